@@ -0,0 +1,65 @@
+"""
+Scaling benchmark for bucketing elements into outline chapters.
+
+For synthetic outlines of growing size (elements per chapter held constant,
+so total elements grow with the outline), compares the previous per-chapter
+rescan against `group_elements_by_chapter`. The rescan grows quadratically;
+the page index grows linearly.
+
+    python -m benchmarks.bench_chapter_grouping --sizes 50 100 200 400
+"""
+import argparse
+import sys
+import time
+
+from src.build_ast import group_elements_by_chapter, outline_to_ranges
+from src.elements import Element, label_code
+
+
+def synthetic_document(chapters, pages_per_chapter=10, elements_per_page=40):
+    total_pages = chapters * pages_per_chapter
+    outline = [[1, f"Chapter {i + 1}", i * pages_per_chapter + 1] for i in range(chapters)]
+    paragraph = label_code("paragraph")
+    elements = [
+        Element(page, i, "", type_code=paragraph)
+        for page in range(1, total_pages + 1)
+        for i in range(elements_per_page)
+    ]
+    return outline, elements, total_pages
+
+
+def rescan_grouping(elements, chapter_ranges):
+    # The previous approach: one full pass over all elements per chapter
+    return [
+        [el for el in elements if start < el.page <= end + 1]
+        for _, start, end in chapter_ranges
+    ]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 100, 200, 400])
+    parser.add_argument("--elements-per-page", type=int, default=40)
+    args = parser.parse_args()
+
+    print(f"{'chapters':>8} {'elements':>9} {'rescan (s)':>11} {'indexed (s)':>12} {'speedup':>8}")
+    for size in args.sizes:
+        outline, elements, total_pages = synthetic_document(size, elements_per_page=args.elements_per_page)
+        _, chapter_ranges = outline_to_ranges(outline, total_pages)
+        old, old_time = timed(rescan_grouping, elements, chapter_ranges)
+        new, new_time = timed(group_elements_by_chapter, elements, chapter_ranges)
+        if old != new:
+            print(f"MISMATCH at {size} chapters")
+            return 1
+        print(f"{size:>8} {len(elements):>9} {old_time:>11.3f} {new_time:>12.4f} {old_time / new_time:>7.0f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Memory held per span by predicted elements: the previous dict records
+against the slotted `Element`.
+
+Builds classified span elements from synthetic page records, the way
+prediction does, and measures with tracemalloc what they keep alive once
+the page records are gone (texts, boxes and sizes included). The same is
+measured for elements loaded from predicted_layout.jsonl, as build_ast does.
+
+    python -m benchmarks.bench_element_memory --spans 1000000
+"""
+import argparse
+import gc
+import json
+import random
+import sys
+import tracemalloc
+
+from src.elements import Element
+from src.predict_layout import group_runs, iter_page_elements
+
+WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do"]
+FONTS = ["Helvetica", "Times-Roman", "Times-Bold"]
+
+
+def synthetic_pages(spans, spans_per_page=40, seed=0):
+    """Page records shaped like `RawExtraction.page`, generated one page at a time."""
+    rng = random.Random(seed)
+    for page_index in range(-(-spans // spans_per_page)):
+        runs = []
+        for i in range(min(spans_per_page, spans - page_index * spans_per_page)):
+            y = 72.0 + i * 17.5 + rng.random()
+            runs.append({
+                "text": " ".join(rng.choices(WORDS, k=rng.randint(3, 12))),
+                "font": FONTS[i % len(FONTS)],
+                "size": rng.choice([10.0, 11.0, 14.0]) + rng.random() / 100,
+                "flags": 0,
+                "bbox": [72.0 + rng.random(), y, 500.0 + rng.random(), y + 12.0],
+                "block": i // 5,
+                "line": i % 5,
+            })
+        yield {"type": "page", "meta": {"number": page_index + 1, "width": 595.0, "height": 842.0, "rotation": 0},
+               "text_runs": runs, "images": []}
+
+
+def legacy_elements(pages, doc_name="synthetic.pdf"):
+    # The dict records prediction produced before, after the label was set and the page fields removed
+    index = 0
+    for page_data in pages:
+        meta = page_data["meta"]
+        for unit in group_runs(page_data["text_runs"]):
+            element = {
+                "id": f"p{meta['number']}_b{index}", "type": "", "text": unit["text"], "bbox": unit["bbox"],
+                "font": unit["font"], "size": unit["size"], "bold": unit["bold"], "spans": unit["spans"],
+                "granularity": "span", "page_width": meta["width"], "page_height": meta["height"],
+                "doc_name": doc_name,
+            }
+            element["type"] = "paragraph"
+            del element["page_width"], element["page_height"], element["doc_name"]
+            yield element
+            index += 1
+
+
+def slotted_elements(pages):
+    for element in iter_page_elements(pages):
+        element.type = "paragraph"
+        yield element
+
+
+def retained_bytes(build):
+    """Bytes still allocated after `build()` returns, and the number of items it built."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = build()
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return retained, len(items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spans", type=int, default=200_000)
+    parser.add_argument("--output", default=None, help="Also write the results as JSON here.")
+    args = parser.parse_args()
+
+    # JSONL lines as predict_layout writes them, for the load measurements
+    lines = [json.dumps(el.to_dict()) for el in slotted_elements(synthetic_pages(args.spans))]
+    cases = {
+        "predicted, dict": lambda: list(legacy_elements(synthetic_pages(args.spans))),
+        "predicted, Element": lambda: list(slotted_elements(synthetic_pages(args.spans))),
+        "loaded, dict": lambda: [json.loads(line) for line in lines],
+        "loaded, Element": lambda: [Element.from_dict(json.loads(line)) for line in lines],
+    }
+
+    results = {}
+    for name, build in cases.items():
+        retained, n = retained_bytes(build)
+        results[name] = round(retained / n, 1)
+        print(f"{name:<20} {retained / n:8.1f} bytes/span  ({retained / 1e6:.1f} MB for {n} spans)")
+    for stage in ("predicted", "loaded"):
+        old, new = results[f"{stage}, dict"], results[f"{stage}, Element"]
+        print(f"{stage}: {old - new:.0f} bytes/span saved, {old / new:.2f}x smaller")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"spans": args.spans, "bytes_per_span": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""
+Measures the cost of extraction logging.
+
+Runs `extract_with_pymupdf` over the same PDF twice: once at TRACE level,
+which reproduces the old one-line-per-span output, and once at the default
+INFO level with rate-limited page summaries. Log output goes to a real file
+so the comparison includes the write cost a log pipeline would see.
+
+    python -m benchmarks.bench_logging --pdf path/to/book.pdf
+"""
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+from src import config
+from src.ingest_extract import extract_with_pymupdf
+from src.log import setup_logging
+
+
+def run_extraction(pdf_path, level, log_path):
+    with open(log_path, "w", encoding="utf-8") as log_file, contextlib.redirect_stderr(log_file):
+        setup_logging(level)
+        start = time.perf_counter()
+        pages = sum(1 for item in extract_with_pymupdf(pdf_path) if item.get("type") == "page")
+        elapsed = time.perf_counter() - start
+    return pages, elapsed, os.path.getsize(log_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", default=str(config.PDF_PATH))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config.OUTPUT_DIR = tmp
+        log_path = os.path.join(tmp, "extract.log")
+        results = {}
+        for level in ("TRACE", "INFO"):
+            runs = [run_extraction(args.pdf, level, log_path) for _ in range(args.repeat)]
+            pages, best, log_bytes = min(runs, key=lambda r: r[1])
+            results[level] = best
+            print(f"{level:>5}: {pages} pages in {best:.3f}s ({pages / best:.1f} pages/s), {log_bytes} bytes of log")
+
+    print(f"Speedup with per-span tracing off: {results['TRACE'] / results['INFO']:.2f}x")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""
+Throughput of paragraph merging on a large synthetic chapter.
+
+Compares the previous concatenation loop with `merge_paragraphs` on a
+chapter made of long paragraphs (hundreds of spans each) separated by
+headings, checks that the merged texts match, and reports spans per second.
+
+    python -m benchmarks.bench_paragraph_merge --spans 300000 --paragraph-spans 600
+"""
+import argparse
+import sys
+import time
+
+from src.build_ast import merge_paragraphs
+from src.elements import Element
+
+
+def synthetic_chapter(spans, paragraph_spans, spans_per_page=40):
+    elements = []
+    for i in range(spans):
+        is_heading = i % (paragraph_spans + 1) == 0
+        element = Element(i // spans_per_page + 1, i,
+                          "Section heading" if is_heading else f"span {i} of some running body text,")
+        element.type = "heading_2" if is_heading else "paragraph"
+        elements.append(element)
+    return elements
+
+
+def legacy_merge(chapter_elements):
+    # The previous loop: grows the paragraph string one span at a time
+    merged_elements = []
+    current_paragraph = ""
+    for i, el in enumerate(chapter_elements):
+        is_last_element = i == len(chapter_elements) - 1
+        next_el_is_paragraph = not is_last_element and chapter_elements[i + 1].type == "paragraph"
+        if el.type == "paragraph":
+            current_paragraph += el.text + " "
+            if not next_el_is_paragraph or is_last_element:
+                merged = Element(el.page, el.index, current_paragraph.strip())
+                merged.type = "paragraph"
+                merged_elements.append(merged)
+                current_paragraph = ""
+        else:
+            merged_elements.append(el)
+    return merged_elements
+
+
+def timed(func, elements, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(elements)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spans", type=int, default=300_000)
+    parser.add_argument("--paragraph-spans", type=int, default=600)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    elements = synthetic_chapter(args.spans, args.paragraph_spans)
+    old, old_time = timed(legacy_merge, elements, args.repeat)
+    new, new_time = timed(merge_paragraphs, elements, args.repeat)
+
+    if [el.text for el in old] != [el.text for el in new]:
+        print("MISMATCH in merged text")
+        return 1
+
+    n = len(elements)
+    print(f"{n} spans, {sum(el.type == 'paragraph' for el in new)} merged paragraphs")
+    print(f"legacy loop:      {n / old_time:>12,.0f} spans/s ({old_time:.3f}s)")
+    print(f"merge_paragraphs: {n / new_time:>12,.0f} spans/s ({new_time:.3f}s)")
+    print(f"speedup: {old_time / new_time:.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
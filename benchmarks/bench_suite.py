@@ -0,0 +1,323 @@
+"""
+End-to-end benchmark over synthetic and real PDFs, for comparing two commits.
+
+For each document size it generates a PDF with `benchmarks.synthetic`,
+and it takes any PDFs given with --pdf as they are; on each document it
+then times every stage on its own (extract, predict, build_ast,
+generate_epub) and the in-memory pipeline as a whole. Each measurement runs
+in a fresh process so that peak memory belongs to that run alone; inputs
+for the later stages are prepared once up front and loaded before the
+clock starts. Unless --model is given, a small model is trained
+on a separate synthetic document, so no network or sample data is needed.
+
+Results are written as JSON. Pass an earlier results file with --compare
+to print the throughput and memory change per stage:
+
+    python -m benchmarks.bench_suite --pages 50 200 --output before.json
+    git checkout my-branch
+    python -m benchmarks.bench_suite --pages 50 200 --output after.json --compare before.json
+    python -m benchmarks.bench_suite --pdf books/*.pdf --model data/models/layout_pipeline.joblib
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from pathlib import Path
+
+from benchmarks.synthetic import generate_pdf
+from src import config
+
+STAGES = ["extract", "predict", "build_ast", "generate_epub", "pipeline"]
+
+
+def _memory_mb(field):
+    """
+    Reads VmHWM (peak) or VmRSS (current) from /proc. Unlike ru_maxrss, these
+    are reset when a process execs, so a spawned worker does not inherit the
+    parent's peak.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # No procfs (macOS): ru_maxrss is in bytes there
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024)
+
+
+def _read_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def _configure(work_dir):
+    # Keep template and stage caches out of the repository's output directory
+    config.OUTPUT_DIR = Path(work_dir)
+    config.TEMPLATE_CACHE_DIR = Path(work_dir) / ".jinja_cache"
+    config.CACHE_DIR = Path(work_dir) / ".cache"
+
+
+def measure(stage_name, case_dir, model_path, options):
+    """
+    Runs one stage on the prepared inputs in `case_dir` and returns its wall
+    time, peak RSS and item counts. Meant to run in a fresh worker process.
+    """
+    from src.build_ast import build_ast, page_figure_paths
+    from src.elements import Element
+    from src.font_rules import FontStats, RuleCascade
+    from src.generate_epub import write_book
+    from src.ingest_extract import extract_with_pymupdf
+    from src.log import setup_logging
+    from src.pipeline import convert
+    from src.predict_layout import iter_page_elements, load_model, predict_elements
+    from src.profiling import Profiler, profiling
+    from src.raw_extraction import RawExtraction
+
+    setup_logging("WARNING")
+    case_dir = Path(case_dir)
+    work_dir = Path(tempfile.mkdtemp(dir=case_dir))
+    _configure(work_dir)
+    pdf_path = Path(options["pdf"])
+
+    # Load whatever the stage consumes before the clock starts
+    if stage_name in ("predict", "pipeline"):
+        model = load_model(model_path)
+    if stage_name == "predict":
+        pages = list(RawExtraction(case_dir / config.RAW_EXTRACTION_PATH.name).pages())
+    if stage_name == "build_ast":
+        with open(case_dir / "outline.json", "r", encoding="utf-8") as f:
+            outline = json.load(f)
+        elements = [Element.from_dict(record) for record in _read_jsonl(case_dir / "predicted_layout.jsonl")]
+        raw = RawExtraction(case_dir / config.RAW_EXTRACTION_PATH.name)
+        page_count = raw.page_count
+        figures_by_page = {number: page_figure_paths(images) for number, images in enumerate(raw.images, 1)}
+    if stage_name == "generate_epub":
+        with open(case_dir / "ast.json", "r", encoding="utf-8") as f:
+            ast = json.load(f)
+
+    baseline_rss = _memory_mb("VmRSS")
+    profiler = Profiler()
+    counts = {}
+    start = time.perf_counter()
+    with profiling(profiler):
+        if stage_name == "extract":
+            items = list(extract_with_pymupdf(pdf_path, workers=options["workers"], image_dir=work_dir))
+            pages = [item for item in items if item.get("type") == "page"]
+            counts = {"pages": len(pages), "spans": sum(len(p["text_runs"]) for p in pages)}
+        elif stage_name == "predict":
+            raw = RawExtraction(case_dir / config.RAW_EXTRACTION_PATH.name)
+            cascade = RuleCascade(FontStats.from_extraction(raw), classes=model.classes_) if options["rules"] else None
+            elements = list(predict_elements(iter_page_elements(pages, granularity=options["granularity"]),
+                                             model, options["batch_size"], cascade))
+            counts = {"pages": len(pages), "spans": sum(el.spans for el in elements), "elements": len(elements),
+                      "ruled": cascade.ruled if cascade else 0}
+        elif stage_name == "build_ast":
+            build_ast(outline, elements, page_count, figures_by_page)
+            counts = {"pages": page_count, "spans": sum(el.spans for el in elements), "elements": len(elements)}
+        elif stage_name == "generate_epub":
+            write_book(ast, work_dir / "book.epub", backend=options["backend"])
+            counts = {"chapters": sum(len(ast[k]) for k in ("frontmatter", "chapters", "backmatter"))}
+        elif stage_name == "pipeline":
+            stats = {}
+            convert(pdf_path, work_dir / "book.epub", model=model, workers=options["workers"],
+                    batch_size=options["batch_size"], granularity=options["granularity"], rules=options["rules"],
+                    backend=options["backend"],
+                    pipelined=options["pipelined"], stats=stats, profiler=profiler)
+            counts = {"pages": stats["pages"], "spans": profiler.stages["extract"]["counts"]["spans"],
+                      "elements": stats["elements"], "ruled": stats["ruled"]}
+    seconds = time.perf_counter() - start
+
+    return {
+        "seconds": seconds,
+        "peak_rss_mb": _memory_mb("VmHWM"),
+        "baseline_rss_mb": baseline_rss,
+        "counts": counts,
+        "steps": {name: record["wall"] for name, record in profiler.steps.items()},
+    }
+
+
+def in_fresh_process(fn, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(fn, *args).result()
+
+
+def prepare_inputs(case_dir, model_path, options):
+    """Runs the pipeline once, keeping the stage artifacts the stage benchmarks start from."""
+    from src.pipeline import convert
+    from src.predict_layout import load_model
+
+    _configure(case_dir)
+    convert(options["pdf"], case_dir / "book.epub", model=load_model(model_path),
+            batch_size=options["batch_size"], granularity=options["granularity"], rules=options["rules"],
+            intermediates_dir=case_dir)
+
+
+def train_model(model_dir, seed):
+    """Trains a throwaway model on a synthetic document, as train_layout_model would on real labels."""
+    from src import train_layout_model
+    from src.log import setup_logging
+
+    labels = generate_pdf(model_dir / "train.pdf", pages=40, spans_per_page=20, outline_depth=3, seed=seed)
+    config.LABELED_DATA_PATH = model_dir / "labels.json"
+    config.LAYOUT_MODEL_PATH = model_dir / "layout_pipeline.joblib"
+    config.CACHE_DIR = model_dir / ".cache"
+    with open(config.LABELED_DATA_PATH, "w", encoding="utf-8") as f:
+        json.dump(labels, f)
+    train_layout_model.main(["--log-level", "WARNING"])
+    return config.LAYOUT_MODEL_PATH
+
+
+def summarize_runs(runs):
+    """Keeps the fastest run's timings and the highest peak memory across runs."""
+    best = min(runs, key=lambda r: r["seconds"])
+    result = {
+        "seconds": round(best["seconds"], 4),
+        "peak_rss_mb": round(max(r["peak_rss_mb"] for r in runs), 1),
+        "rss_growth_mb": round(max(r["peak_rss_mb"] - r["baseline_rss_mb"] for r in runs), 1),
+        "counts": best["counts"],
+        "steps": {name: round(seconds, 4) for name, seconds in best["steps"].items()},
+    }
+    for key in ("pages", "spans", "chapters"):
+        if key in best["counts"]:
+            result[f"{key}_per_second"] = round(best["counts"][key] / best["seconds"], 1)
+    return result
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=Path(__file__).resolve().parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import fitz, numpy, sklearn
+    return {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "pymupdf": fitz.VersionBind,
+        "numpy": numpy.__version__,
+        "sklearn": sklearn.__version__,
+    }
+
+
+def compare(results, baseline):
+    """Prints throughput and peak memory against an earlier results file."""
+    print(f"\nCompared with {baseline['environment'].get('commit')} ({baseline['environment'].get('timestamp')}):")
+    for case, stages in results["cases"].items():
+        old_stages = baseline["cases"].get(case)
+        if old_stages is None:
+            print(f"  {case}: not in baseline")
+            continue
+        for stage_name, new in stages.items():
+            old = old_stages.get(stage_name)
+            if old is None:
+                continue
+            speedup = old["seconds"] / new["seconds"] if new["seconds"] else float("inf")
+            memory = new["peak_rss_mb"] - old["peak_rss_mb"]
+            print(f"  {case:<28} {stage_name:<14} {speedup:5.2f}x faster  {memory:+7.1f} MB peak")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=None,
+                        help="Synthetic document sizes to run (default 50 and 200, or none when --pdf is given).")
+    parser.add_argument("--pdf", nargs="+", default=[], metavar="PATH", help="Real PDFs to run the same stages on.")
+    parser.add_argument("--spans-per-page", type=int, default=30)
+    parser.add_argument("--images-per-page", type=int, default=1)
+    parser.add_argument("--outline-depth", type=int, default=2)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement; the fastest is kept.")
+    parser.add_argument("--workers", type=int, default=1, help="Extraction processes.")
+    parser.add_argument("--batch-size", type=int, default=config.PREDICTION_BATCH_SIZE)
+    parser.add_argument("--granularity", choices=["span", "line", "block"], default=config.CLASSIFY_GRANULARITY)
+    parser.add_argument("--backend", choices=["ebooklib", "stream"], default=config.EPUB_BACKEND)
+    parser.add_argument("--pipelined", action="store_true", help="Run the pipeline stage in pipelined mode.")
+    parser.add_argument("--no-rules", dest="rules", action="store_false",
+                        help="Classify every element with the model, without the font rule cascade.")
+    parser.add_argument("--model", default=None, help="Layout model to use instead of a synthetic one.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results.")
+    parser.add_argument("--compare", default=None, help="Earlier results JSON to compare against.")
+    args = parser.parse_args()
+
+    from src.log import setup_logging
+    setup_logging("WARNING")
+    options = {
+        "workers": args.workers,
+        "batch_size": args.batch_size,
+        "granularity": args.granularity,
+        "rules": args.rules,
+        "backend": args.backend,
+        "pipelined": args.pipelined,
+    }
+    results = {
+        "environment": environment(),
+        "parameters": dict(vars(args), output=None, compare=None),
+        "cases": {},
+    }
+
+    with tempfile.TemporaryDirectory(prefix="pdf2epub-bench-") as tmp:
+        tmp = Path(tmp)
+        if args.model:
+            model_path = args.model
+        else:
+            print("Training a model on a synthetic document...")
+            model_path = train_model(tmp, args.seed + 1)
+
+        cases = []  # (case name, case directory, PDF)
+        for pages in args.pages if args.pages is not None else ([] if args.pdf else [50, 200]):
+            case = f"{pages}p_{args.spans_per_page}s_{args.images_per_page}i_d{args.outline_depth}"
+            (tmp / case).mkdir()
+            generate_pdf(tmp / case / "synthetic.pdf", pages, args.spans_per_page, args.images_per_page,
+                         args.outline_depth, args.seed)
+            cases.append((case, tmp / case, tmp / case / "synthetic.pdf"))
+        for i, pdf in enumerate(args.pdf):
+            case = f"pdf_{Path(pdf).stem}"
+            if any(case == name for name, _, _ in cases):
+                case = f"{case}_{i}"
+            (tmp / case).mkdir()
+            cases.append((case, tmp / case, Path(pdf).resolve()))
+
+        for case, case_dir, pdf in cases:
+            case_options = dict(options, pdf=str(pdf))
+            prepare_inputs(case_dir, model_path, case_options)
+
+            results["cases"][case] = {}
+            for stage_name in args.stages:
+                runs = [in_fresh_process(measure, stage_name, str(case_dir), model_path, case_options)
+                        for _ in range(args.repeat)]
+                summary = summarize_runs(runs)
+                results["cases"][case][stage_name] = summary
+                rates = ", ".join(f"{summary[k]} {k.replace('_per_second', '')}/s"
+                                  for k in ("pages_per_second", "spans_per_second", "chapters_per_second")
+                                  if k in summary)
+                # Only the stages that classify report how many elements the rules labeled
+                share = ""
+                if "ruled" in summary["counts"] and summary["counts"].get("elements"):
+                    share = f"  {summary['counts']['ruled'] / summary['counts']['elements']:.0%} by rules"
+                print(f"{case:<28} {stage_name:<14} {summary['seconds']:8.3f}s  {rates}  "
+                      f"peak {summary['peak_rss_mb']} MB (+{summary['rss_growth_mb']}){share}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
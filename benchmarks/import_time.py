@@ -0,0 +1,97 @@
+"""
+Import-time budget check for the CLI entry points.
+
+Imports each module in a fresh interpreter with `python -X importtime`,
+keeps the fastest of a few runs, and fails (exit status 1) if a module
+takes longer than its budget or pulls in a heavy dependency it should
+only load lazily, such as pandas or scikit-learn from a stage that never
+touches the model. Wall-clock budgets depend on the machine; the
+forbidden-module checks do not, and catch most regressions on their own.
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --scale 2 --output imports.json   # slower machine
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+# Module -> (budget in ms, top-level packages it must not import)
+BUDGETS = {
+    "src.__main__": (50, {"numpy", "pandas", "sklearn", "joblib", "fitz", "jinja2", "ebooklib"}),
+    "src.build_ast": (80, {"numpy", "pandas", "sklearn", "joblib", "fitz", "jinja2", "ebooklib"}),
+    "src.generate_epub": (250, {"numpy", "pandas", "sklearn", "joblib", "fitz", "ebooklib"}),
+    "src.ingest_extract": (350, {"pandas", "sklearn", "joblib", "jinja2", "ebooklib"}),
+    "src.process_figures": (350, {"pandas", "sklearn", "joblib", "jinja2", "ebooklib"}),
+    "src.predict_layout": (300, {"pandas", "sklearn", "joblib", "fitz", "jinja2", "ebooklib"}),
+    "src.pipeline": (600, {"pandas", "sklearn", "joblib", "ebooklib"}),
+}
+
+
+def measure_import(module, python=sys.executable):
+    """
+    Imports `module` in a fresh interpreter.
+
+    Returns:
+        (cumulative import time of `module` in ms, set of top-level packages imported)
+    """
+    result = subprocess.run([python, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, check=True)
+    total_us = None
+    packages = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue  # The header line
+        name = name.strip()
+        packages.add(name.split(".")[0])
+        if name == module:
+            total_us = int(cumulative)
+    return (total_us or 0) / 1000, packages
+
+
+def check(modules, repeat=3, scale=1.0):
+    """Measures each module and returns one result dict per module."""
+    results = []
+    for module in modules:
+        budget_ms, forbidden = BUDGETS[module]
+        runs = [measure_import(module) for _ in range(repeat)]
+        ms = min(run[0] for run in runs)
+        loaded = sorted(forbidden & runs[0][1])
+        results.append({
+            "module": module,
+            "ms": round(ms, 1),
+            "budget_ms": round(budget_ms * scale, 1),
+            "forbidden_imports": loaded,
+            "ok": ms <= budget_ms * scale and not loaded,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=list(BUDGETS),
+                        help=f"Modules to check (default: all of {', '.join(BUDGETS)}).")
+    parser.add_argument("--repeat", type=int, default=3, help="Imports per module; the fastest is kept.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply every time budget by this factor.")
+    parser.add_argument("--output", default=None, help="Also write the results as JSON here.")
+    args = parser.parse_args()
+    unknown = [m for m in args.modules if m not in BUDGETS]
+    if unknown:
+        parser.error(f"no budget for {', '.join(unknown)}")
+
+    results = check(args.modules, args.repeat, args.scale)
+    for r in results:
+        status = "ok" if r["ok"] else "FAIL"
+        extra = f"  imports {', '.join(r['forbidden_imports'])}" if r["forbidden_imports"] else ""
+        print(f"{r['module']:<22} {r['ms']:8.1f} ms  (budget {r['budget_ms']:.0f} ms)  {status}{extra}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0 if all(r["ok"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
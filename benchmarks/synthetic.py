@@ -0,0 +1,139 @@
+"""
+Generates synthetic PDFs with PyMuPDF for benchmarking, without any
+network access or sample documents.
+
+Each page gets a running header, a page number, a number of body text
+spans and optionally images; chapters start every few pages and carry an
+outline entry, with nested section entries down to the requested depth.
+The generator also returns ground-truth labels in the layout of
+`config.LABELED_DATA_PATH`, so a throwaway model can be trained on the
+same kind of document it is benchmarked on.
+
+    python -m benchmarks.synthetic out.pdf --pages 200 --spans-per-page 40
+"""
+import argparse
+import json
+import random
+import sys
+
+import fitz
+
+WORDS = [
+    "the", "of", "revolution", "Party", "economic", "PLANNING", "village", "Mao's",
+    "1949", "reform", "Économie", "production", "state", "labour", "—", "committee",
+]
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+MARGIN = 72
+LINE_HEIGHT = 14
+PAGES_PER_CHAPTER = 5
+
+
+def _sentence(rng, words=10):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def _solid_pixmap(width, height, color):
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, width, height), 0)
+    pix.set_rect(pix.irect, color)
+    return pix
+
+
+def generate_pdf(path, pages=50, spans_per_page=20, images_per_page=1, outline_depth=2, seed=0):
+    """
+    Writes a synthetic PDF and returns its labeled elements.
+
+    Args:
+        path: Where to save the PDF.
+        pages: Number of pages.
+        spans_per_page: Body text lines per page (each line is one span).
+        images_per_page: Images per page. The first one on every page is the
+                         same logo, as in real books; the others are unique.
+        outline_depth: Outline levels: 1 for chapters only, 2 adds sections,
+                       3 adds subsections, and so on.
+        seed: Seed for the text content.
+
+    Returns:
+        Ground-truth labels as {doc name: {"document_analysis": {"pages": [...]}}}.
+    """
+    rng = random.Random(seed)
+    doc = fitz.open()
+    logo = _solid_pixmap(32, 32, (200, 10, 10))
+    toc = []
+    labeled_pages = []
+    for page_index in range(pages):
+        page_num = page_index + 1
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        elements = []
+
+        def put(text, x, y, size, label, font="helv"):
+            page.insert_text((x, y), text, fontsize=size, fontname=font)
+            elements.append({
+                "id": f"p{page_num}_{len(elements)}",
+                "type": label,
+                "text": text,
+                "bbox": [x, y - size, x + len(text) * size * 0.5, y + size * 0.25],
+                "font": font,
+                "size": size,
+                "bold": 1.0 if font == "tibo" else 0.0,
+                "spans": 1,
+            })
+
+        put("A SYNTHETIC HISTORY", 220, 36, 8, "running_header")
+        y = 90
+        chapter, offset = divmod(page_index, PAGES_PER_CHAPTER)
+        if offset == 0:
+            title = f"Chapter {chapter + 1}"
+            put(title, MARGIN, y, 22, "heading_1", "tibo")
+            toc.append([1, title, page_num])
+            y += 40
+        # Deeper outline levels start on the following pages of the chapter
+        elif offset < outline_depth:
+            title = f"Section {chapter + 1}.{offset}"
+            put(title, MARGIN, y, 14, "sub_heading", "tibo")
+            toc.append([offset + 1, title, page_num])
+            y += 26
+
+        # Dense pages get a smaller line height and font so every span still fits
+        body_bottom = PAGE_HEIGHT - 60 - (110 if images_per_page > 1 else 0)
+        line_height = min(LINE_HEIGHT, (body_bottom - y) / max(1, spans_per_page))
+        for _ in range(spans_per_page):
+            put(_sentence(rng), MARGIN, y, line_height * 0.7, "paragraph")
+            y += line_height
+
+        if images_per_page > 0:
+            page.insert_image(fitz.Rect(500, 780, 532, 812), pixmap=logo)
+        for i in range(1, images_per_page):
+            color = ((page_index * 7) % 256, (i * 53) % 256, (page_index * 13 + i) % 256)
+            x = MARGIN + (i - 1) % 4 * 110
+            page.insert_image(fitz.Rect(x, 690, x + 100, 770), pixmap=_solid_pixmap(64, 48, color))
+
+        put(str(page_num), PAGE_WIDTH / 2, 822, 9, "page_number")
+        labeled_pages.append({"elements": elements})
+
+    doc.set_toc(toc)
+    doc.save(path, garbage=1)
+    doc.close()
+    return {"synthetic.pdf": {"document_analysis": {"pages": labeled_pages}}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output", help="PDF path to write.")
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--spans-per-page", type=int, default=20)
+    parser.add_argument("--images-per-page", type=int, default=1)
+    parser.add_argument("--outline-depth", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--labels", default=None, help="Also write the ground-truth labels as JSON here.")
+    args = parser.parse_args()
+
+    labels = generate_pdf(args.output, args.pages, args.spans_per_page, args.images_per_page,
+                          args.outline_depth, args.seed)
+    if args.labels:
+        with open(args.labels, "w", encoding="utf-8") as f:
+            json.dump(labels, f, ensure_ascii=False)
+    print(f"Wrote {args.pages} pages to {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
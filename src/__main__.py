@@ -0,0 +1,75 @@
+"""
+Single entry point for the converter's stages and tools:
+
+    python -m src extract [options]     # PDF -> raw_extraction/ and outline.json
+    python -m src predict [options]     # -> predicted_layout.jsonl
+    python -m src ast [options]         # -> ast.json
+    python -m src figures [options]     # -> figures.json
+    python -m src epub [options]        # -> book.epub
+    python -m src all [--force]         # the five stages above, in one process
+    python -m src convert book.pdf      # in-memory pipeline (src/pipeline.py)
+    python -m src batch run input/      # many PDFs (src/batch.py)
+    python -m src train [options]       # train the layout model
+
+Each command imports only its own module, so heavy dependencies (pandas,
+scikit-learn, PyMuPDF, ebooklib) are loaded only by the stages that use
+them. Run `python -m src <command> --help` for a command's options.
+"""
+import sys
+import argparse
+import importlib
+
+# Command -> (module, profiler stage name)
+COMMANDS = {
+    "extract": ("src.ingest_extract", "extract"),
+    "predict": ("src.predict_layout", "predict"),
+    "ast": ("src.build_ast", "build_ast"),
+    "figures": ("src.process_figures", "figures"),
+    "epub": ("src.generate_epub", "generate_epub"),
+    "convert": ("src.pipeline", None),
+    "batch": ("src.batch", None),
+    "train": ("src.train_layout_model", None),
+}
+# Stages run by `all`, in order
+FILE_STAGES = ["extract", "predict", "ast", "figures", "epub"]
+
+
+def run_all(argv):
+    """Runs every file-based stage in one interpreter, so imports and startup are paid once."""
+    from src.log import add_logging_args, setup_logging
+    from src.profiling import add_profiling_args, profile_run, stage
+
+    parser = argparse.ArgumentParser(prog="python -m src all", description="Run every stage in order.")
+    parser.add_argument("--force", action="store_true", help="Re-run every stage even if its inputs are unchanged.")
+    add_logging_args(parser)
+    add_profiling_args(parser)
+    args = parser.parse_args(argv)
+    setup_logging(args.log_level, args.log_json)
+
+    with profile_run(args):
+        for command in FILE_STAGES:
+            module_name, stage_name = COMMANDS[command]
+            module = importlib.import_module(module_name)
+            stage_args = module.parse_args(["--force"] if args.force else [])
+            with stage(stage_name):
+                module.run(stage_args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m src", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("command", choices=[*COMMANDS, "all"])
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="Options for the command.")
+    args = parser.parse_args(argv)
+
+    # Stage parsers take their program name from argv[0]
+    sys.argv[0] = f"python -m src {args.command}"
+    if args.command == "all":
+        return run_all(args.args)
+    module = importlib.import_module(COMMANDS[args.command][0])
+    return module.main(args.args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,385 @@
+import os
+import sys
+import json
+import time
+import uuid
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src import config
+from src.log import add_logging_args, get_logger, logging_settings, setup_logging
+from src.pipeline import convert
+from src.predict_layout import GRANULARITIES, load_model
+from src.profiling import Profiler
+
+log = get_logger("batch")
+
+# Layout model loaded once per worker process by _init_worker
+_worker_model = None
+_worker_options = {}
+
+
+def discover_pdfs(source):
+    """
+    Lists the PDFs to convert from a directory (searched recursively) or a
+    manifest file: either a JSON list of paths or one path per line. Relative
+    manifest entries are resolved against the manifest's directory.
+    """
+    source = Path(source)
+    if source.is_dir():
+        return sorted(p for p in source.rglob("*") if p.suffix.lower() == ".pdf")
+
+    with open(source, "r", encoding="utf-8") as f:
+        text = f.read()
+    if source.suffix.lower() == ".json":
+        entries = json.loads(text)
+    else:
+        entries = [line.strip() for line in text.splitlines() if line.strip() and not line.startswith("#")]
+    return [p if p.is_absolute() else source.parent / p for p in map(Path, entries)]
+
+
+def document_output_dir(output_root, pdf_path, input_root=None):
+    """
+    The output directory of one document: its path relative to
+    `input_root` (the scanned directory or the manifest's directory) without
+    the suffix, so "x/book.pdf" and "y/book.pdf" do not collide. PDFs outside
+    `input_root`, or converted without one, get their stem and a short hash
+    of their full path instead.
+    """
+    pdf_path = Path(pdf_path).resolve()
+    if input_root is not None:
+        try:
+            return Path(output_root) / pdf_path.relative_to(Path(input_root).resolve()).with_suffix("")
+        except ValueError:
+            pass
+    digest = hashlib.sha1(str(pdf_path).encode("utf-8")).hexdigest()[:8]
+    return Path(output_root) / f"{pdf_path.stem}-{digest}"
+
+
+def check_model():
+    """Loads the layout model once, returning None if it is usable or the error message if not."""
+    try:
+        load_model()
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+def failed_result(pdf_path, error):
+    """The result of a document whose conversion never ran or whose worker died."""
+    return {"pdf": str(pdf_path), "epub": None, "status": "failed", "error": error, "seconds": 0.0}
+
+
+def _init_worker(log_settings, options):
+    global _worker_model, _worker_options
+    setup_logging(*log_settings)
+    _worker_model = load_model()
+    _worker_options = options
+
+
+def convert_document(pdf_path, output_root, input_root=None):
+    """
+    Converts one PDF into its directory under `output_root` (see
+    `document_output_dir`), using the model loaded by the worker
+    initializer. Never raises: failures are reported in the returned result
+    so one bad document does not stop the batch.
+    """
+    out_dir = document_output_dir(output_root, pdf_path, input_root)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    epub_path = out_dir / f"{Path(pdf_path).stem}.epub"
+    stats = {}
+    profiler = Profiler()
+    result = {"pdf": str(pdf_path), "epub": None, "status": "failed", "error": None}
+    start = time.perf_counter()
+    try:
+        model = _worker_model if _worker_model is not None else load_model()
+        intermediates_dir = out_dir / "intermediates" if _worker_options.get("keep_intermediates") else None
+        produced = convert(
+            pdf_path,
+            epub_path,
+            model=model,
+            workers=_worker_options.get("workers", 1),
+            batch_size=_worker_options.get("batch_size"),
+            granularity=_worker_options.get("granularity"),
+            rules=_worker_options.get("rules"),
+            backend=_worker_options.get("backend"),
+            intermediates_dir=intermediates_dir,
+            stats=stats,
+            profiler=profiler,
+        )
+        if produced is None:
+            result["error"] = "no content to package"
+        else:
+            result["status"] = "ok"
+            result["epub"] = str(produced)
+    except Exception as e:
+        log.exception(f"Conversion failed for {pdf_path}")
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    result.update(stats)
+    result["profile"] = profiler.to_dict()
+    return result
+
+
+def summarize(results, wall_seconds, concurrency):
+    """Builds the batch report: throughput, failures and per-stage timings."""
+    ok = [r for r in results if r["status"] == "ok"]
+    stage_totals = {}
+    for r in ok:
+        for stage, seconds in r.get("timings", {}).items():
+            stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+    pages = sum(r.get("pages", 0) for r in ok)
+    return {
+        "documents": len(results),
+        "succeeded": len(ok),
+        "failed": len(results) - len(ok),
+        "concurrency": concurrency,
+        "wall_seconds": round(wall_seconds, 3),
+        "documents_per_minute": round(len(ok) / wall_seconds * 60, 2) if wall_seconds else None,
+        "pages": pages,
+        "pages_per_second": round(pages / wall_seconds, 2) if wall_seconds else None,
+        "stage_seconds": {stage: round(seconds, 3) for stage, seconds in stage_totals.items()},
+        "failures": [{"pdf": r["pdf"], "error": r["error"]} for r in results if r["status"] != "ok"],
+        "results": results,
+    }
+
+
+def make_executor(concurrency, options):
+    return ProcessPoolExecutor(
+        max_workers=concurrency,
+        initializer=_init_worker,
+        initargs=(logging_settings(), options),
+    )
+
+
+def run_batch(pdf_paths, output_root, concurrency=None, options=None, input_root=None):
+    """
+    Converts many PDFs across a process pool and writes
+    `<output_root>/batch_report.json`.
+
+    The model is loaded once in this process before the pool starts; if it
+    cannot be loaded, every document is reported as failed with that error.
+    A worker that dies breaks the pool; the documents not converted by then
+    are reported as failed instead of aborting the batch.
+
+    Args:
+        pdf_paths: PDFs to convert.
+        output_root: Directory receiving one sub-directory per document.
+        concurrency: Documents converted at once (defaults to `config.BATCH_CONCURRENCY`).
+        options: Per-document settings: workers, batch_size, granularity, rules,
+                 backend, keep_intermediates.
+        input_root: Directory the PDFs were found in, which their output
+                    directories mirror (see `document_output_dir`).
+
+    Returns:
+        The report dictionary.
+    """
+    concurrency = concurrency or config.BATCH_CONCURRENCY
+    options = options or {}
+    output_root = Path(output_root)
+    output_root.mkdir(parents=True, exist_ok=True)
+
+    start = time.perf_counter()
+    results = []
+    model_error = check_model()
+    if model_error:
+        log.error(f"Cannot load the layout model, no document converted: {model_error}")
+        results = [failed_result(pdf, f"model: {model_error}") for pdf in pdf_paths]
+    else:
+        log.info(f"Converting {len(pdf_paths)} documents with {concurrency} workers...")
+        with make_executor(concurrency, options) as executor:
+            futures = {executor.submit(convert_document, pdf, output_root, input_root): pdf for pdf in pdf_paths}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # The worker process died (BrokenProcessPool) or its initializer failed
+                    log.error(f"Worker failed on {futures[future]}: {e}")
+                    result = failed_result(futures[future], f"{type(e).__name__}: {e}")
+                results.append(result)
+                log.info(f"[{len(results)}/{len(pdf_paths)}] {result['status']}: {result['pdf']} ({result['seconds']}s)")
+    wall_seconds = time.perf_counter() - start
+
+    results.sort(key=lambda r: r["pdf"])
+    report = summarize(results, wall_seconds, concurrency)
+    report_path = output_root / "batch_report.json"
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    log.info(
+        f"Batch done: {report['succeeded']}/{report['documents']} succeeded in {report['wall_seconds']}s "
+        f"({report['pages_per_second']} pages/s). Report: {report_path}"
+    )
+    return report
+
+
+class JobQueue:
+    """In-process job registry feeding a shared worker pool, used by the HTTP front end."""
+
+    def __init__(self, executor, output_root):
+        self.executor = executor
+        self.output_root = output_root
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, pdf_path):
+        job_id = uuid.uuid4().hex[:12]
+        future = self.executor.submit(convert_document, pdf_path, self.output_root)
+        with self.lock:
+            self.jobs[job_id] = {"id": job_id, "pdf": str(pdf_path), "status": "queued", "future": future}
+        return job_id
+
+    def status(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        future = job["future"]
+        info = {"id": job_id, "pdf": job["pdf"]}
+        if future.done():
+            try:
+                info.update(future.result())
+            except Exception as e:
+                info.update(failed_result(job["pdf"], f"{type(e).__name__}: {e}"))
+        else:
+            info["status"] = "running" if future.running() else "queued"
+        return info
+
+    def list(self):
+        with self.lock:
+            job_ids = list(self.jobs)
+        return [self.status(job_id) for job_id in job_ids]
+
+
+def make_handler(queue):
+    class JobHandler(BaseHTTPRequestHandler):
+        """
+        POST /jobs {"pdf": "/path/to/file.pdf"} queues a conversion;
+        GET /jobs lists jobs and GET /jobs/<id> reports one job's status.
+        """
+
+        def _send(self, code, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/jobs":
+                return self._send(404, {"error": "not found"})
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                pdf_path = json.loads(self.rfile.read(length) or b"{}").get("pdf")
+            except (ValueError, AttributeError):
+                return self._send(400, {"error": "expected a JSON body like {\"pdf\": \"...\"}"})
+            if not pdf_path or not os.path.exists(pdf_path):
+                return self._send(400, {"error": f"PDF not found: {pdf_path}"})
+            self._send(202, {"id": queue.submit(pdf_path)})
+
+        def do_GET(self):
+            path = self.path.rstrip("/")
+            if path == "/jobs":
+                return self._send(200, queue.list())
+            if path.startswith("/jobs/"):
+                info = queue.status(path.rsplit("/", 1)[1])
+                return self._send(200, info) if info else self._send(404, {"error": "unknown job"})
+            self._send(404, {"error": "not found"})
+
+        def log_message(self, format, *args):
+            log.debug(format % args)
+
+    return JobHandler
+
+
+def serve(host, port, output_root, concurrency=None, options=None):
+    """
+    Runs a local HTTP front end that queues conversions onto the worker pool.
+
+    Returns:
+        False if the model cannot be loaded and the server was not started.
+    """
+    concurrency = concurrency or config.BATCH_CONCURRENCY
+    model_error = check_model()
+    if model_error:
+        log.error(f"Cannot load the layout model: {model_error}")
+        return False
+    Path(output_root).mkdir(parents=True, exist_ok=True)
+    with make_executor(concurrency, options or {}) as executor:
+        server = ThreadingHTTPServer((host, port), make_handler(JobQueue(executor, output_root)))
+        log.info(f"Listening on http://{host}:{port} with {concurrency} workers (POST /jobs, GET /jobs/<id>)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    return True
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Convert many PDFs with a pool of workers.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(sub):
+        sub.add_argument("-o", "--output", default=str(config.OUTPUT_DIR / "batch"),
+                         help="Root directory for per-document output directories.")
+        sub.add_argument("-j", "--concurrency", type=int, default=config.BATCH_CONCURRENCY,
+                         help="Documents converted at once (one worker process each).")
+        sub.add_argument("--workers", type=int, default=1, help="Extraction processes per document.")
+        sub.add_argument("--batch-size", type=int, default=config.PREDICTION_BATCH_SIZE,
+                         help="Elements per prediction batch.")
+        sub.add_argument("--granularity", choices=GRANULARITIES, default=config.CLASSIFY_GRANULARITY,
+                         help="Classify single text spans, whole lines or whole PyMuPDF blocks.")
+        sub.add_argument("--no-rules", dest="rules", action="store_false", default=config.RULE_CASCADE,
+                         help="Send every element to the model instead of labeling obvious text by font rules.")
+        sub.add_argument("--backend", choices=["ebooklib", "stream"], default=config.EPUB_BACKEND,
+                         help="EPUB packaging backend.")
+        sub.add_argument("--keep-intermediates", action="store_true",
+                         help="Also write each document's stage artifacts to <output>/<name>/intermediates.")
+        add_logging_args(sub)
+
+    run = subparsers.add_parser("run", help="Convert a directory or manifest of PDFs and write a report.")
+    run.add_argument("source", help="Directory of PDFs, or a manifest (.json list or one path per line).")
+    add_common(run)
+
+    srv = subparsers.add_parser("serve", help="Run a local HTTP front end that queues conversion jobs.")
+    srv.add_argument("--host", default="127.0.0.1")
+    srv.add_argument("--port", type=int, default=8765)
+    add_common(srv)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging(args.log_level, args.log_json)
+    options = {
+        "workers": max(1, args.workers),
+        "batch_size": args.batch_size,
+        "granularity": args.granularity,
+        "rules": args.rules,
+        "backend": args.backend,
+        "keep_intermediates": args.keep_intermediates,
+    }
+
+    if args.command == "serve":
+        if not serve(args.host, args.port, args.output, args.concurrency, options):
+            sys.exit(1)
+        return
+
+    pdf_paths = discover_pdfs(args.source)
+    if not pdf_paths:
+        log.error(f"No PDFs found in {args.source}")
+        sys.exit(1)
+    input_root = args.source if os.path.isdir(args.source) else os.path.dirname(os.path.abspath(args.source))
+    report = run_batch(pdf_paths, args.output, args.concurrency, options, input_root)
+    if report["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,24 @@
 import os
 import json
+import math
+import argparse
+from bisect import bisect_right
 
 from src import config
+from src.cache import StageCache, file_hash, json_hash
+from src.elements import Element, label_code
+from src.log import add_logging_args, get_logger, setup_logging
+from src.profiling import add_profiling_args, count, profile_run, stage, step
+from src.raw_extraction import RawExtraction
+
+log = get_logger("ast")
+
+PARAGRAPH = label_code("paragraph")
+FIGURE = label_code("figure")
+
+# Outline titles that always go to the front or back matter
+FRONTMATTER_TITLES = {"cover", "copyright", "contents"}
+BACKMATTER_TITLES = {"index", "endnotes", "glossary of names", "bibliography"}
 
 # Helper: map outline entries to page ranges
 def outline_to_ranges(outline, total_pages):
@@ -19,21 +36,351 @@ def outline_to_ranges(outline, total_pages):
         chapter_ranges.append((title, start, end))
     return toc, chapter_ranges
 
-def main():
+def group_elements_by_chapter(elements, chapter_ranges):
+    """
+    Buckets elements into the page range of each chapter.
+
+    Elements are indexed by page number once (a stable sort, which is linear
+    for the already page-ordered output of prediction), so each chapter's
+    elements are a slice found by binary search instead of a full rescan.
+
+    Returns:
+        One list of elements per entry in `chapter_ranges`, in the same order.
+    """
+    page_numbers = [el.page for el in elements]
+    if any(a > b for a, b in zip(page_numbers, page_numbers[1:])):
+        order = sorted(range(len(elements)), key=page_numbers.__getitem__)
+        elements = [elements[i] for i in order]
+        page_numbers = [page_numbers[i] for i in order]
+
+    groups = []
+    for _, start, end in chapter_ranges:
+        # page numbers are 1-based, start/end are 0-based: keep start < page <= end + 1
+        lo = bisect_right(page_numbers, start)
+        hi = bisect_right(page_numbers, end + 1)
+        groups.append(elements[lo:hi])
+    return groups
+
+def page_figure_paths(images):
+    """
+    The paths of a page's extracted images (image records as in
+    raw_extraction/images.json) that go into the book as figures; images
+    marked as page furniture are left out.
+    """
+    return [image["path"] for image in images if not image.get("furniture")]
+
+def insert_page_figures(elements, figures_by_page):
+    """
+    Adds a figure element for each extracted image after the elements of
+    its page.
+
+    Extracted images carry no position in the text flow, so a page's
+    figures follow its text. `elements` must arrive in page order.
+    `figures_by_page` maps page numbers to image paths (see
+    `page_figure_paths`); it may still be filled while the elements are
+    streamed, as long as a page's entry is in place before the first
+    element of a later page arrives. Entries are removed once used.
+
+    Figure elements have the "image" granularity and carry the image path
+    as their text.
+    """
+    next_page = 1
+
+    def figures_before(page):
+        nonlocal next_page
+        while next_page < page:
+            for index, path in enumerate(figures_by_page.pop(next_page, ())):
+                yield Element(next_page, index, path, granularity="image", type_code=FIGURE)
+            next_page += 1
+
+    for el in elements:
+        if el.page > next_page:
+            yield from figures_before(el.page)
+        yield el
+    yield from figures_before(max(figures_by_page, default=0) + 1)
+
+def merge_paragraphs(elements):
+    """
+    Merges each run of consecutive "paragraph" elements into one paragraph.
+
+    Runs in a single pass: the texts of a run are collected and joined once
+    when the run ends, so long paragraphs do not pay for repeated string
+    copies. A merged paragraph is a new `Element` on the page of its first
+    run, with the page of its last run as `end_page`. Other elements are
+    passed through unchanged, and so are paragraphs classified as whole
+    PyMuPDF blocks, which are complete paragraphs already. Figures made from
+    extracted images (see `insert_page_figures`) do not end a run: they
+    follow the paragraph they interrupt.
+    """
+    merged_elements = []
+    parts = []
+    held = []  # image figures met inside the current run
+    first = None
+    last_page = None
+
+    def flush():
+        merged_elements.append(Element(first.page, first.index, " ".join(parts).strip(),
+                                       type_code=PARAGRAPH, end_page=last_page))
+        merged_elements.extend(held)
+        parts.clear()
+        held.clear()
+
+    for el in elements:
+        if el.type_code == PARAGRAPH and el.granularity != "block":
+            if not parts:
+                first = el
+            parts.append(el.text)
+            last_page = el.page
+        elif parts and el.granularity == "image":
+            held.append(el)
+        else:
+            if parts:
+                flush()
+            # Add the non-paragraph element directly
+            merged_elements.append(el)
+    if parts:
+        flush()
+    return merged_elements
+
+def transform_elements(merged_elements):
+    """
+    Filters page furniture and maps predicted element types onto AST nodes.
+    """
+    processed_elements = []
+    for el in merged_elements:
+        el_type = el.type
+        
+        # Skip elements that shouldn't be in the main content flow
+        if el_type in ["running_header", "page_number", "header", "footer"]:
+            continue
+        
+        # Map predicted types to a structured AST
+        if el_type == "main_title":
+            processed_elements.append({"type": "heading", "level": 1, "text": el.text, "page_number": el.page})
+
+        elif "heading" in el_type:
+             # e.g., "heading_1" -> 1, "sub_heading" -> 2
+            level = 1
+            if "_" in el_type:
+                try:
+                    level = int(el_type.split('_')[1])
+                except ValueError:
+                    level = 2 # Default for sub_heading etc.
+            elif el_type == "sub_heading":
+                level = 2
+
+            processed_elements.append({"type": "heading", "level": level, "text": el.text, "page_number": el.page})
+        
+        elif el_type == "paragraph":
+            paragraph = {"type": "paragraph", "text": el.text, "page_number": el.page}
+            if el.end_page is not None:
+                paragraph["end_page_number"] = el.end_page
+            processed_elements.append(paragraph)
+        
+        elif el_type == "list_item":
+            # If the previous element was not a list, create a new one
+            if not processed_elements or processed_elements[-1]["type"] != "list":
+                processed_elements.append({"type": "list", "items": [], "ordered": False, "page_number": el.page})
+            # Add the item to the last list
+            processed_elements[-1]["items"].append(el.text)
+
+        elif el_type == "blockquote":
+             processed_elements.append({"type": "blockquote", "text": el.text, "page_number": el.page})
+
+        elif el_type == "figure":
+            # Only figures made from extracted images have a source (see `insert_page_figures`)
+            src = el.text if el.granularity == "image" else None
+            processed_elements.append({"type": "figure", "src": src, "caption": "", "page_number": el.page})
+
+        elif el_type == "caption":
+            # Try to associate with the last figure
+            if processed_elements and processed_elements[-1]["type"] == "figure":
+                processed_elements[-1]["caption"] = el.text
+            else: # Orphan caption, treat as a small paragraph
+                processed_elements.append({"type": "paragraph", "style": "caption", "text": el.text, "page_number": el.page})
+        
+        # Add other mappings from your taxonomy here...
+        else:
+            log.warning(f"Unhandled element type: '{el_type}'. Skipping.")
+    return processed_elements
+
+def section_kind(index, title, section_count):
+    """Whether outline entry `index` belongs to the "frontmatter", "chapters" or "backmatter"."""
+    if index == 0 or title.lower() in FRONTMATTER_TITLES:
+        return "frontmatter"
+    if title.lower() in BACKMATTER_TITLES or index == section_count - 1:
+        return "backmatter"
+    return "chapters"
+
+def spine_order(outline):
+    """Outline indices in the order their sections appear in the book (see `build_ast`)."""
+    kinds = [section_kind(i, entry[1], len(outline)) for i, entry in enumerate(outline)]
+    return [i for kind in ("frontmatter", "chapters", "backmatter") for i, k in enumerate(kinds) if k == kind]
+
+def iter_spine(outline, chapters):
+    """
+    Reorders (outline index, chapter) pairs, as `iter_chapters` yields them,
+    into spine order, yielding each chapter as soon as every section before
+    it in the book has been yielded.
+    """
+    position = {index: p for p, index in enumerate(spine_order(outline))}
+    ready = {}
+    next_position = 0
+    for index, chapter in chapters:
+        ready[position[index]] = chapter
+        while next_position in ready:
+            yield ready.pop(next_position)
+            next_position += 1
+
+def build_chapter(title, chapter_elements):
+    with step("merge"):
+        merged_elements = merge_paragraphs(chapter_elements)
+    with step("transform"):
+        processed_elements = transform_elements(merged_elements)
+    return {
+        "title": title,
+        "elements": processed_elements
+    }
+
+def iter_chapters(outline, elements, figures_by_page=None):
+    """
+    Builds chapters from a stream of predicted elements while it is still
+    being produced, for pipelined conversion.
+
+    `elements` must arrive in page order, as `predict_layout.predict_elements`
+    yields them. A chapter is complete, and is built and yielded, as soon as
+    an element from a page after its outline range arrives; the last one
+    when the stream ends. Elements are only held until every chapter that
+    could contain them has been built. The chapters are the same as those
+    `build_ast` produces from the whole element list. `figures_by_page` is
+    as for `insert_page_figures`.
+
+    Yields:
+        (outline index, chapter) in outline order.
+    """
+    # The last range ends with the document, which is only known at the end of the stream
+    _, chapter_ranges = outline_to_ranges(outline, math.inf)
+    # Lowest start page of the chapters from each index on; older elements can be dropped
+    lowest_start = [math.inf] * (len(chapter_ranges) + 1)
+    for i in range(len(chapter_ranges) - 1, -1, -1):
+        lowest_start[i] = min(chapter_ranges[i][1], lowest_start[i + 1])
+
+    if figures_by_page is not None:
+        elements = insert_page_figures(elements, figures_by_page)
+
+    pending = []       # elements not yet needed by every chapter
+    page_numbers = []  # their pages
+    next_index = 0
+    element_count = 0
+
+    def complete(last_page=None):
+        # Chapters ending before `last_page` can get no more elements; None flushes every chapter
+        nonlocal next_index, pending, page_numbers
+        while next_index < len(chapter_ranges) and (last_page is None or chapter_ranges[next_index][2] + 1 < last_page):
+            title, start, end = chapter_ranges[next_index]
+            chapter_elements = pending[bisect_right(page_numbers, start):bisect_right(page_numbers, end + 1)]
+            yield next_index, build_chapter(title, chapter_elements)
+            next_index += 1
+            cut = bisect_right(page_numbers, lowest_start[next_index])
+            if cut:
+                pending, page_numbers = pending[cut:], page_numbers[cut:]
+
+    for el in elements:
+        element_count += 1
+        if page_numbers and el.page > page_numbers[-1]:
+            yield from complete(el.page)
+        pending.append(el)
+        page_numbers.append(el.page)
+    yield from complete()
+    count("build_ast", elements=element_count, chapters=len(chapter_ranges))
+
+def assemble_ast(outline, chapters, total_pages):
+    """
+    Puts built chapters (one per outline entry, in outline order) into the
+    AST layout: front matter, chapters and back matter.
+    """
+    toc, _ = outline_to_ranges(outline, total_pages)
+    # Heuristic for metadata - we can get some from the raw pages if needed
+    # For now, we'll keep it simple as it wasn't well-defined before.
+    metadata = {
+        "page_size": None, # Could be extracted from raw file if needed
+        "rotation": None,
+        "total_pages": total_pages
+    }
+    sections = {"frontmatter": [], "chapters": [], "backmatter": []}
+    for idx, chapter in enumerate(chapters):
+        sections[section_kind(idx, chapter["title"], len(chapters))].append(chapter)
+
+    # Build final AST
+    return {
+        "metadata": metadata,
+        "toc": toc,
+        **sections,
+        "footnotes": [] # Footnote detection would need a separate model/logic
+    }
+
+def build_ast(outline, elements, total_pages, figures_by_page=None):
+    """
+    Groups predicted elements into front matter, chapters and back matter.
+
+    Args:
+        outline: The PDF outline as [level, title, page_num] entries.
+        elements: Predicted layout `Element`s, in page order.
+        total_pages: Number of pages in the source document.
+        figures_by_page: Extracted image paths by page number, added as
+                         figures after each page's text (see
+                         `insert_page_figures`).
+
+    Returns:
+        The AST as a dictionary, ready to be rendered or serialized.
+    """
+    if figures_by_page is not None:
+        elements = insert_page_figures(elements, figures_by_page)
+    elements = list(elements)
+
+    _, chapter_ranges = outline_to_ranges(outline, total_pages)
+    with step("group"):
+        chapter_groups = group_elements_by_chapter(elements, chapter_ranges)
+    count("build_ast", elements=len(elements), chapters=len(chapter_ranges))
+    chapters = [build_chapter(title, chapter_elements)
+                for (title, _, _), chapter_elements in zip(chapter_ranges, chapter_groups)]
+    return assemble_ast(outline, chapters, total_pages)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build the document AST from the outline and predicted layout.")
+    parser.add_argument("--force", action="store_true", help="Rebuild the AST even if its inputs are unchanged.")
+    add_logging_args(parser)
+    add_profiling_args(parser)
+    return parser.parse_args(argv)
+
+def run(args):
+    cache = StageCache("ast")
+    inputs = {
+        "outline": file_hash(config.OUTLINE_PATH),
+        # Only the page count and the image records are read, not the text runs
+        "raw": json_hash({name: file_hash(config.RAW_EXTRACTION_PATH / name)
+                          for name in ("meta.json", "images.json")}),
+        "predicted": file_hash(config.PREDICTED_LAYOUT_PATH),
+    }
+    outputs = [config.AST_PATH]
+    if cache.skip_if_fresh(inputs, outputs, force=args.force):
+        return
+
     # Load outline and count total pages
     try:
         with open(config.OUTLINE_PATH, "r", encoding="utf-8") as f:
             outline = json.load(f)
     except FileNotFoundError:
-        print(f"[ERROR] Outline file not found at {config.OUTLINE_PATH}. Aborting.")
+        log.error(f"Outline file not found at {config.OUTLINE_PATH}. Aborting.")
         return
         
     try:
-        with open(config.RAW_EXTRACTION_PATH, "r", encoding="utf-8") as f:
-            # We need to count only page entries
-            total_pages = sum(1 for line in f if '"type": "page"' in line)
+        # The page index gives the count without reading any page data
+        raw = RawExtraction(config.RAW_EXTRACTION_PATH)
+        total_pages = raw.page_count
+        figures_by_page = {number: page_figure_paths(images) for number, images in enumerate(raw.images, 1)}
     except FileNotFoundError:
-        print(f"[ERROR] Raw pages file not found at {config.RAW_EXTRACTION_PATH}. Aborting.")
+        log.error(f"Raw pages file not found at {config.RAW_EXTRACTION_PATH}. Aborting.")
         return
 
     # Load predicted layout elements
@@ -41,163 +388,24 @@ def main():
     try:
         with open(config.PREDICTED_LAYOUT_PATH, "r", encoding="utf-8") as f:
             for line in f:
-                elements.append(json.loads(line))
+                elements.append(Element.from_dict(json.loads(line)))
     except FileNotFoundError:
-        print(f"[ERROR] Predicted layout file not found at {config.PREDICTED_LAYOUT_PATH}. Aborting.")
+        log.error(f"Predicted layout file not found at {config.PREDICTED_LAYOUT_PATH}. Aborting.")
         return
 
-    # Assign page numbers to each element from its ID
-    for el in elements:
-        try:
-            # ID is like "p12_b345"
-            el['page_number'] = int(el['id'].split('_')[0][1:])
-        except (ValueError, IndexError):
-            el['page_number'] = 0 # Default if ID is malformed
-            
-    toc, chapter_ranges = outline_to_ranges(outline, total_pages)
-    
-    # Heuristic for metadata - we can get some from the raw pages if needed
-    # For now, we'll keep it simple as it wasn't well-defined before.
-    metadata = {
-        "page_size": None, # Could be extracted from raw file if needed
-        "rotation": None,
-        "total_pages": total_pages
-    }
-    
-    # Group elements into chapters
-    frontmatter = []
-    chapters = []
-    backmatter = []
-    
-    for idx, (title, start, end) in enumerate(chapter_ranges):
-        # page numbers are 1-based, start/end are 0-based
-        chapter_elements = [el for el in elements if start < el.get("page_number", 0) <= end + 1]
-        
-        # Merge consecutive paragraph blocks
-        merged_elements = []
-        current_paragraph = ""
-        for i, el in enumerate(chapter_elements):
-            el_type = el.get("type")
-            
-            is_paragraph = el_type == "paragraph"
-            is_last_element = i == len(chapter_elements) - 1
-            next_el_is_paragraph = not is_last_element and chapter_elements[i+1].get("type") == "paragraph"
-
-            if is_paragraph:
-                # Append text to the current paragraph
-                current_paragraph += el.get("text", "") + " "
-                # If the next element is not a paragraph, or it's the last element,
-                # finalize the current paragraph.
-                if not next_el_is_paragraph or is_last_element:
-                    merged_elements.append({
-                        "type": "paragraph", 
-                        "text": current_paragraph.strip(),
-                        "page_number": el.get("page_number") # Use page number of last run
-                    })
-                    current_paragraph = "" # Reset
-            else:
-                # If there was a pending paragraph, add it first.
-                if current_paragraph:
-                    merged_elements.append({
-                        "type": "paragraph", 
-                        "text": current_paragraph.strip(),
-                         # This page number might be slightly off, but it's an approximation
-                        "page_number": el.get("page_number")
-                    })
-                    current_paragraph = ""
-
-                # Add the non-paragraph element directly
-                merged_elements.append(el)
-        
-        # If the last element was a paragraph, ensure it's added
-        if current_paragraph:
-             merged_elements.append({
-                "type": "paragraph", 
-                "text": current_paragraph.strip(),
-                "page_number": chapter_elements[-1].get("page_number")
-            })
-
-        # Filter and transform elements for the AST
-        processed_elements = []
-        for el in merged_elements:
-            el_type = el.get("type")
-            
-            # Skip elements that shouldn't be in the main content flow
-            if el_type in ["running_header", "page_number", "header", "footer"]:
-                continue
-            
-            # Map predicted types to a structured AST
-            if el_type == "main_title":
-                processed_elements.append({"type": "heading", "level": 1, "text": el.get("text"), "page_number": el.get("page_number")})
-
-            elif "heading" in el_type:
-                 # e.g., "heading_1" -> 1, "sub_heading" -> 2
-                level = 1
-                if "_" in el_type:
-                    try:
-                        level = int(el_type.split('_')[1])
-                    except ValueError:
-                        level = 2 # Default for sub_heading etc.
-                elif el_type == "sub_heading":
-                    level = 2
-
-                processed_elements.append({"type": "heading", "level": level, "text": el.get("text"), "page_number": el.get("page_number")})
-            
-            elif el_type == "paragraph":
-                processed_elements.append({"type": "paragraph", "text": el.get("text"), "page_number": el.get("page_number")})
-            
-            elif el_type == "list_item":
-                # If the previous element was not a list, create a new one
-                if not processed_elements or processed_elements[-1]["type"] != "list":
-                    processed_elements.append({"type": "list", "items": [], "ordered": False, "page_number": el.get("page_number")})
-                # Add the item to the last list
-                processed_elements[-1]["items"].append(el.get("text"))
-
-            elif el_type == "blockquote":
-                 processed_elements.append({"type": "blockquote", "text": el.get("text"), "page_number": el.get("page_number")})
-
-            elif el_type == "figure":
-                processed_elements.append({"type": "figure", "src": el.get("src"), "caption": el.get("caption", ""), "page_number": el.get("page_number")})
-
-            elif el_type == "caption":
-                # Try to associate with the last figure
-                if processed_elements and processed_elements[-1]["type"] == "figure":
-                    processed_elements[-1]["caption"] = el.get("text")
-                else: # Orphan caption, treat as a small paragraph
-                    processed_elements.append({"type": "paragraph", "style": "caption", "text": el.get("text"), "page_number": el.get("page_number")})
-            
-            # Add other mappings from your taxonomy here...
-            else:
-                print(f"[WARN] Unhandled element type: '{el_type}'. Skipping.")
-
-            
-        chapter = {
-            "title": title,
-            "elements": processed_elements
-        }
-        
-        # Assign to frontmatter, backmatter, or chapters
-        if idx == 0 or title.lower() in ["cover", "copyright", "contents"]:
-            frontmatter.append(chapter)
-        elif title.lower() in ["index", "endnotes", "glossary of names", "bibliography"] or idx == len(chapter_ranges) - 1:
-            backmatter.append(chapter)
-        else:
-            chapters.append(chapter)
+    ast = build_ast(outline, elements, total_pages, figures_by_page)
 
-    # Build final AST
-    ast = {
-        "metadata": metadata,
-        "toc": toc,
-        "frontmatter": frontmatter,
-        "chapters": chapters,
-        "backmatter": backmatter,
-        "footnotes": [] # Footnote detection would need a separate model/logic
-    }
-    
     with open(config.AST_PATH, "w", encoding="utf-8") as f:
         json.dump(ast, f, ensure_ascii=False, indent=2)
 
-    print(f"[INFO] Saved AST to {config.AST_PATH}")
+    log.info(f"Saved AST to {config.AST_PATH}")
+    cache.save(inputs, outputs)
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging(args.log_level, args.log_json)
+    with profile_run(args), stage("build_ast"):
+        run(args)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
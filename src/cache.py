@@ -0,0 +1,121 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+
+from src import config
+from src.log import get_logger
+
+log = get_logger("cache")
+
+# Bump to invalidate every stage manifest when stage outputs change format
+CACHE_VERSION = 2
+
+
+def file_hash(path):
+    """SHA-256 of a file's contents (or of a directory's files), or None if it does not exist."""
+    if not path or not os.path.exists(path):
+        return None
+    if os.path.isdir(path):
+        return directory_hash(path)
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def bytes_hash(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def json_hash(obj):
+    """Hash of a JSON-serializable object, independent of key order."""
+    return bytes_hash(json.dumps(obj, sort_keys=True, ensure_ascii=False))
+
+
+def directory_hash(path, pattern="*"):
+    """Combined hash of every file matching `pattern` in a directory."""
+    path = Path(path)
+    if not path.is_dir():
+        return None
+    return json_hash({p.name: file_hash(p) for p in sorted(path.glob(pattern)) if p.is_file()})
+
+
+class StageCache:
+    """
+    Input fingerprints for one pipeline stage.
+
+    A stage records the hashes of its inputs (and the paths of its outputs)
+    in `<cache dir>/<stage>.json` after a successful run. On the next run it
+    can skip itself when the fingerprint is unchanged and its outputs still
+    exist. Stages that can redo part of their work keep finer-grained entries
+    (per page or per chapter) in their own files under `unit_dir`.
+    """
+
+    def __init__(self, stage, cache_dir=None):
+        self.stage = stage
+        self.cache_dir = Path(cache_dir or config.CACHE_DIR)
+        self.manifest_path = self.cache_dir / f"{stage}.json"
+        self.unit_dir = self.cache_dir / stage
+
+    def load(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return manifest if manifest.get("version") == CACHE_VERSION else None
+
+    def is_fresh(self, inputs, outputs):
+        """True if the last run used identical inputs and all its outputs still exist."""
+        manifest = self.load()
+        if manifest is None or manifest.get("inputs") != inputs:
+            return False
+        if sorted(str(p) for p in outputs) != sorted(manifest.get("outputs", [])):
+            return False
+        return all(os.path.exists(p) for p in outputs)
+
+    def save(self, inputs, outputs):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        manifest = {"version": CACHE_VERSION, "inputs": inputs, "outputs": [str(p) for p in outputs]}
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def invalidate(self):
+        if self.manifest_path.exists():
+            self.manifest_path.unlink()
+
+    def skip_if_fresh(self, inputs, outputs, force=False):
+        """Logs and returns True when the stage can be skipped."""
+        if not force and self.is_fresh(inputs, outputs):
+            log.info(f"{self.stage}: inputs unchanged, reusing {', '.join(str(p) for p in outputs)}")
+            return True
+        # Outputs are about to be rewritten; drop the manifest so an interrupted run is never trusted
+        self.invalidate()
+        return False
+
+    # Per-unit entries (pages, chapters) stored as individual files keyed by content hash
+
+    def unit_path(self, key, suffix=".json"):
+        return self.unit_dir / key[:2] / f"{key}{suffix}"
+
+    def get_unit(self, key, suffix=".json"):
+        path = self.unit_path(key, suffix)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f) if suffix == ".json" else f.read()
+        except FileNotFoundError:
+            return None
+
+    def put_unit(self, key, value, suffix=".json"):
+        path = self.unit_path(key, suffix)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            if suffix == ".json":
+                json.dump(value, f, ensure_ascii=False)
+            else:
+                f.write(value)
+        os.replace(tmp_path, path)
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 # Base directory for the project
@@ -13,17 +14,68 @@ PDF_PATH = INPUT_DIR / "China's Revolution and the Quest for a Socialist Future.
 LABELED_DATA_PATH = DATA_DIR / "labeled_document_data.json"
 
 # Output files
-RAW_EXTRACTION_PATH = OUTPUT_DIR / "raw_extraction.jsonl"
+RAW_EXTRACTION_PATH = OUTPUT_DIR / "raw_extraction"  # Columnar directory, see src/raw_extraction.py
 OUTLINE_PATH = OUTPUT_DIR / "outline.json"
 PREDICTED_LAYOUT_PATH = OUTPUT_DIR / "predicted_layout.jsonl"
 AST_PATH = OUTPUT_DIR / "ast.json"
+FIGURES_PATH = OUTPUT_DIR / "figures.json"  # Source image path -> transcoded image, see src/process_figures.py
 EPUB_PATH = OUTPUT_DIR / "book.epub"
 
 # Model files
+LAYOUT_MODEL_PATH = OUTPUT_DIR / "layout_pipeline.joblib"  # Scaler + classifier as one sklearn Pipeline
+# Separate classifier and scaler written by older versions; still loaded if no pipeline exists
 MODEL_OUTPUT_PATH = OUTPUT_DIR / "layout_model.joblib"
 SCALER_OUTPUT_PATH = OUTPUT_DIR / "scaler.joblib"
 
 # Template files
 TEMPLATE_DIR = BASE_DIR / "templates"
 CSS_STYLE_PATH = TEMPLATE_DIR / "style.css"
-MAIN_TEMPLATE_PATH = TEMPLATE_DIR / "main.xhtml.j2" 
\ No newline at end of file
+MAIN_TEMPLATE_PATH = TEMPLATE_DIR / "main.xhtml.j2" 
+
+# Extraction settings
+EXTRACTION_WORKERS = 1  # Worker processes for page-sharded extraction (1 = serial)
+
+# Logging settings (overridable with the PDF2EPUB_LOG_LEVEL / PDF2EPUB_LOG_JSON environment variables)
+LOG_LEVEL = os.environ.get("PDF2EPUB_LOG_LEVEL", "INFO")  # Use "TRACE" for per-span output
+LOG_JSON = os.environ.get("PDF2EPUB_LOG_JSON", "") not in ("", "0", "false")
+LOG_PROGRESS_INTERVAL = 5.0  # Minimum seconds between per-page progress summaries
+
+# Page furniture settings (running headers/footers and page numbers dropped before classification)
+FURNITURE_MIN_PAGES = 4  # Pages a margin text must repeat on to count as furniture (0 = disabled)
+FURNITURE_MIN_DENSITY = 0.4  # Fraction of the pages since its first appearance it must appear on
+FURNITURE_MARGIN = 0.15  # Top/bottom fraction of the page searched for furniture
+FURNITURE_GRID = 2.0  # Points the vertical position is quantized to when matching across pages
+
+# Prediction settings
+PREDICTION_BATCH_SIZE = 10000  # Elements per featurize/scale/predict batch (0 = whole document)
+PREDICTION_N_JOBS = 1  # Threads used by the classifier per batch (-1 = all cores)
+MODEL_MMAP = False  # Memory-map the model's arrays when loading it instead of reading them into memory
+TRAINING_N_JOBS = -1  # Processes/threads used to fit the forest and run hyperparameter searches (-1 = all cores)
+CLASSIFY_GRANULARITY = "span"  # Unit classified by the layout model: "span", "line" or "block" (PyMuPDF grouping)
+
+# Font rule cascade (labels obvious body text and top-level headings before the model; see src/font_rules.py)
+RULE_CASCADE = True  # False sends every element to the model
+RULE_MIN_CHARS = 2000  # Characters the document statistics need before any rule applies
+RULE_BODY_MIN_SHARE = 0.5  # Share of characters the most common size needs to count as the body size
+RULE_BODY_MIN_WORDS = 4  # Shorter text in the body style (stray words, numbers) goes to the model
+RULE_HEADING_RATIO = 1.5  # The largest size marks headings only if at least this many times the body size
+RULE_HEADING_MAX_WORDS = 12  # Longer text in the heading size goes to the model
+CASCADE_MIN_CONFIDENCE = 0.5  # Model predictions less probable than this fall back to a tentative rule label
+
+# Figure processing settings
+FIGURE_WORKERS = 1  # Worker processes for image transcoding (1 = serial)
+FIGURE_MAX_DIMENSION = 1600  # Longest side of a packaged image in pixels (0 = keep the original size)
+FIGURE_JPEG_QUALITY = 85  # Quality of re-encoded JPEG images (1-100)
+
+# EPUB generation settings
+TEMPLATE_CACHE_DIR = OUTPUT_DIR / ".jinja_cache"  # Compiled template bytecode
+EPUB_BACKEND = "ebooklib"  # "ebooklib" (in-memory book) or "stream" (write chapters into the zip as rendered)
+
+# Incremental rebuild cache (per-stage input fingerprints, per-page predictions, rendered chapters)
+CACHE_DIR = OUTPUT_DIR / ".cache"
+
+# Pipelined conversion (pipeline.py --pipelined)
+PIPELINE_QUEUE_SIZE = 64  # Items (pages, predicted elements) a stage may run ahead of the next one
+
+# Batch conversion settings
+BATCH_CONCURRENCY = os.cpu_count() or 1  # Documents converted at once, one worker process each
@@ -0,0 +1,111 @@
+import sys
+
+# Label names by integer code; code 0 is an element not classified yet
+_label_names = [""]
+_label_codes = {"": 0}
+
+
+def label_code(name):
+    """The integer code for a label name, registering names not seen before."""
+    code = _label_codes.get(name)
+    if code is None:
+        name = str(name)  # Model classes are NumPy strings
+        code = _label_codes.setdefault(name, len(_label_names))
+        if code == len(_label_names):
+            _label_names.append(name)
+    return code
+
+
+def label_name(code):
+    return _label_names[code]
+
+
+def intern_font(font):
+    """Font names repeat on nearly every element; keep one copy of each."""
+    return sys.intern(font) if isinstance(font, str) else font
+
+
+class Element:
+    """
+    One unit of text (a span, line or block) on its way from prediction to
+    the AST.
+
+    Elements exist by the million, so they use slots instead of a dict and
+    hold only what is specific to them: the page number and page height are
+    shared by all elements of a page, font names are interned, the label is
+    an integer code (see `label_code`), and the "p<page>_b<index>" id is
+    built only when asked for. Merged paragraphs also record the page they
+    end on in `end_page`.
+
+    `to_dict` and `from_dict` convert to and from the predicted_layout.jsonl
+    records.
+    """
+
+    __slots__ = ("page", "index", "text", "bbox", "font", "size", "bold", "spans", "granularity",
+                 "page_height", "type_code", "end_page")
+
+    def __init__(self, page, index, text, bbox=None, font=None, size=0.0, bold=0.0, spans=1,
+                 granularity="span", page_height=1.0, type_code=0, end_page=None):
+        self.page = page
+        self.index = index
+        self.text = text
+        self.bbox = bbox
+        self.font = font
+        self.size = size
+        self.bold = bold
+        self.spans = spans
+        self.granularity = granularity
+        self.page_height = page_height
+        self.type_code = type_code
+        self.end_page = end_page
+
+    @property
+    def id(self):
+        return f"p{self.page}_b{self.index}"
+
+    @property
+    def type(self):
+        return _label_names[self.type_code]
+
+    @type.setter
+    def type(self, name):
+        self.type_code = label_code(name)
+
+    def to_dict(self):
+        """The element as a predicted_layout.jsonl record."""
+        return {
+            "id": self.id,
+            "type": self.type,
+            "text": self.text,
+            "bbox": list(self.bbox) if self.bbox is not None else None,
+            "font": self.font,
+            "size": self.size,
+            "bold": self.bold,
+            "spans": self.spans,
+            "granularity": self.granularity,
+        }
+
+    @classmethod
+    def from_dict(cls, record):
+        """
+        Reads a predicted_layout.jsonl record. The page and index come from
+        the "p<page>_b<index>" id (0 if it is malformed).
+        """
+        try:
+            page, index = (int(part[1:]) for part in record["id"].split("_", 1))
+        except (KeyError, ValueError):
+            page, index = 0, 0
+        bbox = record.get("bbox")
+        return cls(
+            page, index, record.get("text", ""),
+            bbox=tuple(bbox) if bbox is not None else None,
+            font=intern_font(record.get("font")),
+            size=record.get("size", 0.0),
+            bold=record.get("bold", 0.0),
+            spans=record.get("spans", 1),
+            granularity=sys.intern(record.get("granularity", "span")),
+            type_code=label_code(record.get("type", "")),
+        )
+
+    def __repr__(self):
+        return f"Element({self.id}, {self.type!r}, {self.text[:40]!r})"
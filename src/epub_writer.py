@@ -0,0 +1,172 @@
+import uuid
+import shutil
+import zipfile
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape, quoteattr
+
+CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="EPUB/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+
+class StreamingEpubWriter:
+    """
+    Writes an EPUB 3 package straight into the zip archive.
+
+    Chapters, images and stylesheets are compressed into the archive as soon
+    as they are added, and only their manifest entries (file name, title,
+    media type) are kept in memory. The package documents (content.opf,
+    nav.xhtml, toc.ncx) are written by `close()`, since they only reference
+    the content files. As required by the OCF spec, `mimetype` is the first
+    entry and is stored uncompressed.
+
+    Usage:
+        with StreamingEpubWriter(path, title="My Book") as writer:
+            writer.add_stylesheet("style/main.css", css)
+            writer.add_chapter("chapter_0.xhtml", "Chapter 1", html)
+    """
+
+    ROOT = "EPUB/"
+
+    def __init__(self, path, title="Untitled Book", language="en", identifier=None, author=None):
+        self.title = title
+        self.language = language
+        self.identifier = identifier or f"urn:uuid:{uuid.uuid4()}"
+        self.author = author
+        self.manifest = []  # (item id, href, media type, properties)
+        self.spine = []     # (item id, href, title)
+        self._ids = {"id", "nav", "ncx"}  # Reserved for the identifier and navigation items
+
+        self._closed = False
+        self._zip = zipfile.ZipFile(path, "w")
+        self._zip.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        self._write("META-INF/container.xml", CONTAINER_XML)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._closed = True
+            self._zip.close()
+
+    def _write(self, name, data):
+        self._zip.writestr(name, data, compress_type=zipfile.ZIP_DEFLATED)
+
+    def _item_id(self, href):
+        base = "".join(c if c.isalnum() else "_" for c in href.rsplit(".", 1)[0])
+        if not base[:1].isalpha():
+            base = f"item_{base}"
+        item_id, n = base, 1
+        while item_id in self._ids:
+            n += 1
+            item_id = f"{base}_{n}"
+        self._ids.add(item_id)
+        return item_id
+
+    def add_stylesheet(self, href, content):
+        self._write(self.ROOT + href, content)
+        self.manifest.append((self._item_id(href), href, "text/css", None))
+
+    def add_chapter(self, href, title, content):
+        """Writes one XHTML chapter and appends it to the spine."""
+        self._write(self.ROOT + href, content)
+        item_id = self._item_id(href)
+        self.manifest.append((item_id, href, "application/xhtml+xml", None))
+        self.spine.append((item_id, href, title))
+
+    def add_image_file(self, href, path, media_type):
+        """Copies an image into the archive in chunks, without loading it whole."""
+        info = zipfile.ZipInfo(self.ROOT + href, date_time=datetime.now().timetuple()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with open(path, "rb") as src, self._zip.open(info, "w") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        self.manifest.append((self._item_id(href), href, media_type, None))
+
+    def _nav_xhtml(self):
+        links = "\n".join(
+            f'      <li><a href={quoteattr(href)}>{escape(title)}</a></li>' for _, href, title in self.spine
+        )
+        return f"""<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang={quoteattr(self.language)} xml:lang={quoteattr(self.language)}>
+<head>
+  <title>{escape(self.title)}</title>
+</head>
+<body>
+  <nav epub:type="toc" id="toc">
+    <h1>{escape(self.title)}</h1>
+    <ol>
+{links}
+    </ol>
+  </nav>
+</body>
+</html>
+"""
+
+    def _toc_ncx(self):
+        points = "\n".join(
+            f"""    <navPoint id="navpoint-{n}" playOrder="{n}">
+      <navLabel><text>{escape(title)}</text></navLabel>
+      <content src={quoteattr(href)}/>
+    </navPoint>"""
+            for n, (_, href, title) in enumerate(self.spine, 1)
+        )
+        return f"""<?xml version="1.0" encoding="UTF-8"?>
+<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">
+  <head>
+    <meta name="dtb:uid" content={quoteattr(self.identifier)}/>
+    <meta name="dtb:depth" content="1"/>
+    <meta name="dtb:totalPageCount" content="0"/>
+    <meta name="dtb:maxPageNumber" content="0"/>
+  </head>
+  <docTitle><text>{escape(self.title)}</text></docTitle>
+  <navMap>
+{points}
+  </navMap>
+</ncx>
+"""
+
+    def _content_opf(self):
+        modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        creator = f"\n    <dc:creator>{escape(self.author)}</dc:creator>" if self.author else ""
+        items = "\n".join(
+            f'    <item id="{item_id}" href={quoteattr(href)} media-type="{media_type}"'
+            + (f' properties="{properties}"' if properties else "") + "/>"
+            for item_id, href, media_type, properties in self.manifest
+        )
+        itemrefs = "\n".join(f'    <itemref idref="{item_id}"/>' for item_id, _, _ in self.spine)
+        return f"""<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="id" xml:lang={quoteattr(self.language)}>
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="id">{escape(self.identifier)}</dc:identifier>
+    <dc:title>{escape(self.title)}</dc:title>
+    <dc:language>{escape(self.language)}</dc:language>{creator}
+    <meta property="dcterms:modified">{modified}</meta>
+  </metadata>
+  <manifest>
+{items}
+  </manifest>
+  <spine toc="ncx">
+{itemrefs}
+  </spine>
+</package>
+"""
+
+    def close(self):
+        """Writes the navigation and package documents and closes the archive."""
+        if self._closed:
+            return
+        self._closed = True
+        self._write(self.ROOT + "nav.xhtml", self._nav_xhtml())
+        self.manifest.append(("nav", "nav.xhtml", "application/xhtml+xml", "nav"))
+        self._write(self.ROOT + "toc.ncx", self._toc_ncx())
+        self.manifest.append(("ncx", "toc.ncx", "application/x-dtbncx+xml", None))
+        self._write(self.ROOT + "content.opf", self._content_opf())
+        self._zip.close()
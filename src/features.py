@@ -1,49 +1,155 @@
-import pandas as pd
-from typing import List, Dict, Any
+from __future__ import annotations
 
-def featurize(elements: List[Dict[str, Any]]) -> pd.DataFrame:
+import numpy as np
+from typing import TYPE_CHECKING, Dict, Any, Sequence, Optional, Union
+
+from src.elements import Element
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+FEATURE_COLUMNS = ["width", "height", "x0", "rel_y0", "text_len", "word_count", "cap_ratio"]
+# Font aggregates, added when every element carries them (extracted elements do,
+# hand-labeled training data usually does not). A model only sees the columns
+# its scaler was fitted on, so models trained without them keep working.
+FONT_FEATURE_COLUMNS = ["font_size", "bold_ratio", "span_count"]
+
+# Per-code-point lookup tables for str.isupper() / str.isspace(), grown on demand
+_upper_table = np.zeros(0, dtype=bool)
+_space_table = np.zeros(0, dtype=bool)
+
+def _char_tables(max_code_point: int):
+    global _upper_table, _space_table
+    if max_code_point >= len(_upper_table):
+        size = max(256, 1 << int(max_code_point).bit_length())
+        chars = [chr(cp) for cp in range(size)]
+        _upper_table = np.fromiter((c.isupper() for c in chars), dtype=bool, count=size)
+        _space_table = np.fromiter((c.isspace() for c in chars), dtype=bool, count=size)
+    return _upper_table, _space_table
+
+def _segment_counts(flags: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    # Number of True flags in flags[offsets[i]:offsets[i + 1]] for every segment, empty ones included
+    return np.diff(np.searchsorted(np.flatnonzero(flags), offsets)).astype(np.int64)
+
+def text_features(texts: Sequence[str]):
+    """
+    Computes length, word count and uppercase count for many strings at once.
+
+    All texts are concatenated into a single code-point array, so the
+    per-character work runs in NumPy instead of a Python generator. Results
+    match `len(t)`, `len(t.split())` and `sum(c.isupper() for c in t)`.
+    """
+    n = len(texts)
+    text_len = np.fromiter(map(len, texts), dtype=np.int64, count=n)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(text_len, out=offsets[1:])
+
+    # surrogatepass keeps lone surrogates, which PyMuPDF can emit, as one code point each
+    code_points = np.frombuffer("".join(texts).encode("utf-32-le", errors="surrogatepass"), dtype=np.uint32)
+    if len(code_points) == 0:
+        zeros = np.zeros(n, dtype=np.int64)
+        return text_len, zeros, zeros.copy()
+
+    upper_table, space_table = _char_tables(int(code_points.max()))
+    is_upper = upper_table[code_points]
+    is_word = ~space_table[code_points]
+
+    # A word starts at a non-space character whose predecessor in the same text is a space
+    prev_is_word = np.empty_like(is_word)
+    prev_is_word[0] = False
+    prev_is_word[1:] = is_word[:-1]
+    starts = offsets[:-1][text_len > 0]
+    prev_is_word[starts] = False
+    word_starts = is_word & ~prev_is_word
+
+    return text_len, _segment_counts(word_starts, offsets), _segment_counts(is_upper, offsets)
+
+def featurize_columns(
+    bboxes: Any,
+    texts: Sequence[str],
+    page_heights: Any,
+    labels: Optional[Sequence[str]] = None,
+    font_stats: Any = None,
+) -> pd.DataFrame:
+    """
+    Columnar featurizer: builds the feature frame from whole arrays at once.
+
+    Args:
+        bboxes: An (n, 4) array-like of x0, y0, x1, y1.
+        texts: The n element texts.
+        page_heights: The n page heights used to normalize y0 (0 falls back to 1).
+        labels: Optional n labels; defaults to empty strings.
+        font_stats: Optional (n, 3) array-like of font size, bold ratio and
+                    span count, added as the FONT_FEATURE_COLUMNS.
+
+    Returns:
+        The same DataFrame `featurize` returns for equivalent elements.
+    """
+    n = len(texts)
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(n, 4)
+    page_heights = np.asarray(page_heights, dtype=np.float64).reshape(n)
+    page_heights = np.where(page_heights == 0, 1.0, page_heights)
+
+    text_len, word_count, upper_count = text_features(texts)
+
+    columns = {
+        "width": bboxes[:, 2] - bboxes[:, 0],
+        "height": bboxes[:, 3] - bboxes[:, 1],
+        "x0": bboxes[:, 0],
+        "rel_y0": bboxes[:, 1] / page_heights,
+        "text_len": text_len,
+        "word_count": word_count,
+        # Ratio of uppercase characters
+        "cap_ratio": upper_count / (text_len + 1e-5),
+    }
+    if font_stats is not None:
+        font_stats = np.asarray(font_stats, dtype=np.float64).reshape(n, len(FONT_FEATURE_COLUMNS))
+        for i, name in enumerate(FONT_FEATURE_COLUMNS):
+            columns[name] = font_stats[:, i]
+    columns["label"] = list(labels) if labels is not None else [""] * n # Include label for training
+    # Imported here: pandas alone takes longer to import than most stages take to run
+    import pandas as pd
+    return pd.DataFrame(columns)
+
+def featurize(elements: Sequence[Union[Element, Dict[str, Any]]]) -> pd.DataFrame:
     """
     Converts a list of text elements into a pandas DataFrame of features.
 
     Args:
-        elements: A list of dictionaries, where each dictionary represents
-                  a text element with properties like 'text', 'bbox', etc.
+        elements: `Element`s as prediction produces them, or dictionaries
+                  with properties like 'text', 'bbox', etc. as loaded from
+                  labeled training data.
 
     Returns:
         A pandas DataFrame where each row corresponds to an element and
-        each column is a feature.
-    """
-    features = []
-    for el in elements:
-        bbox = el["bbox"]
-        text = el.get("text", "")
-        
-        # Bbox features
-        x0, y0, x1, y1 = bbox
-        width = x1 - x0
-        height = y1 - y0
-        
-        # Normalize position by page height, with a fallback
-        page_height = el.get("page_height", 1)
-        if page_height == 0:
-            page_height = 1
-        rel_y0 = y0 / page_height
-        
-        # Text features
-        text_len = len(text)
-        word_count = len(text.split())
-        
-        # Ratio of uppercase characters
-        cap_ratio = sum(1 for c in text if c.isupper()) / (text_len + 1e-5)
-        
-        features.append({
-            "width": width,
-            "height": height,
-            "x0": x0,
-            "rel_y0": rel_y0,
-            "text_len": text_len,
-            "word_count": word_count,
-            "cap_ratio": cap_ratio,
-            "label": el.get("type", "") # Include label for training
-        })
-    return pd.DataFrame(features) 
\ No newline at end of file
+        each column is a feature. The FONT_FEATURE_COLUMNS are included
+        when every element has a font "size", which `Element`s always do.
+    """
+    if elements and isinstance(elements[0], Element):
+        return featurize_columns(
+            [el.bbox for el in elements],
+            [el.text for el in elements],
+            [el.page_height for el in elements],
+            [el.type for el in elements],
+            [(el.size, el.bold, el.spans) for el in elements],
+        )
+    font_stats = None
+    if elements and all("size" in el for el in elements):
+        font_stats = [(el["size"], el.get("bold", 0.0), el.get("spans", 1)) for el in elements]
+    return featurize_columns(
+        [el["bbox"] for el in elements],
+        [el.get("text", "") for el in elements],
+        [el.get("page_height", 1) for el in elements],
+        [el.get("type", "") for el in elements],
+        font_stats,
+    )
+
+def model_features(df: pd.DataFrame, model: Any) -> pd.DataFrame:
+    """
+    Selects the feature columns a fitted model (or scaler) expects, in its order.
+
+    Estimators fitted on a DataFrame remember their column names; older
+    ones fitted on the base features alone get FEATURE_COLUMNS.
+    """
+    columns = getattr(model, "feature_names_in_", None)
+    return df[list(columns) if columns is not None else FEATURE_COLUMNS]
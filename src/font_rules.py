@@ -0,0 +1,237 @@
+import re
+from collections import Counter
+
+import numpy as np
+
+from src import config
+from src.features import text_features
+from src.log import get_logger
+
+log = get_logger("rules")
+
+# Bump when the rules change, to invalidate cached predictions
+RULES_VERSION = 1
+
+# Labels the rules assign; the model's label names for the same elements
+BODY_LABEL = "paragraph"
+HEADING_LABEL = "heading_1"
+
+# Text that is set like body text but is not a plain paragraph: list items and captions
+_NOT_BODY = re.compile(r"^\s*(?:[•◦▪‣∙·*–—-]\s|\(?\d{1,3}[.)]\s|\(?[a-z][.)]\s|(?:fig(?:ure)?|table|plate)\.?\s*\d)",
+                       re.IGNORECASE)
+
+
+def rule_settings():
+    """The rule version and thresholds, which cached labels depend on."""
+    return [RULES_VERSION, {
+        name: getattr(config, name) for name in (
+            "RULE_MIN_CHARS", "RULE_BODY_MIN_SHARE", "RULE_BODY_MIN_WORDS",
+            "RULE_HEADING_RATIO", "RULE_HEADING_MAX_WORDS",
+        )
+    }]
+
+
+def size_bin(size):
+    """Font sizes are compared in half-point bins, absorbing rounding noise in the PDF."""
+    return round((size or 0.0) * 2) / 2
+
+
+class FontStats:
+    """
+    Character-weighted histograms of font size and font name for one
+    document, from which the body text style and the top-level heading size
+    are read.
+
+    The body style is the most common size and the most common font. The
+    heading size is the largest size in the document, provided it is at
+    least `config.RULE_HEADING_RATIO` times the body size.
+    """
+
+    def __init__(self):
+        self.sizes = Counter()  # size bin -> characters
+        self.fonts = Counter()  # font name -> characters
+
+    def add(self, font, size, chars):
+        self.sizes[size_bin(size)] += chars
+        self.fonts[font] += chars
+
+    def add_elements(self, elements):
+        """Counts `Element`s as produced by `predict_layout.iter_page_elements`."""
+        for el in elements:
+            self.add(el.font, el.size, len(el.text))
+
+    def add_page(self, page_data):
+        """Counts the text runs of one page record, leaving out page furniture."""
+        for run in page_data.get("text_runs", []):
+            if not run.get("furniture"):
+                self.add(run.get("font"), run.get("size", 0.0), len(run["text"]))
+
+    @classmethod
+    def from_pages(cls, pages):
+        stats = cls()
+        for page_data in pages:
+            stats.add_page(page_data)
+        return stats
+
+    @classmethod
+    def from_extraction(cls, raw):
+        """
+        Builds the histograms straight from the columns of a `RawExtraction`,
+        without materializing any page. Runs are weighted by their character
+        count, as in `add_elements`.
+        """
+        weights = raw.char_counts().astype(np.float64)
+        sizes = np.round(np.asarray(raw.column("size")) * 2) / 2
+        font_ids = np.asarray(raw.column("font"))
+        weights[np.asarray(raw.column("furniture"))] = 0
+
+        stats = cls()
+        bins, index = np.unique(sizes, return_inverse=True)
+        for size, chars in zip(bins.tolist(), np.bincount(index, weights=weights).tolist()):
+            if chars:
+                stats.sizes[size] += int(chars)
+        fonts = raw.fonts
+        for font_id, chars in enumerate(np.bincount(font_ids, weights=weights, minlength=len(fonts)).tolist()):
+            if chars:
+                stats.fonts[fonts[font_id]] += int(chars)
+        return stats
+
+    @property
+    def chars(self):
+        return sum(self.sizes.values())
+
+    @property
+    def body_size(self):
+        return self.sizes.most_common(1)[0][0] if self.sizes else None
+
+    @property
+    def body_font(self):
+        return self.fonts.most_common(1)[0][0] if self.fonts else None
+
+    @property
+    def body_share(self):
+        """Fraction of all characters set in the body size."""
+        chars = self.chars
+        return self.sizes[self.body_size] / chars if chars else 0.0
+
+    @property
+    def heading_size(self):
+        body_size = self.body_size
+        if not body_size:
+            return None
+        largest = max(self.sizes)
+        return largest if largest >= body_size * config.RULE_HEADING_RATIO else None
+
+    def summary(self):
+        """What the rules read from the statistics; part of the prediction cache key."""
+        return {
+            "body_size": self.body_size,
+            "body_font": self.body_font,
+            "body_share": round(self.body_share, 3),
+            "heading_size": self.heading_size,
+            "chars": self.chars,
+        }
+
+
+def rule_labels(elements, summary, enabled=(BODY_LABEL, HEADING_LABEL)):
+    """
+    Labels a batch of elements from the document's font statistics, given as
+    `FontStats.summary()`. Only the rules whose label is in `enabled` apply.
+
+    Text in the body size and font, not bold, with at least
+    `config.RULE_BODY_MIN_WORDS` words and no list or caption prefix is body
+    text. Short text in the heading size (see `FontStats`) is a top-level
+    heading. Elements that only partly match (a short line in the body
+    style, long text in the heading size) get a tentative label, used only
+    if the model is unsure. The tests run on whole arrays, as they are
+    meant to cost less than featurizing.
+
+    Returns:
+        (labels, certain): per element, the label (None when no rule
+        applies) and whether the rule is certain of it.
+    """
+    n = len(elements)
+    if not n or summary["chars"] < config.RULE_MIN_CHARS:
+        return [None] * n, [False] * n
+    texts = [el.text for el in elements]
+    _, words, _ = text_features(texts)
+    sizes = np.round(np.array([el.size for el in elements], dtype=np.float64) * 2) / 2
+    bold = np.array([el.bold for el in elements], dtype=np.float64)
+    body_font = summary["body_font"]
+    in_body_font = np.array([el.font == body_font for el in elements], dtype=bool)
+
+    body = np.zeros(n, dtype=bool)
+    if summary["body_share"] >= config.RULE_BODY_MIN_SHARE:
+        body = sizes == summary["body_size"]
+    certain_body = body & in_body_font & (bold < 0.5) & (words >= config.RULE_BODY_MIN_WORDS)
+    for i in np.flatnonzero(certain_body).tolist():
+        if _NOT_BODY.match(texts[i]):
+            certain_body[i] = False
+
+    heading = ~body & (sizes == summary["heading_size"]) if summary["heading_size"] else np.zeros(n, dtype=bool)
+    certain_heading = heading & (words > 0) & (words <= config.RULE_HEADING_MAX_WORDS)
+    # A disabled body rule still keeps body-size text out of the heading rule
+    if BODY_LABEL not in enabled:
+        body = certain_body = np.zeros(n, dtype=bool)
+    if HEADING_LABEL not in enabled:
+        heading = certain_heading = np.zeros(n, dtype=bool)
+
+    labels = np.where(body, BODY_LABEL, np.where(heading, HEADING_LABEL, None)).tolist()
+    return labels, (certain_body | certain_heading).tolist()
+
+
+class RuleCascade:
+    """
+    Splits classification between the font rules and the model.
+
+    Elements a rule labels with certainty are never featurized; the rest are
+    classified by the model with `predict_proba`. Where the model's top
+    probability is below `min_confidence` and a rule had a tentative label
+    for the element, the rule's label is used instead.
+
+    With `learn=True` each batch is added to the statistics before it is
+    labeled, for streams whose statistics are not known up front (the
+    in-memory pipeline); otherwise `stats` should cover the whole document.
+
+    Given the model's `classes`, a rule whose label the model does not know
+    is disabled (with a warning), so rules never emit a label the model
+    could not have predicted.
+    """
+
+    def __init__(self, stats=None, learn=False, min_confidence=None, classes=None):
+        self.stats = FontStats() if stats is None else stats
+        self.learn = learn
+        self.min_confidence = config.CASCADE_MIN_CONFIDENCE if min_confidence is None else min_confidence
+        self.labels = (BODY_LABEL, HEADING_LABEL)
+        if classes is not None:
+            missing = [label for label in self.labels if label not in set(classes)]
+            if missing:
+                log.warning(f"The layout model has no {', '.join(map(repr, missing))} class; "
+                            f"disabling the font rules for {'it' if len(missing) == 1 else 'them'}.")
+            self.labels = tuple(label for label in self.labels if label not in missing)
+        self.ruled = 0  # Elements labeled by a rule alone
+        self.modeled = 0  # Elements sent to the model
+        self.fallbacks = 0  # Model predictions replaced by a tentative rule label
+
+    def fingerprint(self):
+        """Everything the cascade's labels depend on besides the model and the element."""
+        return [rule_settings(), self.min_confidence, self.stats.summary(), list(self.labels)]
+
+    def label(self, elements):
+        """
+        Returns:
+            (labels, tentative): per element, the certain rule label (None if
+            the element needs the model) and the tentative one.
+        """
+        if self.learn:
+            self.stats.add_elements(elements)
+        tentative, certain = rule_labels(elements, self.stats.summary(), self.labels)
+        return [label if sure else None for label, sure in zip(tentative, certain)], tentative
+
+    def report(self):
+        """One line on how the elements were split between the rules and the model."""
+        total = self.ruled + self.modeled
+        share = self.ruled / total if total else 0.0
+        return (f"Font rules labeled {self.ruled} of {total} elements ({share:.0%}); "
+                f"{self.modeled} went to the model, {self.fallbacks} of them kept a rule label "
+                f"below {self.min_confidence:.0%} model confidence.")
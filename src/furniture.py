@@ -0,0 +1,125 @@
+import re
+
+from src import config
+
+_DIGITS = re.compile(r"\d+")
+
+
+def furniture_settings():
+    """The detection thresholds, which the extraction's furniture flags depend on."""
+    return {
+        name: getattr(config, name) for name in (
+            "FURNITURE_MIN_PAGES", "FURNITURE_MIN_DENSITY", "FURNITURE_MARGIN", "FURNITURE_GRID",
+        )
+    }
+
+
+def furniture_key(text, bbox, page_height, margin=None, grid=None):
+    """
+    The key under which a text run is matched against the same run on other
+    pages, or None if the run cannot be page furniture.
+
+    Only runs lying in the top or bottom `margin` fraction of the page are
+    considered. The key is the text with digit runs masked ("Page 12" and
+    "Page 13" match), case and whitespace normalized, plus the run's top and
+    bottom edges quantized to `grid` points. Horizontal position is left
+    out, so page numbers whose width grows with the number still match.
+    """
+    if margin is None:
+        margin = config.FURNITURE_MARGIN
+    if grid is None:
+        grid = config.FURNITURE_GRID
+    x0, y0, x1, y1 = bbox
+    if page_height and margin_band(y0, y1, page_height, margin) is None:
+        return None
+    normalized = " ".join(_DIGITS.sub("#", text).casefold().split())
+    if not normalized:
+        return None
+    return f"{normalized}|{round(y0 / grid)}|{round(y1 / grid)}"
+
+
+def image_key(image):
+    """The key under which an extracted image is matched against the images of other pages."""
+    return f"image|{image['hash']}" if image.get("hash") else None
+
+
+def margin_band(y0, y1, page_height, margin):
+    """"top" or "bottom" if the box lies within that margin of the page, else None."""
+    if y1 <= page_height * margin:
+        return "top"
+    if y0 >= page_height * (1 - margin):
+        return "bottom"
+    return None
+
+
+class FurnitureIndex:
+    """
+    Document-level index of text that repeats across pages.
+
+    Each page's text runs are keyed with `furniture_key`, and every key
+    records the pages it was seen on. A key is page furniture (a running
+    header, footer or page number) once it has been seen on at least
+    `min_pages` pages and on at least `min_density` of the pages since its
+    first appearance; the density test keeps headings that recur at the same
+    place only at chapter starts ("Chapter 3", "Chapter 4") out of it.
+
+    The index is used in two ways: extraction records every page and tags
+    runs once the whole document is known (`add_page`, then `is_furniture`
+    on the returned keys), while the in-memory pipeline tags each page as
+    it arrives (`tag_page`), based on the pages seen so far.
+
+    Images are indexed alongside the runs by their content hash (see
+    `image_key`), so a logo or ornament printed on every page is furniture
+    too and is not packaged as a figure.
+    """
+
+    def __init__(self, min_pages=None, min_density=None):
+        self.min_pages = config.FURNITURE_MIN_PAGES if min_pages is None else min_pages
+        self.min_density = config.FURNITURE_MIN_DENSITY if min_density is None else min_density
+        self.pages = {}  # key -> [first page, last page, page count]
+
+    def add_page(self, page_data):
+        """Records one page record and returns the key of each of its runs (None where not applicable)."""
+        page_number = page_data["meta"]["number"]
+        height = page_data["meta"].get("height") or 0
+        keys = [furniture_key(run["text"], run["bbox"], height) for run in page_data.get("text_runs", [])]
+        if self.min_pages <= 0:
+            return [None] * len(keys)
+        for key in set(keys).union(map(image_key, page_data.get("images", []))):
+            if key is None:
+                continue
+            seen = self.pages.get(key)
+            if seen is None:
+                self.pages[key] = [page_number, page_number, 1]
+            elif seen[1] != page_number:
+                seen[1] = page_number
+                seen[2] += 1
+        return keys
+
+    def is_furniture(self, key):
+        """True if the run keyed `key` is furniture, given the pages recorded so far."""
+        seen = self.pages.get(key) if key is not None else None
+        if seen is None or seen[2] < self.min_pages:
+            return False
+        first, last, pages = seen
+        return pages / (last - first + 1) >= self.min_density
+
+    def tag_page(self, page_data):
+        """
+        Records a page and marks its runs and images that are furniture
+        given the pages seen so far with "furniture": True. Returns the
+        number of tagged runs.
+        """
+        tagged = 0
+        for run, key in zip(page_data.get("text_runs", []), self.add_page(page_data)):
+            if self.is_furniture(key):
+                run["furniture"] = True
+                tagged += 1
+        self.tag_images(page_data.get("images", []))
+        return tagged
+
+    def tag_images(self, images):
+        """Marks the image records that are furniture, given the pages recorded so far."""
+        for image in images:
+            if self.is_furniture(image_key(image)):
+                image["furniture"] = True
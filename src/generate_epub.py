@@ -1,32 +1,238 @@
 import json
 import os
-from jinja2 import Environment, FileSystemLoader
-from ebooklib import epub, ITEM_DOCUMENT
+import sys
+import hashlib
+import argparse
+from collections import deque
+from functools import lru_cache
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 from pathlib import Path
 
 from src import config
+from src.cache import StageCache, directory_hash, file_hash, json_hash
+from src.epub_writer import StreamingEpubWriter
+from src.log import add_logging_args, get_logger, setup_logging
+from src.profiling import add_profiling_args, count, profile_run, stage, step
+
+log = get_logger("epub")
+
+BOOK_IDENTIFIER = "id123456"
+
+IMAGE_MEDIA_TYPES = {
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "jpx": "image/jp2",
+    "jp2": "image/jp2",
+    "svg": "image/svg+xml",
+}
 
 def load_ast(path):
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
-def render_chapter(env, chapter_data):
-    template = env.get_template("main.xhtml.j2")
-    return template.render(chapter=chapter_data)
+@lru_cache(maxsize=None)
+def load_template(template_dir=None, cache_dir=None):
+    """
+    Returns the compiled chapter template, compiling it at most once per
+    process. Compiled bytecode is cached in `cache_dir` so later runs skip
+    compilation on a cold start.
+    """
+    template_dir = Path(template_dir or config.TEMPLATE_DIR)
+    cache_dir = Path(cache_dir or config.TEMPLATE_CACHE_DIR)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    env = Environment(
+        loader=FileSystemLoader(template_dir),
+        bytecode_cache=FileSystemBytecodeCache(str(cache_dir)),
+    )
+    return env.get_template(Path(config.MAIN_TEMPLATE_PATH).name)
 
-def main():
-    print("[INFO] Loading AST...")
-    ast = load_ast(config.AST_PATH)
-    
-    # Create output dir if it doesn't exist
-    Path(config.OUTPUT_DIR).mkdir(exist_ok=True)
+def render_chapter(template, chapter_data):
+    with step("render"):
+        return template.render(chapter=chapter_data)
+
+def iter_rendered_chapters(sections, template_dir=None, cache_dir=None):
+    """
+    Renders sections to XHTML strings, yielded in the same (spine) order.
+
+    Rendering stays serial: with the template compiled once, a chapter
+    renders in well under a millisecond, less than it costs to pickle the
+    section to a worker process and the XHTML back. A process pool only
+    made 300 chapters slower.
+    """
+    template = load_template(template_dir, cache_dir)
+    for section in sections:
+        yield render_chapter(template, section)
+
+def iter_rendered_chapters_cached(sections, render_cache, template_key):
+    """
+    Yields rendered XHTML in spine order, reusing chapters whose content and
+    template are unchanged since they were last rendered and rendering only
+    the rest.
+
+    Each section is looked up as it arrives, so chapters stream through like
+    in `iter_rendered_chapters`.
+    """
+    template = None
+    total = hits = 0
+    try:
+        for section in sections:
+            total += 1
+            key = json_hash([template_key, section])
+            html_content = render_cache.get_unit(key, ".xhtml")
+            if html_content is not None:
+                hits += 1
+            else:
+                template = template or load_template()
+                html_content = render_chapter(template, section)
+                render_cache.put_unit(key, html_content, ".xhtml")
+            yield html_content
+    finally:
+        # Callers may stop iterating once they have every chapter they expect
+        log.info(f"Reused {hits} of {total} rendered chapters from the cache.")
+
+def _iter_rendered(sections, render_cache):
+    if render_cache is None:
+        return iter_rendered_chapters(sections)
+    return iter_rendered_chapters_cached(sections, render_cache, template_fingerprint())
+
+def template_fingerprint():
+    return directory_hash(config.TEMPLATE_DIR, "*.j2")
+
+def render_chapters(sections, template_dir=None, cache_dir=None):
+    """Renders all sections and returns the XHTML strings in spine order."""
+    return list(iter_rendered_chapters(sections, template_dir, cache_dir))
+
+def load_figures(path):
+    """The figure map written by `process_figures`, or {} if there is none."""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+class ImageCollector:
+    """
+    Finds every image referenced by a figure element, keeps one copy per
+    distinct content and points the figures at the packaged href. Figure
+    elements are replaced in their section's list rather than modified, so
+    on sections from `iter_book_sections` the AST keeps its source paths.
+
+    Images are keyed by the hash of their bytes, so an image referenced from
+    many chapters (or extracted under several names) is stored only once.
+    When `figures` (see `process_figures.process_figures`) has an entry for
+    a source image, its transcoded file is packaged instead. Sections can
+    be collected over several calls, as they become available; each image
+    is returned by the first call that finds it. A figure whose image file
+    is missing raises FileNotFoundError rather than ship a broken reference.
+    """
+
+    def __init__(self, figures=None):
+        self.figures = figures if figures is not None else {}
+        self.packaged = {}  # content hash -> href inside the book
+        self.by_path = {}   # source path -> href, avoids re-hashing repeated references
+
+    def collect(self, sections):
+        """Returns a list of (href, source path, media type) for the images not seen before."""
+        packaged, by_path, figures = self.packaged, self.by_path, self.figures
+        images = []
+        for section in sections:
+            elements = section.get("elements", [])
+            for index, element in enumerate(elements):
+                src = element.get("src") if element.get("type") == "figure" else None
+                if not src:
+                    continue
+                if src not in by_path:
+                    path = figures[src]["path"] if src in figures else src
+                    if not os.path.exists(path):
+                        raise FileNotFoundError(f"Image not found for figure {src}: {path}")
+                    with open(path, "rb") as f:
+                        digest = hashlib.file_digest(f, "sha1").hexdigest()
+                    if digest not in packaged:
+                        ext = os.path.splitext(path)[1].lstrip(".").lower() or "png"
+                        href = f"images/img_{digest}.{ext}"
+                        images.append((href, path, IMAGE_MEDIA_TYPES.get(ext, f"image/{ext}")))
+                        packaged[digest] = href
+                    by_path[src] = packaged[digest]
+                elements[index] = {**element, "src": by_path[src]}
+        return images
+
+def collect_images(sections, figures=None):
+    """
+    Collects the distinct images of all `sections` (see `ImageCollector`).
+
+    Returns:
+        A list of (href, source path, media type) for the distinct images.
+    """
+    images = ImageCollector(figures).collect(sections)
+    if images:
+        log.info(f"Packaging {len(images)} distinct images.")
+    return images
 
-    # Setup Jinja2
-    env = Environment(loader=FileSystemLoader(config.TEMPLATE_DIR))
+def add_images(book, sections, figures=None):
+    """Adds each distinct figure image to an ebooklib book exactly once and returns how many were added."""
+    from ebooklib import epub
+    images = collect_images(sections, figures)
+    for href, path, media_type in images:
+        with open(path, "rb") as f:
+            content = f.read()
+        book.add_item(epub.EpubImage(
+            uid=os.path.splitext(os.path.basename(href))[0],
+            file_name=href,
+            media_type=media_type,
+            content=content,
+        ))
+    return len(images)
+
+def iter_book_sections(all_sections):
+    """
+    Yields (index, section) for every non-empty section of `all_sections`,
+    which are in spine order. Sections are shallow copies, so packaging can
+    point their figures at the book's images without touching the AST.
+    """
+    for i, chapter_data in enumerate(all_sections):
+        # Skip empty chapters
+        if not chapter_data.get("elements"):
+            log.warning(f"Skipping empty chapter: {chapter_data.get('title', 'Untitled')}")
+            continue
+        yield i, {**chapter_data, "elements": list(chapter_data["elements"])}
+
+def book_sections(ast):
+    """Returns (index, section) for every non-empty section in spine order."""
+    return list(iter_book_sections(ast.get("frontmatter", []) + ast.get("chapters", []) + ast.get("backmatter", [])))
+
+def load_stylesheet():
+    if os.path.exists(config.CSS_STYLE_PATH):
+        with open(config.CSS_STYLE_PATH, "r", encoding="utf-8") as f:
+            return f.read()
+    return ""  # Default to empty string
+
+def write_book(ast, epub_path, backend=None, render_cache=None, figures=None):
+    """
+    Renders the AST's sections and packages them as an EPUB at `epub_path`.
+
+    Args:
+        backend: "ebooklib" builds the whole book in memory before writing it;
+                 "stream" writes chapters and images into the archive as they
+                 are rendered. Defaults to `config.EPUB_BACKEND`.
+        render_cache: A StageCache whose per-chapter entries hold previously
+                      rendered XHTML; unchanged chapters are not re-rendered.
+        figures: Transcoded images by source path (see `process_figures`),
+                 packaged in place of the extracted originals.
+
+    Returns:
+        The EPUB path, or None if there was no content to package.
+    """
+    if backend is None:
+        backend = config.EPUB_BACKEND
+    if backend == "stream":
+        return write_book_streaming(ast, epub_path, render_cache, figures)
+    if backend != "ebooklib":
+        raise ValueError(f"Unknown EPUB backend: {backend!r}")
+    # Only this backend needs ebooklib (and lxml)
+    from ebooklib import epub
 
     # Create a new EPUB book
     book = epub.EpubBook()
-    book.set_identifier("id123456")
+    book.set_identifier(BOOK_IDENTIFIER)
     book.set_title(ast.get("metadata", {}).get("title", "Untitled Book"))
     book.set_language("en")
 
@@ -36,34 +242,26 @@ def main():
         book.add_author(author)
 
     # Add CSS stylesheet
-    style_content = ""  # Default to empty string
-    if os.path.exists(config.CSS_STYLE_PATH):
-        with open(config.CSS_STYLE_PATH, "r", encoding="utf-8") as f:
-            style_content = f.read()
-    
     style_item = epub.EpubItem(
         uid="style_main",
         file_name="style/main.css",
         media_type="text/css",
-        content=style_content,
+        content=load_stylesheet(),
     )
     book.add_item(style_item)
 
     # Process and add chapters
     chapters_to_add = []
-    all_sections = ast.get("frontmatter", []) + ast.get("chapters", []) + ast.get("backmatter", [])
+    to_render = book_sections(ast)
+    image_count = add_images(book, [chapter_data for _, chapter_data in to_render], figures)
 
-    for i, chapter_data in enumerate(all_sections):
-        # Skip empty chapters
-        if not chapter_data.get("elements"):
-            print(f"[WARN] Skipping empty chapter: {chapter_data.get('title', 'Untitled')}")
-            continue
+    log.info(f"Rendering {len(to_render)} chapters...")
+    rendered = _iter_rendered([chapter_data for _, chapter_data in to_render], render_cache)
 
-        html_content = render_chapter(env, chapter_data)
-        
+    for (i, chapter_data), html_content in zip(to_render, rendered):
         # Another check to ensure we don't add empty content
         if not html_content.strip():
-            print(f"[WARN] Skipping chapter with empty rendered content: {chapter_data.get('title', 'Untitled')}")
+            log.warning(f"Skipping chapter with empty rendered content: {chapter_data.get('title', 'Untitled')}")
             continue
             
         file_name = f"chapter_{i}.xhtml"
@@ -71,7 +269,8 @@ def main():
         epub_chapter = epub.EpubHtml(
             title=chapter_data["title"],
             file_name=file_name,
-            content=html_content,
+            # As bytes: ebooklib cannot parse a str with an XML declaration and writes an empty chapter
+            content=html_content.encode("utf-8"),
             lang="en"
         )
         epub_chapter.add_item(style_item)
@@ -79,8 +278,8 @@ def main():
         chapters_to_add.append(epub_chapter)
 
     if not chapters_to_add:
-        print("[ERROR] No content to add to the EPUB. Aborting.")
-        return
+        log.error("No content to add to the EPUB. Aborting.")
+        return None
 
     # Define the book spine
     book.spine = chapters_to_add
@@ -93,10 +292,132 @@ def main():
     book.add_item(epub.EpubNav())
 
     # Write the EPUB file
-    print("[INFO] Writing EPUB file...")
-    epub.write_epub(config.EPUB_PATH, book, {"epub3_pages": False})
+    log.info("Writing EPUB file...")
+    with step("zip"):
+        epub.write_epub(epub_path, book, {"epub3_pages": False})
+    count("generate_epub", chapters=len(chapters_to_add), images=image_count)
+    return epub_path
+
+def write_book_streaming(ast, epub_path, render_cache=None, figures=None):
+    """
+    Streaming counterpart of `write_book`: each chapter is rendered and
+    written into the archive before the next one, and images are copied in
+    chunks, so peak memory is bounded by the largest single chapter rather
+    than the whole book.
+    """
+    to_render = book_sections(ast)
+    log.info(f"Streaming {len(to_render)} chapters into {epub_path}...")
+    return stream_sections(to_render, epub_path, ast.get("metadata", {}), render_cache, ImageCollector(figures))
+
+def stream_sections(sections, epub_path, metadata, render_cache=None, images=None):
+    """
+    Renders (index, section) pairs, given in spine order, and writes them
+    into an EPUB as they arrive, together with the images they reference.
+
+    `sections` may be a generator that is still producing later chapters
+    (see `pipeline.convert(pipelined=True)`). `images` is the ImageCollector
+    the figures are packaged through; its figure map may be extended while
+    sections arrive.
+
+    Returns:
+        The EPUB path, or None if there was no content to package.
+    """
+    if images is None:
+        images = ImageCollector()
+    pending = deque()  # (index, title) of sections handed to the renderer, in order
+    image_count = 0
+
+    def with_images():
+        nonlocal image_count
+        for i, chapter_data in sections:
+            # Images go in before the chapter is rendered, which rewrites figures to their hrefs
+            for href, path, media_type in images.collect([chapter_data]):
+                with step("zip"):
+                    writer.add_image_file(href, path, media_type)
+                image_count += 1
+            pending.append((i, chapter_data["title"]))
+            yield chapter_data
+
+    written = 0
+    # Write to a temporary name so a failed run never leaves a truncated EPUB behind
+    tmp_path = f"{epub_path}.part"
+    with StreamingEpubWriter(
+        tmp_path,
+        title=metadata.get("title", "Untitled Book"),
+        language="en",
+        identifier=BOOK_IDENTIFIER,
+        author=metadata.get("author"),
+    ) as writer:
+        writer.add_stylesheet("style/main.css", load_stylesheet())
+        for html_content in _iter_rendered(with_images(), render_cache):
+            i, title = pending.popleft()
+            # Another check to ensure we don't add empty content
+            if not html_content.strip():
+                log.warning(f"Skipping chapter with empty rendered content: {title}")
+                continue
+            with step("zip"):
+                writer.add_chapter(f"chapter_{i}.xhtml", title, html_content)
+            written += 1
+
+        with step("zip"):
+            writer.close()
+    if image_count:
+        log.info(f"Packaged {image_count} distinct images.")
+    count("generate_epub", chapters=written, images=image_count)
+
+    if not written:
+        os.remove(tmp_path)
+        log.error("No content to add to the EPUB. Aborting.")
+        return None
+    os.replace(tmp_path, epub_path)
+    return epub_path
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Render the AST and package it as an EPUB.")
+    parser.add_argument(
+        "--backend", choices=["ebooklib", "stream"], default=config.EPUB_BACKEND,
+        help="Packaging backend: build the book in memory (ebooklib) or stream it into the zip (stream)."
+    )
+    parser.add_argument("--force", action="store_true", help="Re-render every chapter and repackage even if inputs are unchanged.")
+    add_logging_args(parser)
+    add_profiling_args(parser)
+    return parser.parse_args(argv)
+
+def run(args):
+    cache = StageCache("epub")
+    inputs = {
+        "ast": file_hash(config.AST_PATH),
+        "template": template_fingerprint(),
+        "css": file_hash(config.CSS_STYLE_PATH),
+        "figures": file_hash(config.FIGURES_PATH),
+        "backend": args.backend,
+    }
+    outputs = [config.EPUB_PATH]
+    if cache.skip_if_fresh(inputs, outputs, force=args.force):
+        return
+
+    log.info("Loading AST...")
+    ast = load_ast(config.AST_PATH)
     
-    print(f"[INFO] EPUB saved to {config.EPUB_PATH}")
+    # Create output dir if it doesn't exist
+    Path(config.OUTPUT_DIR).mkdir(exist_ok=True)
+
+    render_cache = None if args.force else cache
+    figures = load_figures(config.FIGURES_PATH)
+    try:
+        result = write_book(ast, config.EPUB_PATH, backend=args.backend, render_cache=render_cache, figures=figures)
+    except FileNotFoundError as e:
+        log.error(f"{e}. Re-run process_figures, or ingest_extract if the extracted images are gone.")
+        sys.exit(1)
+    if result:
+        log.info(f"EPUB saved to {config.EPUB_PATH}")
+        cache.save(inputs, outputs)
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging(args.log_level, args.log_json)
+    with profile_run(args), stage("generate_epub"):
+        run(args)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
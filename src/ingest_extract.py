@@ -1,105 +1,256 @@
 import sys
 import os
+import argparse
 import fitz
 import json
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 from src import config
+from src.cache import StageCache, file_hash
+from src.furniture import furniture_settings
+from src.log import TRACE, ProgressLogger, add_logging_args, get_logger, logging_settings, setup_logging
+from src.profiling import add_profiling_args, count, profile_run, stage, step
+from src.raw_extraction import FORMAT_VERSION, RawExtractionWriter
+
+log = get_logger("ingest")
 
 
 def ensure_output_dir():
     if not os.path.exists(config.OUTPUT_DIR):
         os.makedirs(config.OUTPUT_DIR)
-        print(f"[INFO] Created output directory: {config.OUTPUT_DIR}")
+        log.info(f"Created output directory: {config.OUTPUT_DIR}")
     else:
-        print(f"[INFO] Output directory already exists: {config.OUTPUT_DIR}")
+        log.info(f"Output directory already exists: {config.OUTPUT_DIR}")
+
+class ImageCache:
+    """
+    Content-addressed store for extracted images.
+
+    Each xref is decoded at most once per document handle, and images are
+    written as `img_<sha1>.<ext>`, so identical content stored under several
+    xrefs (or pages) ends up in a single file that every reference points to.
+    Because the name only depends on the bytes, parallel workers with their
+    own caches agree on paths and output stays identical to a serial run.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.by_xref = {}
+        self.by_hash = {}
+
+    def get(self, doc, xref):
+        if xref in self.by_xref:
+            return self.by_xref[xref]
+
+        img_info = doc.extract_image(xref)
+        if not img_info:
+            self.by_xref[xref] = None
+            return None
+
+        img_bytes = img_info["image"]
+        ext = img_info.get("ext", "png")
+        digest = hashlib.sha1(img_bytes).hexdigest()
+        img_path = self.by_hash.get(digest)
+        if img_path is None:
+            img_path = os.path.join(self.output_dir, f"img_{digest}.{ext}")
+            if not os.path.exists(img_path):
+                # Write-then-rename so concurrent workers never expose a partial file
+                tmp_path = f"{img_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(img_bytes)
+                os.replace(tmp_path, img_path)
+                log.debug(f"Saved image to {img_path}")
+            self.by_hash[digest] = img_path
+
+        img_record = {
+            "xref": xref,
+            "path": img_path,
+            "width": img_info.get("width"),
+            "height": img_info.get("height"),
+            "ext": ext,
+            "hash": digest
+        }
+        self.by_xref[xref] = img_record
+        return img_record
+
+def extract_page(doc, page, page_num, image_cache=None):
+    with step("get_text"):
+        text_dict = page.get_text("dict")
+    page_meta = {
+        "number": page_num,
+        "width": page.rect.width,
+        "height": page.rect.height,
+        "rotation": page.rotation,
+    }
+    page_data = {
+        "type": "page",
+        "meta": page_meta,
+        "text_runs": [],
+        "images": []
+    }
+    # Text runs
+    trace = log.isEnabledFor(TRACE)
+    # Each run keeps the index of its PyMuPDF block and line, so prediction
+    # can classify whole lines or blocks instead of single spans
+    for block_index, block in enumerate(text_dict["blocks"]):
+        if block["type"] == 0:  # text
+            for line_index, line in enumerate(block["lines"]):
+                for span in line["spans"]:
+                    run = {
+                        "text": span["text"],
+                        "font": span["font"],
+                        "size": span["size"],
+                        "flags": span["flags"],
+                        "bbox": span["bbox"],
+                        "block": block_index,
+                        "line": line_index
+                    }
+                    page_data["text_runs"].append(run)
+                    if trace:
+                        log.log(TRACE, f"  [TEXT] '{span['text'][:40]}' (font: {span['font']}, size: {span['size']}, bbox: {span['bbox']})")
+    # Image extraction
+    if image_cache is None:
+        image_cache = ImageCache(config.OUTPUT_DIR)
+    with step("images"):
+        images = page.get_images(full=True)
+        for img in images:
+            xref = img[0]
+            try:
+                img_record = image_cache.get(doc, xref)
+                if img_record is None:
+                    log.warning(f"Could not extract image xref {xref} on page {page_num}. Skipping.")
+                    continue
+                page_data["images"].append(dict(img_record))
+            except Exception as img_e:
+                log.error(f"Failed to extract image xref {xref} on page {page_num}: {img_e}")
+    return page_data
 
-def extract_with_pymupdf(pdf_path):
-    print("[INFO] Extracting with PyMuPDF...")
+def extract_page_range(pdf_path, start, end, image_dir):
+    """
+    Extracts pages [start, end) (0-based) using a private document handle.
+
+    This is the unit of work for parallel extraction: every worker process
+    opens its own `fitz` document, since handles cannot be shared across
+    processes. The image directory is passed explicitly because workers
+    started with "spawn" re-import config rather than inheriting it.
+    """
+    doc = fitz.open(pdf_path)
+    image_cache = ImageCache(image_dir)
+    try:
+        return [extract_page(doc, doc[i], i + 1, image_cache) for i in range(start, end)]
+    finally:
+        doc.close()
+
+def page_shards(page_count, workers):
+    """
+    Splits `page_count` pages into contiguous (start, end) ranges.
+
+    Several shards are created per worker so that a few slow pages (large
+    scans, dense tables) do not leave the other workers idle at the end.
+    """
+    shard_size = max(1, -(-page_count // (workers * 4)))
+    return [(start, min(start + shard_size, page_count)) for start in range(0, page_count, shard_size)]
+
+def extract_with_pymupdf(pdf_path, workers=1, image_dir=None):
+    if image_dir is None:
+        image_dir = config.OUTPUT_DIR
+    log.info("Extracting with PyMuPDF...")
     try:
         doc = fitz.open(pdf_path)
         
         # First, yield the outline
         outline = doc.get_toc()
         yield {"type": "outline", "data": outline}
-        print(f"[INFO] PDF outline/bookmarks: {len(outline)} entries")
+        log.info(f"PDF outline/bookmarks: {len(outline)} entries")
 
         # Then, yield each page's data
-        for page_num, page in enumerate(doc, 1):
-            text_dict = page.get_text("dict")
-            page_meta = {
-                "number": page_num,
-                "width": page.rect.width,
-                "height": page.rect.height,
-                "rotation": page.rotation,
-            }
-            page_data = {
-                "type": "page",
-                "meta": page_meta,
-                "text_runs": [],
-                "images": []
-            }
-            # Text runs
-            for block in text_dict["blocks"]:
-                if block["type"] == 0:  # text
-                    for line in block["lines"]:
-                        for span in line["spans"]:
-                            run = {
-                                "text": span["text"],
-                                "font": span["font"],
-                                "size": span["size"],
-                                "bbox": span["bbox"]
-                            }
-                            page_data["text_runs"].append(run)
-                            print(f"  [TEXT] '{span['text'][:40]}' (font: {span['font']}, size: {span['size']}, bbox: {span['bbox']})")
-            # Image extraction
-            images = page.get_images(full=True)
-            for img_idx, img in enumerate(images):
-                xref = img[0]
-                try:
-                    img_info = doc.extract_image(xref)
-                    if not img_info:
-                        print(f"  [WARNING] Could not extract image xref {xref} on page {page_num}. Skipping.")
-                        continue
-                    img_bytes = img_info["image"]
-                    ext = img_info.get("ext", "png")
-                    img_path = os.path.join(config.OUTPUT_DIR, f"page{page_num}_img{img_idx}_xref{xref}.{ext}")
-                    with open(img_path, "wb") as f:
-                        f.write(img_bytes)
-                    img_record = {
-                        "xref": xref,
-                        "path": img_path,
-                        "width": img_info.get("width"),
-                        "height": img_info.get("height"),
-                        "ext": ext
-                    }
-                    page_data["images"].append(img_record)
-                    print(f"  [IMAGE] Saved image to {img_path}")
-                except Exception as img_e:
-                    print(f"  [ERROR] Failed to extract image xref {xref} on page {page_num}: {img_e}")
-            
-            yield page_data
+        progress = ProgressLogger(log, "Extracted pages")
+        if workers > 1 and doc.page_count > 1:
+            shards = page_shards(doc.page_count, workers)
+            doc.close()
+            log.info(f"Extracting {len(shards)} page shards with {workers} workers...")
+            with ProcessPoolExecutor(max_workers=workers, initializer=setup_logging, initargs=logging_settings()) as executor:
+                # A bounded window of shards is in flight, and each shard's
+                # pages are released as they are yielded, so memory does not
+                # grow with the document
+                shard_iter = iter(shards)
+                pending = deque()
+                for start, end in shard_iter:
+                    pending.append(executor.submit(extract_page_range, pdf_path, start, end, image_dir))
+                    if len(pending) >= workers * 2:
+                        break
+                # Shards are consumed in submission order, so pages are yielded in page order
+                while pending:
+                    shard_pages = pending.popleft().result()
+                    shard = next(shard_iter, None)
+                    if shard is not None:
+                        pending.append(executor.submit(extract_page_range, pdf_path, *shard, image_dir))
+                    shard_pages.reverse()
+                    while shard_pages:
+                        page_data = shard_pages.pop()
+                        progress.update(spans=len(page_data["text_runs"]), images=len(page_data["images"]))
+                        count("extract", pages=1, spans=len(page_data["text_runs"]), images=len(page_data["images"]))
+                        yield page_data
+        else:
+            image_cache = ImageCache(image_dir)
+            for page_num, page in enumerate(doc, 1):
+                page_data = extract_page(doc, page, page_num, image_cache)
+                progress.update(spans=len(page_data["text_runs"]), images=len(page_data["images"]))
+                count("extract", pages=1, spans=len(page_data["text_runs"]), images=len(page_data["images"]))
+                yield page_data
+            doc.close()
+        progress.finish()
         
-        print("[INFO] PyMuPDF extraction complete.")
+        log.info("PyMuPDF extraction complete.")
         
     except Exception as e:
-        print(f"[ERROR] PyMuPDF extraction failed: {e}")
+        # Re-raised so callers never take a truncated extraction for a complete one
+        log.error(f"PyMuPDF extraction failed: {e}")
+        raise
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Extract text runs, images and the outline from the input PDF.")
+    parser.add_argument(
+        "--workers", type=int, default=config.EXTRACTION_WORKERS,
+        help="Number of worker processes for page-sharded extraction (1 = serial)."
+    )
+    parser.add_argument("--force", action="store_true", help="Re-extract even if the PDF is unchanged.")
+    add_logging_args(parser)
+    add_profiling_args(parser)
+    return parser.parse_args(argv)
 
-def main():
+def run(args):
     ensure_output_dir()
     if not os.path.exists(config.PDF_PATH):
-        print(f"[ERROR] PDF file not found: {config.PDF_PATH}")
+        log.error(f"PDF file not found: {config.PDF_PATH}")
         sys.exit(1)
 
-    with open(config.RAW_EXTRACTION_PATH, "w", encoding="utf-8") as f_jsonl:
-        for item in extract_with_pymupdf(config.PDF_PATH):
+    cache = StageCache("ingest")
+    # The furniture flags on text runs and images are computed at extraction time
+    inputs = {"pdf": file_hash(config.PDF_PATH), "format": FORMAT_VERSION, "furniture": furniture_settings()}
+    outputs = [config.RAW_EXTRACTION_PATH, config.OUTLINE_PATH]
+    if cache.skip_if_fresh(inputs, outputs, force=args.force):
+        return
+
+    with RawExtractionWriter(config.RAW_EXTRACTION_PATH) as writer:
+        for item in extract_with_pymupdf(config.PDF_PATH, workers=max(1, args.workers)):
             if item.get("type") == "outline":
                 with open(config.OUTLINE_PATH, "w", encoding="utf-8") as f_outline:
                     json.dump(item["data"], f_outline, ensure_ascii=False, indent=2)
-                print(f"[INFO] Saved outline data to {config.OUTLINE_PATH}")
+                log.info(f"Saved outline data to {config.OUTLINE_PATH}")
             elif item.get("type") == "page":
-                f_jsonl.write(json.dumps(item, ensure_ascii=False) + '\n')
+                writer.add_page(item)
     
-    print(f"[INFO] Saved page-by-page extraction data to {config.RAW_EXTRACTION_PATH}")
+    log.info(f"Saved page-by-page extraction data to {config.RAW_EXTRACTION_PATH}")
+    cache.save(inputs, outputs)
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging(args.log_level, args.log_json)
+    with profile_run(args), stage("extract"):
+        run(args)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,125 @@
+import json
+import logging
+import sys
+import time
+
+from src import config
+
+# Root of the pipeline's logger hierarchy; stages log under "pdf2epub.<stage>"
+LOGGER_NAME = "pdf2epub"
+
+# Finer than DEBUG: per-span tracing, off unless explicitly requested
+TRACE = 5
+logging.addLevelName(TRACE, "TRACE")
+
+# Settings applied by the last setup_logging() call, handed to worker processes
+_settings = (None, None)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a single-line JSON object for log pipelines."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        # Structured fields passed as `extra={"fields": {...}}`
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def get_logger(name):
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def setup_logging(level=None, json_format=None):
+    """
+    Configures the pipeline logger. Safe to call more than once (for example
+    from every stage's `main()` or from worker process initializers).
+
+    Args:
+        level: A level name ("TRACE", "DEBUG", "INFO", ...) or number.
+               Defaults to `config.LOG_LEVEL`.
+        json_format: Emit one JSON object per line instead of plain text.
+                     Defaults to `config.LOG_JSON`.
+    """
+    level = config.LOG_LEVEL if level is None else level
+    json_format = config.LOG_JSON if json_format is None else json_format
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+        if not isinstance(level, int):
+            level = logging.INFO
+
+    global _settings
+    _settings = (level, json_format)
+
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level)
+    logger.propagate = False
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+    handler = logging.StreamHandler(sys.stderr)
+    if json_format:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+    logger.addHandler(handler)
+    return logger
+
+
+def logging_settings():
+    """Returns the active (level, json_format) so worker processes can mirror it."""
+    return _settings
+
+
+def add_logging_args(parser):
+    """Adds the shared --log-level/--log-json options to a stage's CLI."""
+    parser.add_argument("--log-level", default=None, help="TRACE, DEBUG, INFO, WARNING or ERROR.")
+    parser.add_argument("--log-json", action="store_true", default=None, help="Emit structured JSON log lines.")
+
+
+class ProgressLogger:
+    """
+    Rate-limited progress summaries for per-page loops.
+
+    `update()` is cheap to call for every item; a summary is only logged when
+    at least `interval` seconds have passed since the previous one. `finish()`
+    always logs the final totals.
+    """
+
+    def __init__(self, logger, label, interval=None):
+        self.logger = logger
+        self.label = label
+        self.interval = config.LOG_PROGRESS_INTERVAL if interval is None else interval
+        self.started = time.perf_counter()
+        self.last_emit = self.started
+        self.count = 0
+        self.totals = {}
+
+    def update(self, n=1, **counts):
+        self.count += n
+        for key, value in counts.items():
+            self.totals[key] = self.totals.get(key, 0) + value
+        now = time.perf_counter()
+        if now - self.last_emit >= self.interval:
+            self.last_emit = now
+            self._emit("progress")
+
+    def finish(self):
+        self._emit("done")
+
+    def _emit(self, status):
+        elapsed = time.perf_counter() - self.started
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        summary = ", ".join(f"{value} {key}" for key, value in self.totals.items())
+        self.logger.info(
+            f"{self.label}: {self.count} processed ({rate:.1f}/s){', ' + summary if summary else ''}",
+            extra={"fields": {"status": status, "label": self.label, "count": self.count,
+                              "elapsed": round(elapsed, 3), **self.totals}},
+        )
@@ -0,0 +1,370 @@
+import os
+import sys
+import json
+import queue
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+
+from src import config
+from src.ingest_extract import extract_with_pymupdf
+from src.predict_layout import GRANULARITIES, check_granularity, iter_page_elements, load_model, predict_batches
+from src.furniture import FurnitureIndex
+from src.font_rules import RuleCascade
+from src.build_ast import assemble_ast, build_ast, iter_chapters, iter_spine, page_figure_paths
+from src.generate_epub import ImageCollector, iter_book_sections, stream_sections, write_book
+from src.process_figures import figure_sources, process_figures
+from src.log import add_logging_args, get_logger, setup_logging
+from src.profiling import Profiler, active_profiler, add_profiling_args, profile_run, profiling, stage
+from src.raw_extraction import RawExtractionWriter
+
+log = get_logger("pipeline")
+
+
+def _tee_jsonl(elements, path, ensure_ascii=True):
+    """Passes elements through unchanged while writing each one as a predicted_layout.jsonl line."""
+    with open(path, "w", encoding="utf-8") as f:
+        for element in elements:
+            f.write(json.dumps(element.to_dict(), ensure_ascii=ensure_ascii) + '\n')
+            yield element
+
+
+def _tee_raw(pages, path):
+    """Passes page records through unchanged while writing them in the columnar raw format."""
+    with RawExtractionWriter(path) as writer:
+        for page_data in pages:
+            writer.add_page(page_data)
+            yield page_data
+
+
+# Queue markers for the end of a threaded stream and for an error in its producer
+_DONE = object()
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def _threaded(items, name, maxsize=None):
+    """
+    Iterates `items` on a background thread and yields its items through a
+    bounded queue, so the producer runs at most `maxsize` items ahead of
+    the consumer (defaults to `config.PIPELINE_QUEUE_SIZE`).
+
+    An exception raised by the producer is re-raised to the consumer. If the
+    consumer stops early, the producer is stopped and `items` closed, which
+    in turn stops any threaded stream it was reading from.
+    """
+    channel = queue.Queue(maxsize or config.PIPELINE_QUEUE_SIZE)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                channel.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    break
+            else:
+                put(_DONE)
+        except BaseException as e:
+            put(_Failure(e))
+        finally:
+            if hasattr(items, "close"):
+                items.close()
+
+    thread = threading.Thread(target=produce, name=f"pipeline-{name}", daemon=True)
+    thread.start()
+    try:
+        while True:
+            # Time blocked on the producer is not this consumer's own work
+            with stage("queue_wait"):
+                item = channel.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def convert(pdf_path, epub_path=None, *, model=None, workers=1,
+            batch_size=None, granularity=None, rules=None, figure_workers=None,
+            backend=None, pipelined=False, intermediates_dir=None, stats=None, profiler=None):
+    """
+    Converts a PDF to an EPUB in one process, passing data between the stages
+    as Python objects instead of re-parsing files.
+
+    Args:
+        pdf_path: The PDF to convert.
+        epub_path: Where to write the EPUB. Defaults to the PDF name with an
+                   .epub suffix in `config.OUTPUT_DIR`.
+        model: A preloaded layout model (see `predict_layout.load_model`);
+               loaded from the config paths when omitted.
+        workers: Worker processes for page extraction.
+        batch_size: Elements per prediction batch.
+        granularity: Classify single spans, lines or blocks ("span", "line"
+                     or "block"; defaults to `config.CLASSIFY_GRANULARITY`).
+        rules: Label obvious body text and headings by font rules before
+               the model (see `font_rules.RuleCascade`; defaults to
+               `config.RULE_CASCADE`). The font statistics are gathered from
+               the batches predicted so far, the current one included.
+        figure_workers: Worker processes for image transcoding.
+        backend: EPUB packaging backend ("ebooklib" or "stream").
+        pipelined: Run extraction, prediction and chapter building on
+                   separate threads connected by bounded queues, so they
+                   overlap. With the "stream" backend, each chapter is also
+                   rendered and packaged as soon as its outline range has
+                   been classified, and its figures' images are transcoded
+                   just before it is packaged.
+        intermediates_dir: If given, also write the usual stage artifacts
+                           (raw_extraction/, outline.json,
+                           predicted_layout.jsonl, ast.json, figures.json)
+                           and extracted images there, for debugging.
+        stats: Optional dict filled with per-stage wall times (seconds,
+               under "timings"), page/element/chapter/furniture-run counts
+               and the number of elements labeled by rules.
+        profiler: A Profiler to record stages, sub-steps and counts into;
+                  defaults to the active profiler, or a private one.
+
+    Returns:
+        The EPUB path, or None if the document produced no content.
+    """
+    pdf_path = Path(pdf_path)
+    if epub_path is None:
+        epub_path = Path(config.OUTPUT_DIR) / f"{pdf_path.stem}.epub"
+    epub_path = Path(epub_path)
+    epub_path.parent.mkdir(parents=True, exist_ok=True)
+
+    if stats is None:
+        stats = {}
+    if profiler is None:
+        profiler = active_profiler() or Profiler()
+
+    with profiling(profiler):
+        return _convert(pdf_path, epub_path, model, workers, batch_size, granularity, rules, figure_workers,
+                        backend, pipelined, intermediates_dir, stats, profiler)
+
+
+def _convert(pdf_path, epub_path, model, workers, batch_size, granularity, rules, figure_workers,
+             backend, pipelined, intermediates_dir, stats, profiler):
+    if model is None:
+        with profiler.stage("load_model"):
+            model = load_model()
+    check_granularity(model, granularity)
+
+    with tempfile.TemporaryDirectory(prefix="pdf2epub-") as tmp_dir:
+        # Images must outlive extraction until packaging, so they go to the
+        # intermediates directory if kept, otherwise to a scratch directory.
+        work_dir = Path(intermediates_dir) if intermediates_dir else Path(tmp_dir)
+        work_dir.mkdir(parents=True, exist_ok=True)
+
+        items = profiler.iterate("extract", extract_with_pymupdf(pdf_path, workers=workers, image_dir=work_dir))
+        first = next(items, None)
+        if first is None or first.get("type") != "outline":
+            log.error(f"Extraction produced no data for {pdf_path}. Aborting.")
+            return None
+        outline = first["data"]
+
+        page_count = 0
+        furniture_runs = 0
+        figures_by_page = {}  # page number -> image paths, consumed as the AST is built
+        # Pages are tagged as they arrive, so furniture is only recognized
+        # once it has repeated; the first few occurrences are classified
+        furniture = FurnitureIndex()
+        def pages():
+            nonlocal page_count, furniture_runs
+            for item in items:
+                if item.get("type") == "page":
+                    page_count += 1
+                    furniture_runs += furniture.tag_page(item)
+                    figures_by_page[item["meta"]["number"]] = page_figure_paths(item["images"])
+                    yield item
+
+        page_stream = pages()
+        if intermediates_dir:
+            with open(work_dir / config.OUTLINE_PATH.name, "w", encoding="utf-8") as f:
+                json.dump(outline, f, ensure_ascii=False, indent=2)
+            page_stream = _tee_raw(page_stream, work_dir / config.RAW_EXTRACTION_PATH.name)
+        if pipelined:
+            page_stream = _threaded(page_stream, "extract")
+
+        # Pulling a batch may pull pages from extraction; the profiler
+        # subtracts that nested extract time from predict
+        cascade = (RuleCascade(learn=True, classes=model.classes_)
+                   if (config.RULE_CASCADE if rules is None else rules) else None)
+        predicted = profiler.iterate("predict", predict_batches(
+            iter_page_elements(page_stream, granularity=granularity),
+            model, batch_size, cascade
+        ))
+        if pipelined:
+            # Whole batches cross the thread boundary, not single elements
+            predicted = _threaded(predicted, "predict")
+        elements = (element for batch in predicted for element in batch)
+        if intermediates_dir:
+            elements = _tee_jsonl(elements, work_dir / config.PREDICTED_LAYOUT_PATH.name)
+
+        if pipelined:
+            result, ast, element_count, figures = _package_pipelined(
+                outline, elements, epub_path, lambda: page_count, figures_by_page,
+                figure_workers, backend, profiler)
+        else:
+            # The AST needs every element and the final page count, so drain the stream here
+            elements = list(elements)
+            element_count = len(elements)
+
+            with profiler.stage("build_ast"):
+                ast = build_ast(outline, elements, page_count, figures_by_page)
+            with profiler.stage("figures"):
+                figures = process_figures(figure_sources(_sections(ast)), workers=figure_workers)
+            with profiler.stage("generate_epub"):
+                result = write_book(ast, epub_path, backend=backend, figures=figures)
+
+        if intermediates_dir:
+            with open(work_dir / config.AST_PATH.name, "w", encoding="utf-8") as f:
+                json.dump(ast, f, ensure_ascii=False, indent=2)
+            with open(work_dir / config.FIGURES_PATH.name, "w", encoding="utf-8") as f:
+                json.dump(figures, f, ensure_ascii=False, indent=2)
+
+        stats["timings"] = {name: record["wall"] for name, record in profiler.stages.items()}
+        stats["pages"] = page_count
+        stats["elements"] = element_count
+        stats["furniture_runs"] = furniture_runs
+        stats["ruled"] = cascade.ruled if cascade is not None else 0
+        if cascade is not None:
+            log.info(cascade.report())
+        stats["chapters"] = sum(len(ast[k]) for k in ("frontmatter", "chapters", "backmatter"))
+        return result
+
+
+def _sections(ast):
+    return [section for kind in ("frontmatter", "chapters", "backmatter") for section in ast[kind]]
+
+
+def _package_pipelined(outline, elements, epub_path, page_count, figures_by_page,
+                       figure_workers, backend, profiler):
+    """
+    Builds chapters from the stream of predicted `elements` as their outline
+    ranges complete. With the streaming backend each chapter
+    is rendered and packaged right away, in spine order; otherwise the book
+    is written once every chapter is built.
+
+    Returns:
+        (EPUB path or None, AST, element count, figure map)
+    """
+    if backend is None:
+        backend = config.EPUB_BACKEND
+    element_count = 0
+    chapters = [None] * len(outline)
+
+    def counted(items):
+        nonlocal element_count
+        for item in items:
+            element_count += 1
+            yield item
+
+    def built():
+        for index, chapter in profiler.iterate("build_ast", iter_chapters(outline, counted(elements), figures_by_page)):
+            chapters[index] = chapter
+            yield index, chapter
+
+    if backend == "stream":
+        images = ImageCollector()
+
+        def with_figures(sections):
+            # Only the images figures refer to are needed before their chapter is packaged
+            for i, chapter_data in sections:
+                srcs = figure_sources([chapter_data])
+                if srcs:
+                    with profiler.stage("figures"):
+                        images.figures.update(process_figures(srcs, workers=figure_workers))
+                yield i, chapter_data
+
+        with profiler.stage("generate_epub"):
+            result = stream_sections(with_figures(iter_book_sections(iter_spine(outline, built()))),
+                                     epub_path, {}, images=images)
+        figures = images.figures
+    else:
+        for _ in built():
+            pass
+        with profiler.stage("figures"):
+            figures = process_figures(figure_sources(chapters), workers=figure_workers)
+        result = None
+
+    # The document length is only known once extraction has finished
+    ast = assemble_ast(outline, chapters, page_count())
+    if backend != "stream":
+        with profiler.stage("generate_epub"):
+            result = write_book(ast, epub_path, backend=backend, figures=figures)
+    return result, ast, element_count, figures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a PDF to EPUB in a single in-memory pipeline run.")
+    parser.add_argument("pdf", nargs="?", default=str(config.PDF_PATH), help="Input PDF (defaults to config.PDF_PATH).")
+    parser.add_argument("-o", "--output", default=None, help="Output EPUB path.")
+    parser.add_argument("--workers", type=int, default=config.EXTRACTION_WORKERS,
+                        help="Worker processes for page extraction.")
+    parser.add_argument("--batch-size", type=int, default=config.PREDICTION_BATCH_SIZE,
+                        help="Elements per prediction batch (0 = whole document).")
+    parser.add_argument("--n-jobs", type=int, default=config.PREDICTION_N_JOBS,
+                        help="Threads the classifier uses per prediction batch (-1 = all cores).")
+    parser.add_argument("--granularity", choices=GRANULARITIES, default=config.CLASSIFY_GRANULARITY,
+                        help="Classify single text spans, whole lines or whole PyMuPDF blocks.")
+    parser.add_argument("--no-rules", dest="rules", action="store_false", default=config.RULE_CASCADE,
+                        help="Send every element to the model instead of labeling obvious body text "
+                             "and headings by font rules.")
+    parser.add_argument("--figure-workers", type=int, default=config.FIGURE_WORKERS,
+                        help="Worker processes for image transcoding.")
+    parser.add_argument("--backend", choices=["ebooklib", "stream"], default=config.EPUB_BACKEND,
+                        help="EPUB packaging backend.")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="Overlap extraction, prediction and chapter building on separate threads "
+                             "(with --backend stream, also rendering and packaging).")
+    parser.add_argument("--keep-intermediates", metavar="DIR", default=None,
+                        help="Also write the per-stage JSON artifacts and images to DIR.")
+    add_logging_args(parser)
+    add_profiling_args(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging(args.log_level, args.log_json)
+    if not os.path.exists(args.pdf):
+        log.error(f"PDF file not found: {args.pdf}")
+        sys.exit(1)
+
+    with profile_run(args):
+        with stage("load_model"):
+            model = load_model(n_jobs=args.n_jobs)
+        epub_path = convert(
+            args.pdf,
+            args.output,
+            model=model,
+            workers=max(1, args.workers),
+            batch_size=args.batch_size,
+            granularity=args.granularity,
+            rules=args.rules,
+            figure_workers=args.figure_workers,
+            backend=args.backend,
+            pipelined=args.pipelined,
+            intermediates_dir=args.keep_intermediates,
+        )
+    if epub_path is None:
+        sys.exit(1)
+    log.info(f"EPUB saved to {epub_path}")
+
+
+if __name__ == "__main__":
+    main()
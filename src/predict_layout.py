@@ -1,79 +1,406 @@
 import json
-import pandas as pd
-import joblib
-import os
-import fitz # PyMuPDF
+import argparse
+from itertools import groupby, islice
+from pathlib import Path
 
-from features import featurize
+from src.elements import Element, intern_font
+from src.features import featurize, model_features
 from src import config
+from src.font_rules import FontStats, RuleCascade, rule_settings
+from src.cache import StageCache, file_hash, json_hash
+from src.log import ProgressLogger, add_logging_args, get_logger, setup_logging
+from src.profiling import add_profiling_args, count, profile_run, stage, step
+from src.raw_extraction import RawExtraction, is_columnar
 
-def get_page_dimensions(pdf_path):
-    doc = fitz.open(pdf_path)
-    dims = [(p.rect.width, p.rect.height) for p in doc]
-    doc.close()
-    return dims
+log = get_logger("predict")
 
-def process_raw_blocks(raw_path, page_dims):
-    elements = []
+def read_raw_pages(raw_path):
+    """
+    Yields page records from a raw extraction: the columnar directory
+    ingest_extract writes (read page by page from memory-mapped columns), or
+    a JSONL file of page records read one line at a time.
+    """
+    if is_columnar(raw_path):
+        yield from RawExtraction(raw_path).pages()
+        return
     with open(raw_path, "r", encoding="utf-8") as f:
         for line in f:
             page_data = json.loads(line)
-            if page_data.get("type") != "page":
-                continue
-            
-            page_num = page_data["meta"]["number"]
-            width, height = page_dims[page_num - 1] if page_num <= len(page_dims) else (1, 1)
-            
-            for run in page_data.get("text_runs", []):
-                elements.append({
-                    "id": f"p{page_num}_b{len(elements)}",
-                    "type": "", # To be predicted
-                    "text": run["text"],
-                    "bbox": run["bbox"],
-                    "page_width": width,
-                    "page_height": height,
-                    "doc_name": os.path.basename(config.PDF_PATH)
-                })
+            if page_data.get("type") == "page":
+                yield page_data
+
+GRANULARITIES = ("span", "line", "block")
+
+# PyMuPDF span flag for bold text
+BOLD_FLAG = 16
+
+def group_runs(runs, granularity="span"):
+    """
+    Groups a page's text runs into the units to classify.
+
+    "span" keeps every run on its own. "line" and "block" join the runs of
+    each PyMuPDF line or block (spans of a line are concatenated, lines of a
+    block are joined with spaces) and cover them with one bounding box.
+    Font statistics are aggregated per unit: the font with the most
+    characters, the character-weighted mean size, the fraction of characters
+    set in bold and the number of spans.
+
+    Yields:
+        Dicts with "text", "bbox", "font", "size", "bold" and "spans".
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity: {granularity!r} (expected one of {', '.join(GRANULARITIES)})")
+    if granularity == "span":
+        for run in runs:
+            yield {
+                "text": run["text"],
+                "bbox": run["bbox"],
+                "font": run.get("font"),
+                "size": run.get("size", 0.0),
+                "bold": 1.0 if run.get("flags", 0) & BOLD_FLAG else 0.0,
+                "spans": 1,
+            }
+        return
+
+    if runs and "block" not in runs[0]:
+        raise ValueError("Text runs have no block/line ids; re-run ingest_extract to classify by line or block.")
+    unit_key = (lambda run: run["block"]) if granularity == "block" else (lambda run: (run["block"], run["line"]))
+    for _, unit in groupby(runs, key=unit_key):
+        unit = list(unit)
+        lines = [
+            "".join(run["text"] for run in line_runs)
+            for _, line_runs in groupby(unit, key=lambda run: run["line"])
+        ]
+        weights = [max(1, len(run["text"])) for run in unit]
+        total = sum(weights)
+        font_chars = {}
+        for run, weight in zip(unit, weights):
+            font_chars[run.get("font")] = font_chars.get(run.get("font"), 0) + weight
+        yield {
+            "text": " ".join(line.strip() for line in lines if line.strip()) if len(lines) > 1 else lines[0],
+            "bbox": [
+                min(run["bbox"][0] for run in unit),
+                min(run["bbox"][1] for run in unit),
+                max(run["bbox"][2] for run in unit),
+                max(run["bbox"][3] for run in unit),
+            ],
+            "font": max(font_chars, key=font_chars.get),
+            "size": round(sum(run.get("size", 0.0) * w for run, w in zip(unit, weights)) / total, 2),
+            "bold": round(sum(w for run, w in zip(unit, weights) if run.get("flags", 0) & BOLD_FLAG) / total, 3),
+            "spans": len(unit),
+        }
+
+def iter_page_elements(pages, start_index=0, granularity=None):
+    """
+    Flattens page records into `Element`s awaiting prediction, one per
+    span, line or block depending on `granularity` (see `group_runs`).
+
+    Element ids number the elements across the whole document
+    ("p<page>_b<index>"), so they do not depend on how the stream is later
+    batched.
+
+    Runs tagged as page furniture (running headers, footers and page
+    numbers, see `furniture.FurnitureIndex`) are dropped here, so they are
+    never featurized or classified.
+    """
+    if granularity is None:
+        granularity = config.CLASSIFY_GRANULARITY
+    index = start_index
+    for page_data in pages:
+        # Page dimensions were recorded at extraction time, so the PDF itself is never needed here
+        meta = page_data["meta"]
+        page_num = meta["number"]
+        # One float object shared by every element of the page
+        height = float(meta.get("height") or 1)
+        runs = page_data.get("text_runs", [])
+        content = [run for run in runs if not run.get("furniture")]
+        if len(content) < len(runs):
+            count("predict", furniture=len(runs) - len(content))
+
+        for unit in group_runs(content, granularity):
+            yield Element(page_num, index, unit["text"], tuple(unit["bbox"]), intern_font(unit["font"]),
+                          unit["size"], unit["bold"], unit["spans"], granularity, height)
+            index += 1
+
+def process_raw_blocks(raw_path):
+    return list(iter_page_elements(read_raw_pages(raw_path)))
+
+def batched(iterable, size):
+    """Yields lists of up to `size` items; a size of 0 or less yields everything as one list."""
+    iterator = iter(iterable)
+    if size <= 0:
+        batch = list(iterator)
+        if batch:
+            yield batch
+        return
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def load_model(path=None, mmap=None, n_jobs=None):
+    """
+    Loads the layout classifier as one estimator that scales and classifies
+    feature frames (an sklearn Pipeline).
+
+    Args:
+        path: The pipeline artifact (defaults to `config.LAYOUT_MODEL_PATH`).
+              If it does not exist, the separate classifier and scaler written
+              by older versions are loaded and combined.
+        mmap: Memory-map the model's arrays instead of reading them into
+              memory (defaults to `config.MODEL_MMAP`). Needs an uncompressed
+              artifact, which is what train_layout_model writes.
+        n_jobs: Threads the classifier uses per prediction batch (defaults to
+                `config.PREDICTION_N_JOBS`).
+    """
+    # Unpickling the model imports scikit-learn anyway; importing it here keeps
+    # it out of stages and tools that never load a model
+    import joblib
+    from sklearn.pipeline import Pipeline
+
+    path = Path(path or config.LAYOUT_MODEL_PATH)
+    mmap_mode = "r" if (config.MODEL_MMAP if mmap is None else mmap) else None
+    if path.exists():
+        model = joblib.load(path, mmap_mode=mmap_mode)
+    else:
+        log.info(f"No layout pipeline at {path}; using {config.MODEL_OUTPUT_PATH} and {config.SCALER_OUTPUT_PATH}.")
+        model = Pipeline([
+            ("scaler", joblib.load(config.SCALER_OUTPUT_PATH, mmap_mode=mmap_mode)),
+            ("classifier", joblib.load(config.MODEL_OUTPUT_PATH, mmap_mode=mmap_mode)),
+        ])
+    classifier = model[-1]
+    if "n_jobs" in classifier.get_params():
+        classifier.set_params(n_jobs=config.PREDICTION_N_JOBS if n_jobs is None else n_jobs)
+    return model
+
+def check_granularity(model, granularity):
+    """
+    Warns when elements are classified at a granularity other than the one
+    the model was trained on (recorded by train_layout_model; models from
+    older versions were trained on spans).
+    """
+    if granularity is None:
+        granularity = config.CLASSIFY_GRANULARITY
+    trained = getattr(model, "training_granularity", "span")
+    if granularity != trained:
+        log.warning(f"The layout model was trained on {trained} elements; {granularity} elements differ in size "
+                    f"and text length, so expect less accurate labels.")
+
+def model_fingerprint(path=None):
+    """Hash of the model files `load_model` would read."""
+    path = Path(path or config.LAYOUT_MODEL_PATH)
+    if path.exists():
+        return file_hash(path)
+    return json_hash([file_hash(config.MODEL_OUTPUT_PATH), file_hash(config.SCALER_OUTPUT_PATH)])
+
+def predict_batch(elements, model, cascade=None):
+    """
+    Featurizes and classifies one batch of elements in place.
+
+    With a `cascade` (see `font_rules.RuleCascade`), elements the font rules
+    label with certainty skip featurization and the model, and the model's
+    low-confidence predictions fall back to a tentative rule label.
+    """
+    if cascade is None:
+        with step("featurize"):
+            df = featurize(elements)
+
+            # Only the feature columns the model was trained on, not the label
+            features = model_features(df, model)
+
+        with step("predict"):
+            predictions = model.predict(features)
+        count("predict", elements=len(elements))
+
+        for element, prediction in zip(elements, predictions):
+            finalize_element(element, prediction)
+        return elements
+
+    with step("rules"):
+        labels, tentative = cascade.label(elements)
+    pending = [i for i, label in enumerate(labels) if label is None]
+    fallbacks = 0
+    if pending:
+        with step("featurize"):
+            features = model_features(featurize([elements[i] for i in pending]), model)
+        with step("predict"):
+            probabilities = model.predict_proba(features)
+        best = probabilities.argmax(axis=1)
+        confident = probabilities[range(len(pending)), best] >= cascade.min_confidence
+        for i, label, sure in zip(pending, model.classes_[best], confident.tolist()):
+            if not sure and tentative[i] is not None:
+                label = tentative[i]
+                fallbacks += 1
+            labels[i] = label
+    cascade.ruled += len(elements) - len(pending)
+    cascade.modeled += len(pending)
+    cascade.fallbacks += fallbacks
+    count("predict", elements=len(elements), ruled=len(elements) - len(pending), fallbacks=fallbacks)
+
+    for element, label in zip(elements, labels):
+        finalize_element(element, label)
     return elements
 
-def main():
-    print("[INFO] Loading model and scaler...")
-    model = joblib.load(config.MODEL_OUTPUT_PATH)
-    scaler = joblib.load(config.SCALER_OUTPUT_PATH)
+def finalize_element(element, label):
+    element.type = label
+
+def predict_elements(elements, model, batch_size=None, cascade=None):
+    """
+    Classifies a stream of elements in fixed-size batches.
+
+    Only one batch is featurized and held in memory at a time, so peak memory
+    depends on `batch_size` rather than on the document length.
+    """
+    for predicted in predict_batches(elements, model, batch_size, cascade):
+        yield from predicted
+
+def predict_batches(elements, model, batch_size=None, cascade=None):
+    """Like `predict_elements`, but yields each classified batch as a list."""
+    if batch_size is None:
+        batch_size = config.PREDICTION_BATCH_SIZE
+    progress = ProgressLogger(log, "Predicted elements")
+    for batch in batched(elements, batch_size):
+        yield predict_batch(batch, model, cascade)
+        progress.update(len(batch), batches=1)
+    progress.finish()
+
+def page_cache_key(page_data, model_key, granularity="span"):
+    """
+    Key for a page's predictions: everything featurize sees for the page
+    (its text runs and height), the granularity they are grouped at and the
+    model fingerprint.
+    """
+    meta = page_data["meta"]
+    return json_hash([model_key, granularity, meta.get("height"), page_data.get("text_runs", [])])
 
-    print(f"[INFO] Getting page dimensions from {config.PDF_PATH}...")
-    page_dims = get_page_dimensions(config.PDF_PATH)
+def predict_pages_incremental(pages, model, cache, model_key, batch_size=None, granularity=None,
+                              cascade=None):
+    """
+    Like `predict_elements`, but reuses cached labels for pages whose content
+    and model are unchanged, and only featurizes and predicts the rest.
 
-    print(f"[INFO] Processing raw blocks from {config.RAW_EXTRACTION_PATH}...")
-    elements = process_raw_blocks(config.RAW_EXTRACTION_PATH, page_dims)
-    
-    if not elements:
-        print("[ERROR] No elements found to predict. Aborting.")
+    Pages are buffered until `batch_size` elements are pending, cached or
+    not, then the uncached ones are predicted together and all are yielded
+    in page order, so memory stays bounded on fully cached reruns too.
+    """
+    if batch_size is None:
+        batch_size = config.PREDICTION_BATCH_SIZE
+    if granularity is None:
+        granularity = config.CLASSIFY_GRANULARITY
+    pending = []  # (cache key, elements, cached labels or None)
+    stats = {"reused": 0, "predicted": 0}
+
+    def flush():
+        to_predict = [el for _, els, labels in pending if labels is None for el in els]
+        if to_predict:
+            predict_batch(to_predict, model, cascade)
+        for key, els, labels in pending:
+            if labels is None:
+                cache.put_unit(key, [el.type for el in els])
+                stats["predicted"] += len(els)
+            else:
+                for element, label in zip(els, labels):
+                    finalize_element(element, label)
+                stats["reused"] += len(els)
+                count("predict", reused=len(els))
+            yield from els
+        pending.clear()
+
+    index = 0
+    buffered = 0
+    for page_data in pages:
+        els = list(iter_page_elements([page_data], start_index=index, granularity=granularity))
+        index += len(els)
+        key = page_cache_key(page_data, model_key, granularity)
+        labels = cache.get_unit(key)
+        if labels is not None and len(labels) != len(els):
+            labels = None
+        pending.append((key, els, labels))
+        buffered += len(els)
+        if batch_size > 0 and buffered >= batch_size:
+            yield from flush()
+            buffered = 0
+    yield from flush()
+    log.info(f"Reused cached labels for {stats['reused']} elements, predicted {stats['predicted']}.")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Classify extracted text runs with the layout model.")
+    parser.add_argument(
+        "--batch-size", type=int, default=config.PREDICTION_BATCH_SIZE,
+        help="Elements featurized and predicted per batch (0 = whole document at once)."
+    )
+    parser.add_argument(
+        "--n-jobs", type=int, default=config.PREDICTION_N_JOBS,
+        help="Threads the classifier uses per batch (-1 = all cores)."
+    )
+    parser.add_argument(
+        "--granularity", choices=GRANULARITIES, default=config.CLASSIFY_GRANULARITY,
+        help="Classify single text spans, whole lines or whole PyMuPDF blocks."
+    )
+    parser.add_argument(
+        "--no-rules", dest="rules", action="store_false", default=config.RULE_CASCADE,
+        help="Send every element to the model instead of labeling obvious body text and headings by font rules."
+    )
+    parser.add_argument("--force", action="store_true", help="Ignore cached predictions and re-predict every page.")
+    add_logging_args(parser)
+    add_profiling_args(parser)
+    return parser.parse_args(argv)
+
+def document_font_stats(raw_path):
+    """The font statistics of a whole raw extraction (see `font_rules.FontStats`)."""
+    if is_columnar(raw_path):
+        return FontStats.from_extraction(RawExtraction(raw_path))
+    return FontStats.from_pages(read_raw_pages(raw_path))
+
+def run(args):
+    cache = StageCache("predict")
+    model_key = model_fingerprint()
+    inputs = {"raw": file_hash(config.RAW_EXTRACTION_PATH), "model": model_key, "granularity": args.granularity,
+              "rules": args.rules and [rule_settings(), config.CASCADE_MIN_CONFIDENCE]}
+    outputs = [config.PREDICTED_LAYOUT_PATH]
+    if cache.skip_if_fresh(inputs, outputs, force=args.force):
         return
 
-    print(f"[INFO] Generating features for {len(elements)} blocks...")
-    df = featurize(elements)
-    
-    # We only need the feature columns, not the label
-    features = df.drop("label", axis=1)
-    
-    print("[INFO] Scaling features...")
-    features_scaled = scaler.transform(features)
-    
-    print("[INFO] Predicting labels...")
-    predictions = model.predict(features_scaled)
-    
-    print("[INFO] Saving predictions...")
+    log.info("Loading layout model...")
+    model = load_model(n_jobs=args.n_jobs)
+    check_granularity(model, args.granularity)
+
+    cascade = None
+    if args.rules:
+        with step("font_stats"):
+            cascade = RuleCascade(document_font_stats(config.RAW_EXTRACTION_PATH), classes=model.classes_)
+        # A page's labels depend on the document's statistics as much as on the model
+        model_key = json_hash([model_key, cascade.fingerprint()])
+
+    log.info(f"Processing raw blocks from {config.RAW_EXTRACTION_PATH}...")
+    if next(iter_page_elements(read_raw_pages(config.RAW_EXTRACTION_PATH), granularity=args.granularity), None) is None:
+        log.error("No elements found to predict. Aborting.")
+        return
+
+    pages = read_raw_pages(config.RAW_EXTRACTION_PATH)
+    if args.force:
+        elements = predict_elements(iter_page_elements(pages, granularity=args.granularity), model, args.batch_size,
+                                    cascade)
+    else:
+        elements = predict_pages_incremental(pages, model, cache, model_key, args.batch_size,
+                                             granularity=args.granularity, cascade=cascade)
+
+    log.info(f"Predicting labels in batches of {args.batch_size or 'all'} elements...")
     with open(config.PREDICTED_LAYOUT_PATH, "w", encoding="utf-8") as f:
-        for i, element in enumerate(elements):
-            element["type"] = predictions[i]
-            # Clean up for final output
-            del element["page_width"]
-            del element["page_height"]
-            del element["doc_name"]
-            f.write(json.dumps(element) + '\n')
+        for element in elements:
+            f.write(json.dumps(element.to_dict()) + '\n')
             
-    print(f"[INFO] Predictions saved to {config.PREDICTED_LAYOUT_PATH}")
+    if cascade is not None:
+        log.info(cascade.report())
+    log.info(f"Predictions saved to {config.PREDICTED_LAYOUT_PATH}")
+    cache.save(inputs, outputs)
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging(args.log_level, args.log_json)
+    with profile_run(args), stage("predict"):
+        run(args)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
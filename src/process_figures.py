@@ -0,0 +1,218 @@
+import os
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz
+
+from src import config
+from src.cache import StageCache, file_hash, json_hash
+from src.log import add_logging_args, get_logger, logging_settings, setup_logging
+from src.profiling import add_profiling_args, count, profile_run, stage, step
+
+log = get_logger("figures")
+
+# Formats every EPUB reader displays; anything else is re-encoded
+WEB_FORMATS = {"png", "jpeg", "jpg"}
+# Source formats holding photographic content, re-encoded as JPEG rather than PNG
+PHOTO_FORMATS = {"jpeg", "jpg", "jpx", "jp2"}
+# Bump when the transcoding output changes, to invalidate cached figures
+TRANSCODE_VERSION = 1
+
+
+def figure_settings(max_dimension=None, jpeg_quality=None):
+    """The transcoding settings, which are part of every cached figure's key."""
+    return {
+        "version": TRANSCODE_VERSION,
+        "max_dimension": config.FIGURE_MAX_DIMENSION if max_dimension is None else max_dimension,
+        "jpeg_quality": config.FIGURE_JPEG_QUALITY if jpeg_quality is None else jpeg_quality,
+    }
+
+
+def _opaque(pix):
+    """True if the pixmap has an alpha channel that is fully opaque everywhere."""
+    return not pix.samples_mv[pix.n - 1::pix.n].tobytes().strip(b"\xff")
+
+
+def transcode(data, ext, settings):
+    """
+    Converts one image to a web-friendly form.
+
+    The image is decoded with MuPDF, converted to RGB unless it is already
+    gray or RGB (CMYK, indexed, Lab...), stripped of an alpha channel that
+    is fully opaque, and scaled down so neither side exceeds
+    `settings["max_dimension"]` (0 disables scaling). Images that keep
+    transparency are written as PNG; photographic sources (JPEG, JPX) as
+    JPEG; everything else as PNG.
+
+    Returns:
+        (image bytes, extension, width, height), or None if the image is
+        already a web format within the size limit and is best left as-is.
+    """
+    pix = fitz.Pixmap(data)
+    changed = ext not in WEB_FORMATS
+    if pix.alpha and _opaque(pix):
+        pix = fitz.Pixmap(pix, 0)
+        changed = True
+    if pix.colorspace is None or pix.colorspace.n not in (1, 3):
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+        changed = True
+
+    max_dimension = settings["max_dimension"]
+    if max_dimension and max(pix.width, pix.height) > max_dimension:
+        scale = max_dimension / max(pix.width, pix.height)
+        pix = fitz.Pixmap(pix, max(1, round(pix.width * scale)), max(1, round(pix.height * scale)), None)
+        changed = True
+
+    if not changed:
+        return None
+    if pix.alpha or ext not in PHOTO_FORMATS:
+        return pix.tobytes("png"), "png", pix.width, pix.height
+    return pix.tobytes("jpeg", jpg_quality=settings["jpeg_quality"]), "jpeg", pix.width, pix.height
+
+
+def process_figure(src, settings, cache_dir=None):
+    """
+    Transcodes the image at `src`, reusing the result cached under its
+    content hash and the settings when there is one.
+
+    Returns:
+        A record {"source", "path", "ext", "width", "height", "cached"} where
+        "path" is the image to package: the transcoded file, or `src` itself
+        when it needed no changes or could not be decoded.
+    """
+    cache = StageCache("figures", cache_dir)
+    with open(src, "rb") as f:
+        data = f.read()
+    key = json_hash([hashlib.sha1(data).hexdigest(), settings])
+    record = cache.get_unit(key)
+    if record is not None and (record["path"] is None or os.path.exists(record["path"])):
+        return {**record, "source": src, "path": record["path"] or src, "cached": True}
+
+    ext = os.path.splitext(src)[1].lstrip(".").lower()
+    try:
+        result = transcode(data, ext, settings)
+    except Exception as e:
+        log.warning(f"Could not transcode {src}, packaging it as-is: {e}")
+        result = None
+
+    if result is None:
+        # Cached too, so unchanged images are not decoded again on the next run
+        record = {"path": None, "ext": ext, "width": None, "height": None, "bytes": len(data)}
+    else:
+        out_bytes, out_ext, width, height = result
+        out_path = cache.unit_path(key, f".{out_ext}")
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = out_path.with_name(f"{out_path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(out_bytes)
+        os.replace(tmp_path, out_path)
+        record = {"path": str(out_path), "ext": out_ext, "width": width, "height": height, "bytes": len(out_bytes)}
+    cache.put_unit(key, record)
+    return {**record, "source": src, "path": record["path"] or src, "source_bytes": len(data), "cached": False}
+
+
+def _process_in_worker(args):
+    return process_figure(*args)
+
+
+def figure_sources(sections):
+    """The image paths the figures of `sections` (AST chapters) refer to, in order."""
+    return [element["src"] for section in sections for element in section.get("elements", [])
+            if element.get("type") == "figure" and element.get("src")]
+
+
+def process_figures(paths, workers=None, settings=None, cache_dir=None):
+    """
+    Transcodes every distinct image in `paths` (see `process_figure`).
+
+    With `workers` > 1 the images are processed across a process pool, as
+    MuPDF holds the GIL while decoding and encoding.
+
+    Returns:
+        {source path: record} for each image.
+    """
+    if workers is None:
+        workers = config.FIGURE_WORKERS
+    if settings is None:
+        settings = figure_settings()
+    paths = list(dict.fromkeys(p for p in paths if p and os.path.exists(p)))
+    tasks = [(path, settings, cache_dir) for path in paths]
+
+    with step("transcode"):
+        if workers > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=setup_logging, initargs=logging_settings()) as executor:
+                records = list(executor.map(_process_in_worker, tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+        else:
+            records = [process_figure(*task) for task in tasks]
+
+    cached = sum(record["cached"] for record in records)
+    transcoded = sum(record["path"] != record["source"] for record in records)
+    fresh = [record for record in records if not record["cached"]]
+    saved = sum(record["source_bytes"] - record["bytes"] for record in fresh if record["path"] != record["source"])
+    log.info(f"Processed {len(records)} images ({cached} from cache, {transcoded} transcoded); "
+             f"{saved / 1e6:.1f} MB saved on newly transcoded images.")
+    count("figures", images=len(records), cached=cached, transcoded=transcoded)
+    return {record["source"]: record for record in records}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Downscale and re-encode extracted images for packaging.")
+    parser.add_argument("--workers", type=int, default=config.FIGURE_WORKERS,
+                        help="Worker processes for image transcoding (1 = serial).")
+    parser.add_argument("--max-dimension", type=int, default=config.FIGURE_MAX_DIMENSION,
+                        help="Longest side of a packaged image in pixels (0 = keep the original size).")
+    parser.add_argument("--jpeg-quality", type=int, default=config.FIGURE_JPEG_QUALITY,
+                        help="Quality of re-encoded JPEG images (1-100).")
+    parser.add_argument("--force", action="store_true", help="Rebuild the figure map even if the AST is unchanged.")
+    add_logging_args(parser)
+    add_profiling_args(parser)
+    return parser.parse_args(argv)
+
+
+def missing_figure_files(path):
+    """The packaged image paths in the figure map at `path` that no longer exist."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            figures = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return []
+    return [record["path"] for record in figures.values() if not os.path.exists(record["path"])]
+
+
+def run(args):
+    settings = figure_settings(args.max_dimension, args.jpeg_quality)
+    cache = StageCache("figures")
+    inputs = {
+        "ast": file_hash(config.AST_PATH),
+        "settings": settings,
+    }
+    outputs = [config.FIGURES_PATH]
+    # The transcoded files live in the cache directory and can be deleted without the map
+    missing = missing_figure_files(config.FIGURES_PATH)
+    if missing:
+        log.info(f"{len(missing)} images in {config.FIGURES_PATH} are missing; rebuilding the figure map.")
+    if cache.skip_if_fresh(inputs, outputs, force=args.force or bool(missing)):
+        return
+
+    # Only the images that figures in the book refer to are transcoded
+    with open(config.AST_PATH, "r", encoding="utf-8") as f:
+        ast = json.load(f)
+    paths = figure_sources(section for kind in ("frontmatter", "chapters", "backmatter") for section in ast[kind])
+    figures = process_figures(paths, workers=max(1, args.workers), settings=settings)
+    with open(config.FIGURES_PATH, "w", encoding="utf-8") as f:
+        json.dump(figures, f, ensure_ascii=False, indent=2)
+    log.info(f"Saved figure map to {config.FIGURES_PATH}")
+    cache.save(inputs, outputs)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging(args.log_level, args.log_json)
+    with profile_run(args), stage("figures"):
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import resource
+import threading
+from contextlib import contextmanager
+
+# The profiler instrumented code reports to; None means profiling is off and
+# step()/count() cost a single global lookup.
+_active = None
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if os.uname().sysname == "Darwin" else 1024), 1)
+
+
+_PAGE_MB = os.sysconf("SC_PAGE_SIZE") / (1024 * 1024) if hasattr(os, "sysconf") else 0.0
+
+
+def _rss_mb():
+    """Current resident memory of the process, or None where /proc is not available (macOS)."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_MB
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class Profiler:
+    """
+    Records wall time, CPU time, resident memory growth and item counts per
+    pipeline stage, plus the time spent in named sub-steps of each stage.
+
+    A stage may be entered many times (for example once per page pulled
+    through a generator); its figures are accumulated. When a stage is
+    entered while another is active (a prediction generator pulling pages
+    from extraction), the inner stage's time is subtracted from the outer
+    one, so each stage reports only its own work. Steps are attributed to
+    the innermost active stage and do not affect stage totals.
+
+    A stage's "rss_delta_mb" is the change in the process's resident memory
+    over its entries, less that of the stages nested in it: memory the
+    stage left allocated (negative if it freed more than it took). The
+    process-wide peak is reported once, as the top-level "peak_rss_mb";
+    the high-water mark cannot be split by stage, as every stage after the
+    largest one would report the same figure. Memory is only read where
+    /proc is available (Linux); elsewhere the deltas stay 0.
+
+    Only work done in this process is measured; pages extracted or chapters
+    rendered by worker processes show up as time in the waiting stage.
+    """
+
+    # Stop recording individual trace events beyond this many (aggregates are unaffected)
+    MAX_TRACE_EVENTS = 200_000
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.steps = {}
+        self.events = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def _region(self, kind, name):
+        stack = self._stack()
+        frame = {"kind": kind, "name": name, "child_wall": 0.0, "child_cpu": 0.0}
+        if kind == "step":
+            stage = next((f["name"] for f in reversed(stack) if f["kind"] == "stage"), None)
+            frame["key"] = f"{stage}.{name}" if stage else name
+        else:
+            frame["child_rss"] = 0.0
+            frame["rss_start"] = _rss_mb()
+        stack.append(frame)
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.thread_time() - cpu_start
+            stack.pop()
+            with self._lock:
+                if kind == "stage":
+                    # Hand this stage's time to the enclosing stage so it can exclude it
+                    rss_end = _rss_mb()
+                    rss = rss_end - frame["rss_start"] if rss_end is not None and frame["rss_start"] is not None else 0.0
+                    parent = next((f for f in reversed(stack) if f["kind"] == "stage"), None)
+                    if parent is not None:
+                        parent["child_wall"] += wall
+                        parent["child_cpu"] += cpu
+                        parent["child_rss"] += rss
+                    record = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0, "rss_delta_mb": 0.0, "counts": {}})
+                    record["wall"] += wall - frame["child_wall"]
+                    record["cpu"] += cpu - frame["child_cpu"]
+                    record["rss_delta_mb"] += rss - frame["child_rss"]
+                else:
+                    record = self.steps.setdefault(frame["key"], {"wall": 0.0, "cpu": 0.0, "calls": 0})
+                    record["wall"] += wall
+                    record["cpu"] += cpu
+                record["calls"] += 1
+                if len(self.events) < self.MAX_TRACE_EVENTS:
+                    self.events.append({
+                        "name": name,
+                        "cat": kind,
+                        "ph": "X",
+                        "ts": round((wall_start - self.started) * 1e6, 1),
+                        "dur": round(wall * 1e6, 1),
+                        "pid": os.getpid(),
+                        "tid": threading.get_ident(),
+                    })
+
+    def stage(self, name):
+        """Context manager timing one entry into a pipeline stage."""
+        return self._region("stage", name)
+
+    def step(self, name):
+        """Context manager timing a named sub-step of the current stage."""
+        return self._region("step", name)
+
+    def iterate(self, name, iterable):
+        """Yields from `iterable`, counting the time spent producing each item as stage `name`."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, stage, **items):
+        with self._lock:
+            record = self.stages.setdefault(stage, {"wall": 0.0, "cpu": 0.0, "calls": 0, "rss_delta_mb": 0.0, "counts": {}})
+            for key, value in items.items():
+                record["counts"][key] = record["counts"].get(key, 0) + value
+
+    def to_dict(self):
+        def rounded(record):
+            return {k: round(v, 6) if isinstance(v, float) else v for k, v in record.items()}
+        return {
+            "wall_seconds": round(time.perf_counter() - self.started, 6),
+            "peak_rss_mb": _peak_rss_mb(),
+            "stages": {name: rounded(record) for name, record in self.stages.items()},
+            "steps": {name: rounded(record) for name, record in self.steps.items()},
+        }
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def write_trace(self, path):
+        """
+        Writes the recorded regions in Chrome trace-event format, which
+        chrome://tracing, Perfetto and speedscope display as a flame graph.
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+
+def active_profiler():
+    return _active
+
+
+@contextmanager
+def profiling(profiler):
+    """Makes `profiler` the target of step()/count() calls within the block."""
+    global _active
+    previous, _active = _active, profiler
+    try:
+        yield profiler
+    finally:
+        _active = previous
+
+
+@contextmanager
+def _noop():
+    yield
+
+
+def stage(name):
+    return _active.stage(name) if _active is not None else _noop()
+
+
+def step(name):
+    return _active.step(name) if _active is not None else _noop()
+
+
+def count(stage_name, **items):
+    if _active is not None:
+        _active.count(stage_name, **items)
+
+
+def add_profiling_args(parser):
+    """Adds the shared --profile/--trace options to a stage's CLI."""
+    parser.add_argument("--profile", metavar="PATH", default=None,
+                        help="Write per-stage timing, CPU, memory and item counts as JSON.")
+    parser.add_argument("--trace", metavar="PATH", default=None,
+                        help="Write a Chrome trace-event file (flame graph in Perfetto/speedscope).")
+
+
+@contextmanager
+def profile_run(args):
+    """
+    Profiles a CLI run when --profile or --trace was given, writing the
+    requested files when the block exits.
+    """
+    if not (getattr(args, "profile", None) or getattr(args, "trace", None)):
+        yield None
+        return
+    profiler = Profiler()
+    with profiling(profiler):
+        try:
+            yield profiler
+        finally:
+            if args.profile:
+                profiler.write_json(args.profile)
+            if args.trace:
+                profiler.write_trace(args.trace)
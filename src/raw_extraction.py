@@ -0,0 +1,283 @@
+import os
+import json
+import shutil
+from array import array
+from pathlib import Path
+
+from src.furniture import FurnitureIndex
+
+# NumPy is imported where the columns are read or written, so stages that
+# only need the page count (meta.json) do not pay for importing it
+
+# Bump when the on-disk layout changes
+FORMAT_VERSION = 2
+
+# Column files, one per text-run attribute (n = number of runs in the document)
+RUN_COLUMNS = {
+    "bbox": "<f8",   # (n, 4) x0, y0, x1, y1
+    "size": "<f8",   # (n,) font size
+    "font": "<i4",   # (n,) index into fonts.json
+    "flags": "<i4",  # (n,) PyMuPDF span flags
+    "block": "<i4",  # (n,) block index within the page
+    "line": "<i4",   # (n,) line index within the block
+    "furniture": "|b1",  # (n,) repeated running header/footer/page number (see src/furniture.py)
+}
+
+PAGE_DTYPE = [
+    ("number", "<i4"),
+    ("width", "<f8"),
+    ("height", "<f8"),
+    ("rotation", "<i4"),
+]
+
+
+class RawExtractionWriter:
+    """
+    Writes extracted pages to the columnar raw-extraction format.
+
+    The output is a directory holding one .npy file per text-run attribute
+    (see RUN_COLUMNS), font names interned in fonts.json, all run texts as a
+    single UTF-8 blob (text.bin) with byte offsets (text_offsets.npy), a
+    page table (pages.npy) with each page's first run in run_offsets.npy,
+    and the per-page image records in images.json. Texts are streamed to
+    disk as pages are added; the numeric columns are buffered as compact
+    arrays and written by `close()`.
+
+    Runs are also indexed across pages as they are added (see
+    `furniture.FurnitureIndex`), and `close()` writes the furniture column
+    flagging those that repeat as page furniture, now that every page is
+    known. Repeated images get "furniture": true in images.json.
+
+    Pages are written into a sibling ".part" directory that replaces `path`
+    only once complete, so readers never see a half-written extraction.
+
+    Usage:
+        with RawExtractionWriter(path) as writer:
+            for page_data in pages:
+                writer.add_page(page_data)
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.part_path = self.path.with_name(self.path.name + ".part")
+        shutil.rmtree(self.part_path, ignore_errors=True)
+        self.part_path.mkdir(parents=True)
+
+        self._text = open(self.part_path / "text.bin", "wb")
+        self._text_offsets = array("q", [0])
+        self._run_offsets = array("q", [0])
+        self._columns = {"bbox": array("d"), "size": array("d"), "font": array("i"),
+                         "flags": array("i"), "block": array("i"), "line": array("i"),
+                         "furniture": array("i")}  # Key ids until close() resolves them to flags
+        self._font_ids = {}
+        self._furniture = FurnitureIndex()
+        self._furniture_keys = {}  # furniture key -> id in the _columns["furniture"] key column
+        self._pages = []
+        self._images = []
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._text.close()
+            self._closed = True
+            shutil.rmtree(self.part_path, ignore_errors=True)
+
+    def add_page(self, page_data):
+        """Appends one page record as produced by `ingest_extract.extract_page`."""
+        meta = page_data["meta"]
+        self._pages.append((meta["number"], meta["width"], meta["height"], meta.get("rotation", 0)))
+        self._images.append([dict(image) for image in page_data.get("images", [])])
+
+        columns = self._columns
+        key_ids = self._furniture_keys
+        columns["furniture"].extend(-1 if key is None else key_ids.setdefault(key, len(key_ids))
+                                    for key in self._furniture.add_page(page_data))
+        offset = self._text_offsets[-1]
+        for run in page_data.get("text_runs", []):
+            encoded = run["text"].encode("utf-8")
+            self._text.write(encoded)
+            offset += len(encoded)
+            self._text_offsets.append(offset)
+            columns["bbox"].extend(run["bbox"])
+            columns["size"].append(run["size"])
+            columns["font"].append(self._font_ids.setdefault(run["font"], len(self._font_ids)))
+            columns["flags"].append(run.get("flags", 0))
+            columns["block"].append(run.get("block", -1))
+            columns["line"].append(run.get("line", -1))
+        self._run_offsets.append(len(self._text_offsets) - 1)
+
+    def close(self):
+        """Writes the columns and page index and moves the directory into place."""
+        import numpy as np
+
+        if self._closed:
+            return
+        self._closed = True
+        self._text.close()
+        part = self.part_path
+        # Resolve each run's furniture key id to a flag, now that every page has been counted;
+        # id -1 (no key) indexes the trailing False
+        is_furniture = np.array([self._furniture.is_furniture(key) for key in self._furniture_keys] + [False])
+        self._columns["furniture"] = is_furniture[np.array(self._columns["furniture"], dtype=np.int64)]
+        for images in self._images:
+            self._furniture.tag_images(images)
+        for name, values in self._columns.items():
+            column = np.frombuffer(values, dtype=RUN_COLUMNS[name]) if len(values) else np.zeros(0, RUN_COLUMNS[name])
+            np.save(part / f"{name}.npy", column.reshape(-1, 4) if name == "bbox" else column)
+        np.save(part / "text_offsets.npy", np.frombuffer(self._text_offsets, dtype=np.int64))
+        np.save(part / "run_offsets.npy", np.frombuffer(self._run_offsets, dtype=np.int64))
+        np.save(part / "pages.npy", np.array(self._pages, dtype=PAGE_DTYPE))
+        with open(part / "fonts.json", "w", encoding="utf-8") as f:
+            json.dump(list(self._font_ids), f, ensure_ascii=False)
+        with open(part / "images.json", "w", encoding="utf-8") as f:
+            json.dump(self._images, f, ensure_ascii=False)
+        with open(part / "meta.json", "w", encoding="utf-8") as f:
+            json.dump({
+                "version": FORMAT_VERSION,
+                "pages": len(self._pages),
+                "runs": len(self._text_offsets) - 1,
+            }, f)
+
+        shutil.rmtree(self.path, ignore_errors=True)
+        if self.path.exists():
+            self.path.unlink()  # A JSONL file from before the columnar format
+        os.replace(part, self.path)
+
+
+class RawExtraction:
+    """
+    Read access to a columnar raw extraction.
+
+    Columns are memory-mapped and opened on first use, so a stage only
+    reads the files it touches: counting pages reads meta.json alone, and
+    `page(i)` reads just that page's slice of each column.
+    """
+
+    def __init__(self, path, mmap=True):
+        self.path = Path(path)
+        self._mmap_mode = "r" if mmap else None
+        self._cache = {}
+        with open(self.path / "meta.json", "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported raw extraction format {self.meta.get('version')} in {self.path}; "
+                             f"re-run ingest_extract.")
+
+    @property
+    def page_count(self):
+        return self.meta["pages"]
+
+    @property
+    def run_count(self):
+        return self.meta["runs"]
+
+    def __len__(self):
+        return self.page_count
+
+    def column(self, name):
+        """One run column (see RUN_COLUMNS), or "text_offsets" / "run_offsets" / "pages"."""
+        if name not in self._cache:
+            import numpy as np
+            self._cache[name] = np.load(self.path / f"{name}.npy", mmap_mode=self._mmap_mode)
+        return self._cache[name]
+
+    def _json(self, name):
+        if name not in self._cache:
+            with open(self.path / f"{name}.json", "r", encoding="utf-8") as f:
+                self._cache[name] = json.load(f)
+        return self._cache[name]
+
+    @property
+    def fonts(self):
+        return self._json("fonts")
+
+    @property
+    def images(self):
+        """The image records of every page, as a list per page."""
+        return self._json("images")
+
+    def _text_blob(self):
+        if "text" not in self._cache:
+            import numpy as np
+            size = os.path.getsize(self.path / "text.bin")
+            self._cache["text"] = (np.memmap(self.path / "text.bin", dtype=np.uint8, mode="r")
+                                   if size and self._mmap_mode else np.fromfile(self.path / "text.bin", dtype=np.uint8))
+        return self._cache["text"]
+
+    def texts(self, start, end):
+        """Texts of runs start..end-1, decoded from one slice of the blob."""
+        offsets = self.column("text_offsets")[start:end + 1]
+        if end <= start:
+            return []
+        data = self._text_blob()[offsets[0]:offsets[-1]].tobytes()
+        relative = (offsets - offsets[0]).tolist()
+        return [data[a:b].decode("utf-8") for a, b in zip(relative, relative[1:])]
+
+    def char_counts(self):
+        """
+        The number of characters in each run, equal to `len()` of its text,
+        counted on the UTF-8 blob without decoding it: every byte except a
+        continuation byte (0b10xxxxxx) starts a character.
+        """
+        import numpy as np
+        offsets = np.asarray(self.column("text_offsets"))
+        # A trailing non-start byte lets runs that end the blob (or are empty there) be indexed
+        starts = np.append((self._text_blob() & 0xC0) != 0x80, False)
+        counts = np.add.reduceat(starts, offsets[:-1], dtype=np.int64) if len(offsets) > 1 else np.zeros(0, np.int64)
+        # reduceat yields the element at the index, not 0, for empty runs
+        counts[offsets[:-1] == offsets[1:]] = 0
+        return counts
+
+    def page_runs(self, index):
+        """The (start, end) run indices of page `index` (0-based)."""
+        offsets = self.column("run_offsets")
+        return int(offsets[index]), int(offsets[index + 1])
+
+    def page(self, index):
+        """
+        Page `index` (0-based) as the record `ingest_extract.extract_page`
+        produced, so consumers of the old JSONL records work unchanged.
+        """
+        number, width, height, rotation = self.column("pages")[index].tolist()
+        start, end = self.page_runs(index)
+        fonts = self.fonts
+        columns = {name: self.column(name)[start:end].tolist() for name in RUN_COLUMNS if name != "furniture"}
+        runs = [
+            {
+                "text": text,
+                "font": fonts[font],
+                "size": size,
+                "flags": flags,
+                "bbox": bbox,
+                "block": block,
+                "line": line,
+            }
+            for text, font, size, flags, bbox, block, line in zip(
+                self.texts(start, end), columns["font"], columns["size"], columns["flags"],
+                columns["bbox"], columns["block"], columns["line"],
+            )
+        ]
+        for run, furniture in zip(runs, self.column("furniture")[start:end].tolist()):
+            if furniture:
+                run["furniture"] = True
+        return {
+            "type": "page",
+            "meta": {"number": number, "width": width, "height": height, "rotation": rotation},
+            "text_runs": runs,
+            "images": self.images[index],
+        }
+
+    def pages(self):
+        for index in range(self.page_count):
+            yield self.page(index)
+
+    __iter__ = pages
+
+
+def is_columnar(path):
+    return (Path(path) / "meta.json").is_file()
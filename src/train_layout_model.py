@@ -1,16 +1,44 @@
+import os
 import json
+import time
+import argparse
 import pandas as pd
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import GridSearchCV, GroupKFold, ParameterGrid, train_test_split
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import classification_report
+from sklearn.metrics import accuracy_score, classification_report
+from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import StandardScaler
 import joblib
 import numpy as np
 
-from features import featurize
+from src import features
+from src.features import FONT_FEATURE_COLUMNS, featurize
 from src import config
+from src.cache import StageCache, file_hash, json_hash
+from src.log import add_logging_args, get_logger, setup_logging
+from src.predict_layout import load_model
+
+log = get_logger("train")
+
+# Hyperparameters tried by --search
+SEARCH_GRID = {
+    "classifier__n_estimators": [50, 100, 200],
+    "classifier__max_depth": [None, 30, 15],
+    "classifier__min_samples_leaf": [1, 2],
+}
+
+# Optional per-element fields of the labeled data that are carried into training
+FONT_FIELDS = ["font", "size", "bold", "spans"]
 
 def load_and_flatten_data(path):
+    """
+    Flattens the labeled documents into one dict per element.
+
+    Font fields ("font", "size", "bold", "spans") and the element's
+    "granularity" ("span", "line" or "block", default "span") are carried
+    over when the labeled data has them; the font features are only used
+    when every element has a "size" (see `features.featurize`).
+    """
     with open(path, "r", encoding="utf-8") as f:
         data = json.load(f)
     
@@ -28,17 +56,143 @@ def load_and_flatten_data(path):
                     "bbox": element["bbox"],
                     "page_width": page_width,
                     "page_height": page_height,
-                    "doc_name": doc_name
+                    "doc_name": doc_name,
+                    "granularity": element.get("granularity", "span"),
                 }
+                for field in FONT_FIELDS:
+                    if field in element:
+                        element_data[field] = element[field]
                 all_elements.append(element_data)
     return all_elements
 
-def main():
-    print("[INFO] Loading and flattening data...")
-    elements = load_and_flatten_data(config.LABELED_DATA_PATH)
-    
-    print("[INFO] Generating features...")
+def load_training_matrix(path, force=False):
+    """
+    Returns the featurized labeled data: the feature columns plus "label",
+    "doc_name" and "granularity".
+
+    The matrix is cached under `config.CACHE_DIR/train/`, keyed by the hash
+    of the labeled data and of the loader's and featurizer's source, so retraining on an
+    unchanged corpus skips parsing and featurization.
+    """
+    cache = StageCache("train")
+    key = json_hash([file_hash(path), file_hash(features.__file__), file_hash(__file__)])
+    cache_path = cache.unit_path(key, suffix=".pkl")
+    if not force and cache_path.exists():
+        log.info(f"Labeled data unchanged, loading features from {cache_path}")
+        return pd.read_pickle(cache_path)
+
+    log.info("Loading and flattening data...")
+    elements = load_and_flatten_data(path)
+
+    log.info("Generating features...")
     df = featurize(elements)
+    df["doc_name"] = [el["doc_name"] for el in elements]
+    df["granularity"] = [el["granularity"] for el in elements]
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    df.to_pickle(tmp_path)
+    os.replace(tmp_path, cache_path)
+    return df
+
+def build_pipeline(n_estimators=100, max_depth=None, n_jobs=None, **forest_params):
+    """The scaler and classifier as one estimator, saved and loaded as a single artifact."""
+    return Pipeline([
+        ("scaler", StandardScaler()),
+        ("classifier", RandomForestClassifier(
+            n_estimators=n_estimators,
+            max_depth=max_depth,
+            n_jobs=n_jobs,
+            random_state=42,
+            class_weight='balanced',
+            **forest_params,
+        )),
+    ])
+
+def search_hyperparameters(X, y, groups, n_jobs=-1, folds=5):
+    """
+    Grid-searches SEARCH_GRID with cross-validation grouped by document, so
+    no document contributes to both the training and validation folds.
+
+    Candidates are fitted in parallel (each forest single-threaded, to
+    avoid oversubscribing the cores), and each one's fit time, predict time
+    and accuracy are logged.
+
+    Returns:
+        The best parameters, or None when there are fewer than two documents
+        to group by.
+    """
+    n_groups = groups.nunique()
+    if n_groups < 2:
+        log.warning("Hyperparameter search needs labeled data from at least two documents; skipping it.")
+        return None
+    folds = min(folds, n_groups)
+    search = GridSearchCV(
+        build_pipeline(n_jobs=1),
+        SEARCH_GRID,
+        cv=GroupKFold(n_splits=folds),
+        scoring="accuracy",
+        n_jobs=n_jobs,
+        refit=False,
+    )
+    log.info(f"Searching {len(ParameterGrid(SEARCH_GRID))} candidates with {folds}-fold grouped CV...")
+    start = time.perf_counter()
+    search.fit(X, y, groups=groups)
+    log.info(f"Search finished in {time.perf_counter() - start:.1f}s")
+
+    results = pd.DataFrame(search.cv_results_).sort_values("rank_test_score")
+    for _, row in results.iterrows():
+        params = ", ".join(f"{name.split('__', 1)[1]}={value}" for name, value in row["params"].items())
+        log.info(
+            f"  #{row['rank_test_score']:<3} accuracy={row['mean_test_score']:.4f} (+/-{row['std_test_score']:.4f}) "
+            f"fit={row['mean_fit_time']:.2f}s predict={row['mean_score_time']:.3f}s  {params}"
+        )
+    return search.best_params_
+
+def artifact_report(path, sample, n_jobs=None, rows=10000):
+    """
+    Measures what the saved model costs at prediction time: artifact size,
+    load time (regular and memory-mapped) and latency per `rows` elements.
+    """
+    report = {"size_mb": round(os.path.getsize(path) / (1024 * 1024), 2)}
+    for label, mmap in (("load_seconds", False), ("load_seconds_mmap", True)):
+        start = time.perf_counter()
+        model = load_model(path, mmap=mmap, n_jobs=n_jobs)
+        report[label] = round(time.perf_counter() - start, 4)
+
+    # Repeat the held-out rows up to a fixed size so latency is comparable across datasets
+    batch = sample.iloc[np.resize(np.arange(len(sample)), rows)]
+    model.predict(batch.iloc[:100])  # Warm up thread pools
+    start = time.perf_counter()
+    model.predict(batch)
+    report[f"predict_seconds_per_{rows // 1000}k"] = round(time.perf_counter() - start, 4)
+    classifier = model[-1]
+    if hasattr(classifier, "estimators_"):
+        report["trees"] = len(classifier.estimators_)
+        report["nodes"] = int(sum(tree.tree_.node_count for tree in classifier.estimators_))
+    return report
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Train the layout classifier on labeled document data.")
+    parser.add_argument("--n-estimators", type=int, default=100,
+                        help="Trees in the forest; fewer trees load and predict faster.")
+    parser.add_argument("--max-depth", type=int, default=None,
+                        help="Maximum tree depth (default: unlimited); shallower trees are smaller and faster.")
+    parser.add_argument("--n-jobs", type=int, default=config.PREDICTION_N_JOBS,
+                        help="Threads the saved model uses for prediction (-1 = all cores).")
+    parser.add_argument("--train-jobs", type=int, default=config.TRAINING_N_JOBS,
+                        help="Cores used for fitting and for the hyperparameter search (-1 = all cores).")
+    parser.add_argument("--search", action="store_true",
+                        help="Grid-search the forest's hyperparameters with cross-validation grouped by document.")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-featurize the labeled data even if a cached matrix exists.")
+    add_logging_args(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging(args.log_level, args.log_json)
+    df = load_training_matrix(config.LABELED_DATA_PATH, force=args.force)
     
     # Exclude rare classes for more stable training
     label_counts = df['label'].value_counts()
@@ -46,38 +200,58 @@ def main():
     df = df[df['label'].isin(to_keep)]
     
     if df.empty:
-        print("[ERROR] No data left after filtering rare classes. Aborting.")
+        log.error("No data left after filtering rare classes. Aborting.")
         return
 
-    print(f"[INFO] Training on {len(df)} samples.")
-    print(f"[INFO] Label distribution:\n{df['label'].value_counts()}")
+    log.info(f"Training on {len(df)} samples.")
+    log.info(f"Label distribution:\n{df['label'].value_counts()}")
+
+    if not set(FONT_FEATURE_COLUMNS).issubset(df.columns):
+        log.warning("The labeled data has no font size on some elements; training without the font features "
+                    f"({', '.join(FONT_FEATURE_COLUMNS)}).")
+    # Elements are classified best at the granularity the model was trained on
+    granularity = df["granularity"].mode().iloc[0]
+    if df["granularity"].nunique() > 1:
+        log.warning(f"The labeled data mixes granularities; recording the most common, {granularity!r}.")
 
-    X = df.drop("label", axis=1)
+    X = df.drop(["label", "doc_name", "granularity"], axis=1)
     y = df["label"]
     
     # Split data
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.25, random_state=42, stratify=y
+    X_train, X_test, y_train, y_test, groups_train, _ = train_test_split(
+        X, y, df["doc_name"], test_size=0.25, random_state=42, stratify=y
     )
+
+    params = {"n_estimators": args.n_estimators, "max_depth": args.max_depth}
+    if args.search:
+        best = search_hyperparameters(X_train, y_train, groups_train, n_jobs=args.train_jobs)
+        if best:
+            params = {name.split("__", 1)[1]: value for name, value in best.items()}
+            log.info(f"Best parameters: {params}")
     
-    # Scale features
-    scaler = StandardScaler()
-    X_train_scaled = scaler.fit_transform(X_train)
-    X_test_scaled = scaler.transform(X_test)
-    
-    print("[INFO] Training RandomForestClassifier...")
-    model = RandomForestClassifier(n_estimators=100, random_state=42, class_weight='balanced')
-    model.fit(X_train_scaled, y_train)
+    # Scaling is the pipeline's first step, so the saved artifact takes raw features
+    log.info("Training RandomForestClassifier...")
+    start = time.perf_counter()
+    model = build_pipeline(n_jobs=args.train_jobs, **params)
+    model.fit(X_train, y_train)
+    log.info(f"Fitted {model[-1].n_estimators} trees in {time.perf_counter() - start:.2f}s")
+    # Prediction runs with its own thread setting, stored with the model
+    model.set_params(classifier__n_jobs=args.n_jobs)
+    model.training_granularity = granularity
     
-    print("[INFO] Evaluating model...")
-    y_pred = model.predict(X_test_scaled)
-    print(classification_report(y_test, y_pred))
+    log.info("Evaluating model...")
+    y_pred = model.predict(X_test)
+    log.info(f"Classification report:\n{classification_report(y_test, y_pred)}")
     
-    print(f"[INFO] Saving model to {config.MODEL_OUTPUT_PATH}")
-    joblib.dump(model, config.MODEL_OUTPUT_PATH)
-    joblib.dump(scaler, config.SCALER_OUTPUT_PATH)
+    log.info(f"Saving model to {config.LAYOUT_MODEL_PATH}")
+    # Uncompressed, so the tree arrays can be memory-mapped on load
+    joblib.dump(model, config.LAYOUT_MODEL_PATH)
+
+    report = artifact_report(config.LAYOUT_MODEL_PATH, X_test, n_jobs=args.n_jobs)
+    report["accuracy"] = round(accuracy_score(y_test, y_pred), 4)
+    log.info("Model report: " + ", ".join(f"{key}={value}" for key, value in report.items()))
     
-    print("[INFO] Training complete.")
+    log.info("Training complete.")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,21 @@
+"""
+Import-time budgets of the CLI entry points, as checked by
+`benchmarks/import_time.py`. Set IMPORT_TIME_SCALE to loosen the time
+budgets on a slower machine; the forbidden-import checks always apply.
+
+    python -m pytest tests
+"""
+import os
+
+import pytest
+
+from benchmarks.import_time import BUDGETS, check
+
+SCALE = float(os.environ.get("IMPORT_TIME_SCALE", "1"))
+
+
+@pytest.mark.parametrize("module", list(BUDGETS))
+def test_import_budget(module):
+    result, = check([module], scale=SCALE)
+    assert not result["forbidden_imports"], f"{module} imports {', '.join(result['forbidden_imports'])} at startup"
+    assert result["ms"] <= result["budget_ms"], f"{module} took {result['ms']} ms (budget {result['budget_ms']} ms)"